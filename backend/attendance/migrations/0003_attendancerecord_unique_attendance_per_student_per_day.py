@@ -0,0 +1,31 @@
+from django.db import migrations, models
+from django.db.models import Count, Max
+
+
+def remove_duplicate_records(apps, schema_editor):
+    # Keep the most recently written record for each student and day
+    AttendanceRecord = apps.get_model('attendance', 'AttendanceRecord')
+    duplicates = (
+        AttendanceRecord.objects.values('student', 'date')
+        .annotate(count=Count('id'), keep_id=Max('id'))
+        .filter(count__gt=1)
+    )
+    for duplicate in duplicates.iterator():
+        AttendanceRecord.objects.filter(student=duplicate['student'], date=duplicate['date']).exclude(
+            id=duplicate['keep_id']
+        ).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('attendance', '0002_alter_attendancerecord_student'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_records, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='attendancerecord',
+            constraint=models.UniqueConstraint(fields=('student', 'date'), name='unique_attendance_per_student_per_day'),
+        ),
+    ]
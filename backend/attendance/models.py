@@ -27,6 +27,12 @@ class AttendanceRecord(models.Model):
     timestamp = models.DateTimeField(auto_now_add=True)
     note = models.TextField(blank=True, null=True)
 
+    class Meta:
+        # One record per student per day; also the index attendance lookups use
+        constraints = [
+            models.UniqueConstraint(fields=['student', 'date'], name='unique_attendance_per_student_per_day'),
+        ]
+
     def __str__(self):
         return f"{self.student.username} - {self.date} - {self.status}"
     
\ No newline at end of file
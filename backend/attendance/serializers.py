@@ -5,3 +5,9 @@ class AttendanceRecordSerializer(serializers.ModelSerializer):
     class Meta:
         model = AttendanceRecord
         fields = '__all__'
+
+
+class AttendanceRecordUpsertSerializer(AttendanceRecordSerializer):
+    """Manual entry: a record for a student and day that is already marked replaces it instead of being rejected."""
+    class Meta(AttendanceRecordSerializer.Meta):
+        validators = []
@@ -1,3 +1,88 @@
-from django.test import TestCase
+from datetime import date
+from importlib import import_module
+from django.apps import apps
+from django.db import connection, migrations
+from django.db.migrations.state import ProjectState
+from django.test import TestCase, TransactionTestCase
+from rest_framework.test import APIClient
+from school_data.models import StudentProfile
+from users.models import CustomUser
+from .models import AttendanceRecord
+from .utils import upsert_attendance_records
 
-# Create your tests here.
+dedup_migration = import_module('attendance.migrations.0003_attendancerecord_unique_attendance_per_student_per_day')
+
+
+def create_student(username):
+    return StudentProfile.objects.create(user=CustomUser.objects.create(username=username, role='student'))
+
+
+class RemoveDuplicateRecordsMigrationTests(TransactionTestCase):
+    def setUp(self):
+        # Put the table back to how it was before 0003 added the unique constraint
+        self.migrated_state = ProjectState.from_apps(apps)
+        self.state = self.migrated_state.clone()
+        operation = migrations.RemoveConstraint('attendancerecord', 'unique_attendance_per_student_per_day')
+        operation.state_forwards('attendance', self.state)
+        with connection.schema_editor() as editor:
+            operation.database_forwards('attendance', editor, self.migrated_state, self.state)
+
+    def test_keeps_latest_record_per_student_and_day(self):
+        student, other = create_student('student'), create_student('other')
+        day = date(2024, 9, 2)
+        AttendanceRecord.objects.create(student=student, date=day, status='absent')
+        latest = AttendanceRecord.objects.create(student=student, date=day, status='present')
+        next_day = AttendanceRecord.objects.create(student=student, date=date(2024, 9, 3), status='late')
+        others = AttendanceRecord.objects.create(student=other, date=day, status='absent')
+        AttendanceRecord.objects.create(student=student, date=day, status='absent').delete()
+
+        with connection.schema_editor() as editor:
+            for operation in dedup_migration.Migration.operations:
+                operation.database_forwards('attendance', editor, self.state, self.migrated_state)
+
+        self.assertQuerySetEqual(
+            AttendanceRecord.objects.order_by('pk'), [latest.pk, next_day.pk, others.pk], transform=lambda record: record.pk
+        )
+        self.assertEqual(AttendanceRecord.objects.get(pk=latest.pk).status, 'present')
+
+
+class UpsertAttendanceRecordsTests(TestCase):
+    def setUp(self):
+        self.student = create_student('student')
+        self.day = date(2024, 9, 2)
+        self.existing = AttendanceRecord.objects.create(student=self.student, date=self.day, status='present', note='roll call')
+
+    def test_without_overwrite_first_mark_wins(self):
+        upsert_attendance_records([AttendanceRecord(student=self.student, date=self.day, status='late')], overwrite=False)
+        record = AttendanceRecord.objects.get(student=self.student, date=self.day)
+        self.assertEqual((record.pk, record.status, record.note), (self.existing.pk, 'present', 'roll call'))
+
+    def test_overwrite_replaces_status(self):
+        upsert_attendance_records([AttendanceRecord(student=self.student, date=self.day, status='absent', note=None)])
+        record = AttendanceRecord.objects.get(student=self.student, date=self.day)
+        self.assertEqual((record.pk, record.status, record.note), (self.existing.pk, 'absent', None))
+
+
+class AttendanceRecordCreateTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(CustomUser.objects.create(username='teacher', role='teacher'))
+        self.students = [create_student('student1'), create_student('student2')]
+
+    def test_list_upserts_existing_records(self):
+        AttendanceRecord.objects.create(student=self.students[0], date=date(2024, 9, 2), status='absent')
+        response = self.client.post('/api/attendance/records/', [
+            {'student': student.pk, 'date': '2024-09-02', 'status': 'present'} for student in self.students
+        ], format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual([record['status'] for record in response.data], ['present', 'present'])
+        self.assertEqual(AttendanceRecord.objects.filter(status='present').count(), 2)
+
+    def test_repeated_student_and_date_is_rejected(self):
+        response = self.client.post('/api/attendance/records/', [
+            {'student': self.students[0].pk, 'date': '2024-09-02', 'status': 'present'},
+            {'student': self.students[1].pk, 'date': '2024-09-02', 'status': 'present'},
+            {'student': self.students[0].pk, 'date': '2024-09-02', 'status': 'absent'},
+        ], format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(AttendanceRecord.objects.exists())
@@ -0,0 +1,25 @@
+from .models import AttendanceRecord
+
+# Fields replaced when an upsert overwrites an existing record
+UPSERT_FIELDS = ['status', 'recorded_by', 'note']
+
+
+def upsert_attendance_records(records, overwrite=True):
+    """
+    Write unsaved AttendanceRecords for many students in one INSERT ... ON
+    CONFLICT on (student, date). With overwrite, existing records take the
+    new status, recorder and note; without it they are left as they are, so
+    the first mark of the day wins. If the same student and day appear more
+    than once, the last one is written.
+    """
+    unique_records = {}
+    for record in records:
+        unique_records[(record.student_id, record.date)] = record
+    records = list(unique_records.values())
+    if not records:
+        return []
+    if overwrite:
+        return AttendanceRecord.objects.bulk_create(
+            records, update_conflicts=True, unique_fields=['student', 'date'], update_fields=UPSERT_FIELDS
+        )
+    return AttendanceRecord.objects.bulk_create(records, ignore_conflicts=True)
@@ -1,9 +1,12 @@
-from rest_framework import generics
+from rest_framework import generics, status
+from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response
 from django_filters.rest_framework import DjangoFilterBackend
 from .models import AttendanceRecord
 from rest_framework.permissions import IsAuthenticated
 from .permissions import TeacherOrAdminPermission
-from .serializers import AttendanceRecordSerializer
+from .serializers import AttendanceRecordSerializer, AttendanceRecordUpsertSerializer
+from .utils import upsert_attendance_records
 import django_filters.rest_framework as df_filters
 from django.shortcuts import get_object_or_404
 from school_data.models import StudentProfile
@@ -22,6 +25,22 @@ class AttendanceRecordListCreateAPIView(generics.ListCreateAPIView):
     filterset_class = AttendanceRecordFilter
     permission_classes = [IsAuthenticated, TeacherOrAdminPermission]
 
+    def create(self, request, *args, **kwargs):
+        # Accepts one record or a list (e.g. a whole class); both are written in one upsert
+        many = isinstance(request.data, list)
+        serializer = AttendanceRecordUpsertSerializer(data=request.data, many=many, context=self.get_serializer_context())
+        serializer.is_valid(raise_exception=True)
+        items = serializer.validated_data if many else [serializer.validated_data]
+        records = [AttendanceRecord(**item) for item in items]
+        days = [(record.student_id, record.date) for record in records]
+        if len(set(days)) != len(days):
+            # The upsert would keep only the last of them and the response would silently come back shorter
+            raise ValidationError("Each student can have only one record per date in a request.")
+        records = upsert_attendance_records(records)
+        saved = AttendanceRecord.objects.filter(pk__in=[record.pk for record in records]).order_by('pk')
+        data = self.get_serializer(saved, many=True).data
+        return Response(data if many else data[0], status=status.HTTP_201_CREATED)
+
 class AttendanceRecordDetailAPIView(generics.RetrieveUpdateDestroyAPIView):
     queryset = AttendanceRecord.objects.all()
     serializer_class = AttendanceRecordSerializer
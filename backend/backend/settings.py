@@ -207,4 +207,139 @@ DEFAULT_FROM_EMAIL = os.getenv("DEFAULT_FROM_EMAIL")
 
 # Media settings
 MEDIA_URL = '/media/'
-MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
\ No newline at end of file
+MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+
+# Facial recognition gallery search: 'exact' matrix product, or 'ivf' approximate
+# index once the gallery reaches FACE_GALLERY_ANN_MIN_SIZE students.
+FACE_GALLERY_INDEX = os.getenv('FACE_GALLERY_INDEX', 'exact')
+FACE_GALLERY_ANN_MIN_SIZE = int(os.getenv('FACE_GALLERY_ANN_MIN_SIZE', '5000'))
+FACE_GALLERY_IVF_NPROBE = int(os.getenv('FACE_GALLERY_IVF_NPROBE', '8'))
+
+# InsightFace sub-models to load. Attendance only reads bbox and normed_embedding,
+# so the landmark and genderage models are skipped by default; the batched
+# attendance pipeline only ever runs detection and recognition.
+FACE_ANALYSIS_MODULES = os.getenv('FACE_ANALYSIS_MODULES', 'detection,recognition').split(',')
+# Keep the detector's 5-point keypoints on returned faces (dropped by default).
+FACE_ANALYSIS_KEEP_KEYPOINTS = os.getenv('FACE_ANALYSIS_KEEP_KEYPOINTS') == 'True'
+# Aligned face crops per recognition model call.
+FACE_RECOGNITION_BATCH_SIZE = int(os.getenv('FACE_RECOGNITION_BATCH_SIZE', '32'))
+# Threads decoding and detecting the images of one upload in parallel, and ONNX
+# Runtime intra-op threads per model session. 0 derives one from the other so
+# that workers x threads matches the core count (4 workers by default).
+FACE_DETECTION_WORKERS = int(os.getenv('FACE_DETECTION_WORKERS', '0'))
+FACE_ORT_INTRA_OP_THREADS = int(os.getenv('FACE_ORT_INTRA_OP_THREADS', '0'))
+# Further ONNX Runtime session options, applied to every InsightFace model.
+# Inter-op threads (0 = ONNX Runtime's default) only matter in 'parallel'
+# execution mode. Graph optimization is 'disable', 'basic', 'extended' or
+# 'all'. With FACE_ORT_OPTIMIZED_MODEL_DIR set, optimized graphs are saved
+# there and reused on later startups; 'all' may tailor them to this CPU, so
+# don't share the directory between different hosts. Turning spinning off
+# stops idle ONNX threads busy-waiting on cores other workers need;
+# FACE_ORT_INTRA_OP_THREAD_AFFINITIES is passed through to ONNX Runtime's
+# session.intra_op_thread_affinities (e.g. "1;2;3" for 4 threads) to pin
+# threads to cores. manage.py sweep_ort_session_options times the options
+# on this host.
+FACE_ORT_INTER_OP_THREADS = int(os.getenv('FACE_ORT_INTER_OP_THREADS', '0'))
+FACE_ORT_EXECUTION_MODE = os.getenv('FACE_ORT_EXECUTION_MODE', 'sequential')
+FACE_ORT_GRAPH_OPTIMIZATION = os.getenv('FACE_ORT_GRAPH_OPTIMIZATION', 'all')
+FACE_ORT_OPTIMIZED_MODEL_DIR = os.getenv('FACE_ORT_OPTIMIZED_MODEL_DIR', '')
+FACE_ORT_CPU_MEM_ARENA = os.getenv('FACE_ORT_CPU_MEM_ARENA', 'True') == 'True'
+FACE_ORT_MEM_PATTERN = os.getenv('FACE_ORT_MEM_PATTERN', 'True') == 'True'
+FACE_ORT_ALLOW_SPINNING = os.getenv('FACE_ORT_ALLOW_SPINNING', 'True') == 'True'
+FACE_ORT_INTRA_OP_THREAD_AFFINITIES = os.getenv('FACE_ORT_INTRA_OP_THREAD_AFFINITIES', '')
+
+# Unix socket of the shared inference server (manage.py run_inference_server).
+# Unset means every worker loads and runs its own copy of the model.
+FACE_INFERENCE_SOCKET = os.getenv('FACE_INFERENCE_SOCKET')
+FACE_INFERENCE_AUTHKEY = os.getenv('FACE_INFERENCE_AUTHKEY', SECRET_KEY)
+FACE_INFERENCE_BATCH_SIZE = int(os.getenv('FACE_INFERENCE_BATCH_SIZE', '8'))
+FACE_INFERENCE_BATCH_WAIT_MS = int(os.getenv('FACE_INFERENCE_BATCH_WAIT_MS', '5'))
+
+# Background threads per worker processing submitted video attendance jobs.
+VIDEO_JOB_WORKERS = int(os.getenv('VIDEO_JOB_WORKERS', '2'))
+
+# Video attendance frame sampling. The video is decoded once front to back and
+# frames are picked by policy: 'every_n' (every VIDEO_SAMPLE_EVERY_N_FRAMES-th
+# frame), 'rate' (VIDEO_SAMPLES_PER_SECOND per second of video) or 'scene'
+# (frames that differ from the last sample by more than
+# VIDEO_SCENE_CHANGE_THRESHOLD grey levels on average). Sampled frames are
+# shrunk to VIDEO_MAX_FRAME_SIDE pixels on their longer side. Videos long
+# enough to give more than VIDEO_MAX_SAMPLED_FRAMES samples are sampled more
+# sparsely, so the samples still cover the whole video.
+VIDEO_SAMPLING_POLICY = os.getenv('VIDEO_SAMPLING_POLICY', 'rate')
+VIDEO_SAMPLE_EVERY_N_FRAMES = int(os.getenv('VIDEO_SAMPLE_EVERY_N_FRAMES', '30'))
+VIDEO_SAMPLES_PER_SECOND = float(os.getenv('VIDEO_SAMPLES_PER_SECOND', '1'))
+VIDEO_SCENE_CHANGE_THRESHOLD = float(os.getenv('VIDEO_SCENE_CHANGE_THRESHOLD', '12'))
+VIDEO_MAX_SAMPLED_FRAMES = int(os.getenv('VIDEO_MAX_SAMPLED_FRAMES', '60'))
+VIDEO_MAX_FRAME_SIDE = int(os.getenv('VIDEO_MAX_FRAME_SIDE', '1280'))
+
+# Faces in sampled video frames are linked into tracks (same person across
+# frames) when their embeddings reach VIDEO_TRACK_SIMILARITY_THRESHOLD cosine
+# similarity, or their boxes overlap by VIDEO_TRACK_IOU_THRESHOLD within
+# VIDEO_TRACK_MAX_GAP sampled frames. Each track is matched and stored once.
+VIDEO_TRACK_IOU_THRESHOLD = float(os.getenv('VIDEO_TRACK_IOU_THRESHOLD', '0.3'))
+VIDEO_TRACK_SIMILARITY_THRESHOLD = float(os.getenv('VIDEO_TRACK_SIMILARITY_THRESHOLD', '0.5'))
+VIDEO_TRACK_MAX_GAP = int(os.getenv('VIDEO_TRACK_MAX_GAP', '3'))
+
+# Clustering of unrecognized faces for bulk review. Faces whose embeddings
+# reach FACE_CLUSTER_SIMILARITY_THRESHOLD cosine similarity are neighbours;
+# faces with FACE_CLUSTER_MIN_SAMPLES neighbours (themselves included) seed
+# clusters when manage.py cluster_unrecognized_faces runs.
+FACE_CLUSTER_SIMILARITY_THRESHOLD = float(os.getenv('FACE_CLUSTER_SIMILARITY_THRESHOLD', '0.5'))
+FACE_CLUSTER_MIN_SAMPLES = int(os.getenv('FACE_CLUSTER_MIN_SAMPLES', '3'))
+
+# Each student is matched by up to FACE_PROTOTYPES_PER_STUDENT prototype
+# embeddings (e.g. with and without glasses). A new face starts a prototype
+# when it is less than FACE_PROTOTYPE_SPLIT_THRESHOLD similar to all of them.
+FACE_PROTOTYPES_PER_STUDENT = int(os.getenv('FACE_PROTOTYPES_PER_STUDENT', '3'))
+FACE_PROTOTYPE_SPLIT_THRESHOLD = float(os.getenv('FACE_PROTOTYPE_SPLIT_THRESHOLD', '0.7'))
+
+# Uploaded photos are decoded with their longer side reduced to this many
+# pixels (JPEGs at reduced size, straight from the compressed data). The
+# detector works at 640; the extra pixels keep recognition crops of small,
+# distant faces sharp.
+FACE_DECODE_MAX_SIDE = int(os.getenv('FACE_DECODE_MAX_SIDE', '1280' if os.getenv('FACE_DETECTION_TILING', 'off') == 'off' else '4096'))
+
+# Tiled detection for large classroom photos: 'off', 'always', or 'auto' to
+# tile images whose longer side is at least FACE_DETECTION_TILING_MIN_SIDE.
+# The detector then also runs on overlapping FACE_DETECTION_TILE_SIZE tiles
+# at full resolution, so back-row faces aren't shrunk away; results are
+# merged with NMS. Tiling raises the FACE_DECODE_MAX_SIDE default to 4096.
+FACE_DETECTION_TILING = os.getenv('FACE_DETECTION_TILING', 'off')
+FACE_DETECTION_TILING_MIN_SIDE = int(os.getenv('FACE_DETECTION_TILING_MIN_SIDE', '1600'))
+FACE_DETECTION_TILE_SIZE = int(os.getenv('FACE_DETECTION_TILE_SIZE', '640'))
+FACE_DETECTION_TILE_OVERLAP = float(os.getenv('FACE_DETECTION_TILE_OVERLAP', '0.2'))
+FACE_DETECTION_TILE_NMS_THRESHOLD = float(os.getenv('FACE_DETECTION_TILE_NMS_THRESHOLD', '0.4'))
+
+# Review and unrecognized face crops are encoded and stored by a background
+# writer pool after the response (0 workers writes them inline on commit).
+# At most FACE_WRITER_MAX_PENDING batches queue before requests wait; failed
+# storage or database writes are retried FACE_WRITER_RETRIES times, backing
+# off from FACE_WRITER_RETRY_DELAY seconds.
+FACE_WRITER_WORKERS = int(os.getenv('FACE_WRITER_WORKERS', '2'))
+FACE_WRITER_MAX_PENDING = int(os.getenv('FACE_WRITER_MAX_PENDING', '64'))
+FACE_WRITER_RETRIES = int(os.getenv('FACE_WRITER_RETRIES', '3'))
+FACE_WRITER_RETRY_DELAY = float(os.getenv('FACE_WRITER_RETRY_DELAY', '0.5'))
+
+# When attendance is marked for a school class, faces are matched against
+# that class's students first; only faces whose best in-class similarity is
+# below FACE_CLASS_GALLERY_MIN_SIMILARITY are matched against the whole school.
+FACE_CLASS_GALLERY_MIN_SIMILARITY = float(os.getenv('FACE_CLASS_GALLERY_MIN_SIMILARITY', '0.5'))
+
+# 'int8' serves the quantized detection and recognition models written by
+# manage.py quantize_face_models (only after they pass its accuracy check on
+# the school's enrolled images); models without an INT8 copy stay FP32.
+FACE_MODEL_PRECISION = os.getenv('FACE_MODEL_PRECISION', 'fp32')
+
+# Detected boxes and embeddings of uploaded photos, keyed by the SHA-256 of
+# the upload plus the model and detector settings, so a re-sent photo or a
+# retried request skips inference. 'django' keeps them in the
+# FACE_DETECTION_CACHE_ALIAS cache (per worker with the default local-memory
+# cache, which evicts the least recently used of its entries); 'disk' shares
+# them between workers in FACE_DETECTION_CACHE_DIR, trimmed to
+# FACE_DETECTION_CACHE_MAX_BYTES least recently used first; 'off' disables it.
+FACE_DETECTION_CACHE = os.getenv('FACE_DETECTION_CACHE', 'django')
+FACE_DETECTION_CACHE_ALIAS = os.getenv('FACE_DETECTION_CACHE_ALIAS', 'default')
+FACE_DETECTION_CACHE_TIMEOUT = int(os.getenv('FACE_DETECTION_CACHE_TIMEOUT', '86400'))
+FACE_DETECTION_CACHE_DIR = os.getenv('FACE_DETECTION_CACHE_DIR', os.path.join(BASE_DIR, 'face_detection_cache'))
+FACE_DETECTION_CACHE_MAX_BYTES = int(os.getenv('FACE_DETECTION_CACHE_MAX_BYTES', str(256 * 1024 * 1024)))
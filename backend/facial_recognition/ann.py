@@ -0,0 +1,107 @@
+import numpy as np
+
+
+def normalize_rows(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+
+def spherical_kmeans(vectors, n_clusters, n_iter=10, seed=0):
+    """Cosine k-means over L2-normalised rows; returns normalised centroids."""
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), size=n_clusters, replace=False)].copy()
+    for _ in range(n_iter):
+        assignment = (vectors @ centroids.T).argmax(axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, vectors)
+        empty = ~sums.any(axis=1)
+        # Re-seed empty clusters with random points so every list stays usable
+        sums[empty] = vectors[rng.choice(len(vectors), size=int(empty.sum()))]
+        centroids = normalize_rows(sums)
+    return centroids
+
+
+class IVFIndex:
+    """
+    Inverted-file index for cosine search over L2-normalised vectors.
+
+    Vectors are bucketed by their nearest coarse centroid; a query only scans
+    the `nprobe` closest buckets. Keys can be inserted and removed one at a
+    time without retraining, so embedding updates stay cheap. Centroids are
+    only recomputed when the index is rebuilt from scratch.
+    """
+
+    def __init__(self, vectors, keys, nlist=None, nprobe=8, n_iter=10, train_per_list=64):
+        vectors = normalize_rows(vectors)
+        self.dim = vectors.shape[1]
+        self.nprobe = nprobe
+        nlist = min(nlist or max(1, int(np.sqrt(len(vectors)))), len(vectors))
+        # Train the coarse quantizer on a sample; assignment still covers every vector
+        sample = vectors
+        if len(vectors) > train_per_list * nlist:
+            sample = vectors[np.random.default_rng(0).choice(len(vectors), size=train_per_list * nlist, replace=False)]
+        self.centroids = spherical_kmeans(sample, nlist, n_iter=n_iter)
+        self._vectors = [np.empty((0, self.dim), dtype=np.float32) for _ in range(len(self.centroids))]
+        self._keys = [np.empty(0, dtype=np.int64) for _ in range(len(self.centroids))]
+        self._locations = {}
+
+        assignment = (vectors @ self.centroids.T).argmax(axis=1)
+        keys = np.asarray(keys, dtype=np.int64)
+        for list_no in range(len(self.centroids)):
+            members = np.flatnonzero(assignment == list_no)
+            self._vectors[list_no] = np.ascontiguousarray(vectors[members])
+            self._keys[list_no] = keys[members]
+            for position, key in enumerate(keys[members].tolist()):
+                self._locations[key] = (list_no, position)
+
+    def __len__(self):
+        return len(self._locations)
+
+    def add(self, key, vector):
+        self.remove(key)
+        vector = normalize_rows(np.asarray(vector).reshape(1, -1))
+        list_no = int((vector @ self.centroids.T).argmax())
+        self._locations[key] = (list_no, len(self._keys[list_no]))
+        self._vectors[list_no] = np.concatenate([self._vectors[list_no], vector])
+        self._keys[list_no] = np.append(self._keys[list_no], np.int64(key))
+
+    def remove(self, key):
+        location = self._locations.pop(key, None)
+        if location is None:
+            return
+        list_no, position = location
+        vectors, keys = self._vectors[list_no], self._keys[list_no]
+        last = len(keys) - 1
+        if position != last:
+            # Move the last entry into the freed slot to keep the list dense
+            vectors = vectors.copy()
+            keys = keys.copy()
+            vectors[position] = vectors[last]
+            keys[position] = keys[last]
+            self._locations[int(keys[position])] = (list_no, position)
+        self._vectors[list_no] = vectors[:last]
+        self._keys[list_no] = keys[:last]
+
+    def search(self, queries, nprobe=None):
+        """Return (keys, similarities) of the best hit per query; -1 when nothing was probed."""
+        queries = normalize_rows(queries)
+        nprobe = min(nprobe or self.nprobe, len(self.centroids))
+        best_keys = np.full(len(queries), -1, dtype=np.int64)
+        best_sims = np.full(len(queries), -np.inf, dtype=np.float32)
+        probes = np.argsort(-(queries @ self.centroids.T), axis=1)[:, :nprobe]
+
+        # Scan each probed list once for all the queries that probe it
+        for list_no in np.unique(probes):
+            keys = self._keys[list_no]
+            if not len(keys):
+                continue
+            query_rows = np.flatnonzero((probes == list_no).any(axis=1))
+            similarities = queries[query_rows] @ self._vectors[list_no].T
+            top = similarities.argmax(axis=1)
+            top_sims = similarities[np.arange(len(query_rows)), top]
+            better = top_sims > best_sims[query_rows]
+            best_sims[query_rows[better]] = top_sims[better]
+            best_keys[query_rows[better]] = keys[top[better]]
+
+        best_sims[best_keys < 0] = 0
+        return best_keys, best_sims
@@ -0,0 +1,124 @@
+from collections import Counter
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Q
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+from .ann import normalize_rows
+from .models import UnrecognizedFace, UnrecognizedFaceCluster
+
+# Rows of the similarity matrix computed at a time while building the graph
+BLOCK_SIZE = 1024
+
+OPEN_FACES = Q(identified_student__isnull=True, discarded=False)
+
+
+def cluster_embeddings(embeddings, threshold, min_samples):
+    """
+    DBSCAN-style clustering under cosine similarity. Faces with at least
+    `min_samples` neighbours (themselves included) at `threshold` or above
+    are core points; core points that are neighbours share a cluster, other
+    faces join the cluster of a neighbouring core point or stay on their own.
+    Returns one label per embedding, numbered from 0.
+    """
+    vectors = normalize_rows(embeddings)
+    n = len(vectors)
+    rows, cols = [], []
+    for start in range(0, n, BLOCK_SIZE):
+        block_rows, block_cols = np.nonzero(vectors[start:start + BLOCK_SIZE] @ vectors.T >= threshold)
+        rows.append(block_rows + start)
+        cols.append(block_cols)
+    rows, cols = np.concatenate(rows), np.concatenate(cols)
+
+    core = np.bincount(rows, minlength=n) >= min_samples
+    core_edges = core[rows] & core[cols]
+    graph = coo_matrix((np.ones(int(core_edges.sum()), dtype=bool), (rows[core_edges], cols[core_edges])), shape=(n, n))
+    _, labels = connected_components(graph, directed=False)
+    border_edges = ~core[rows] & core[cols]
+    labels[rows[border_edges]] = labels[cols[border_edges]]
+    return np.unique(labels, return_inverse=True)[1]
+
+
+def assign_to_clusters(faces):
+    """
+    Put newly stored unrecognized faces into the cluster with the nearest
+    centroid, or into a new cluster when none is similar enough. Centroids
+    are running means, so this never reads the member faces themselves.
+    """
+    faces = [face for face in faces if face.embedding is not None and len(face.embedding)]
+    if not faces:
+        return
+    threshold = settings.FACE_CLUSTER_SIMILARITY_THRESHOLD
+    with transaction.atomic():
+        clusters = list(
+            UnrecognizedFaceCluster.objects.select_for_update().filter(
+                centroid__isnull=False,
+                id__in=UnrecognizedFace.objects.filter(OPEN_FACES).values('cluster_id'),
+            )
+        )
+        centroids = [np.array(cluster.centroid, dtype=np.float32) for cluster in clusters]
+        changed = set()
+        for face, vector in zip(faces, normalize_rows(np.stack([face.embedding for face in faces]))):
+            best = None
+            if centroids:
+                similarities = normalize_rows(np.stack(centroids)) @ vector
+                best = int(similarities.argmax())
+                if similarities[best] < threshold:
+                    best = None
+            if best is None:
+                clusters.append(UnrecognizedFaceCluster.objects.create(centroid=vector, size=1))
+                centroids.append(vector.copy())
+                best = len(clusters) - 1
+            else:
+                cluster = clusters[best]
+                centroids[best] = (centroids[best] * cluster.size + vector) / (cluster.size + 1)
+                cluster.size += 1
+                changed.add(best)
+            face.cluster = clusters[best]
+        for best in changed:
+            clusters[best].centroid = centroids[best]
+        UnrecognizedFaceCluster.objects.bulk_update([clusters[best] for best in changed], ['centroid', 'size'])
+        UnrecognizedFace.objects.bulk_update(faces, ['cluster'])
+
+
+def recluster_unrecognized_faces():
+    """
+    Re-cluster every open unrecognized face from scratch. A new cluster keeps
+    the id of the old cluster most of its faces came from, so clusters an
+    admin is looking at survive unless they were actually split or merged.
+    Clusters left without open faces are deleted. Returns (faces, clusters).
+    """
+    threshold = settings.FACE_CLUSTER_SIMILARITY_THRESHOLD
+    min_samples = settings.FACE_CLUSTER_MIN_SAMPLES
+    rows = [
+        (face_id, cluster_id, embedding)
+        for face_id, cluster_id, embedding in UnrecognizedFace.objects.filter(OPEN_FACES).values_list('id', 'cluster_id', 'embedding')
+        if embedding is not None and len(embedding)
+    ]
+    with transaction.atomic():
+        if rows:
+            vectors = normalize_rows(np.stack([embedding for _, _, embedding in rows]))
+            labels = cluster_embeddings(vectors, threshold, min_samples)
+            groups = [np.flatnonzero(labels == label) for label in range(labels.max() + 1)]
+            claimed = set()
+            updated_faces, updated_clusters = [], []
+            # Larger groups pick their previous cluster id first
+            for members in sorted(groups, key=len, reverse=True):
+                previous = Counter(rows[m][1] for m in members if rows[m][1] is not None)
+                cluster_id = next((cid for cid, _ in previous.most_common() if cid not in claimed), None)
+                centroid = vectors[members].mean(axis=0)
+                if cluster_id is None:
+                    cluster_id = UnrecognizedFaceCluster.objects.create(centroid=centroid, size=len(members)).id
+                else:
+                    updated_clusters.append(UnrecognizedFaceCluster(id=cluster_id, centroid=centroid, size=len(members)))
+                claimed.add(cluster_id)
+                updated_faces.extend(
+                    UnrecognizedFace(id=rows[m][0], cluster_id=cluster_id) for m in members if rows[m][1] != cluster_id
+                )
+            UnrecognizedFaceCluster.objects.bulk_update(updated_clusters, ['centroid', 'size'], batch_size=500)
+            UnrecognizedFace.objects.bulk_update(updated_faces, ['cluster'], batch_size=500)
+        UnrecognizedFaceCluster.objects.annotate(
+            open_faces=Count('faces', filter=Q(faces__identified_student__isnull=True, faces__discarded=False))
+        ).filter(open_faces=0).delete()
+    return len(rows), UnrecognizedFaceCluster.objects.count()
@@ -0,0 +1,162 @@
+import hashlib
+import logging
+import os
+import threading
+import uuid
+from io import BytesIO
+import numpy as np
+from django.conf import settings
+from django.core.cache import caches
+from .imaging import read_upload
+from .inference import DETECTION_SIZE, DETECTION_THRESHOLD, DetectedFace, get_faces_batch, model_version
+
+logger = logging.getLogger(__name__)
+
+# The disk cache's size is checked (and trimmed) once every this many writes
+EVICTION_CHECK_EVERY = 32
+
+_writes_since_check = 0
+_disk_lock = threading.Lock()
+
+
+def upload_key(image_file, max_side):
+    """
+    SHA-256 of the upload's bytes plus everything that shapes its detections:
+    the models, the decode size (boxes are in decoded-image coordinates) and
+    the detector and tiling settings.
+    """
+    digest = hashlib.sha256(read_upload(image_file))
+    digest.update(repr((
+        model_version(), settings.FACE_MODEL_PRECISION, settings.FACE_ANALYSIS_MODULES, max_side,
+        DETECTION_SIZE, DETECTION_THRESHOLD, settings.FACE_ANALYSIS_KEEP_KEYPOINTS,
+        settings.FACE_DETECTION_TILING, settings.FACE_DETECTION_TILING_MIN_SIDE, settings.FACE_DETECTION_TILE_SIZE,
+        settings.FACE_DETECTION_TILE_OVERLAP, settings.FACE_DETECTION_TILE_NMS_THRESHOLD,
+    )).encode())
+    return f'face-detections:{digest.hexdigest()}'
+
+
+def _dump(faces):
+    arrays = {'bbox': np.empty((0, 4)), 'det_score': np.empty(0), 'embedding': np.empty((0, 0))}
+    if faces:
+        arrays = {
+            'bbox': np.array([face.bbox for face in faces], dtype=np.float32),
+            'det_score': np.array([face.det_score for face in faces], dtype=np.float32),
+            'embedding': np.array([face.normed_embedding for face in faces], dtype=np.float32),
+        }
+        if faces[0].kps is not None:
+            arrays['kps'] = np.array([face.kps for face in faces], dtype=np.float32)
+    buffer = BytesIO()
+    np.savez(buffer, **arrays)
+    return buffer.getvalue()
+
+
+def _load(data):
+    with np.load(BytesIO(data)) as arrays:
+        kpss = arrays['kps'] if 'kps' in arrays else [None] * len(arrays['bbox'])
+        return [
+            DetectedFace(bbox, kps, float(det_score), embedding)
+            for bbox, kps, det_score, embedding in zip(arrays['bbox'], kpss, arrays['det_score'], arrays['embedding'])
+        ]
+
+
+def _disk_path(key):
+    return os.path.join(settings.FACE_DETECTION_CACHE_DIR, key.split(':', 1)[1] + '.npz')
+
+
+def _disk_get(key):
+    path = _disk_path(key)
+    try:
+        with open(path, 'rb') as entry:
+            data = entry.read()
+        os.utime(path)  # Eviction goes by modification time, so a hit counts as a use
+    except FileNotFoundError:
+        return None
+    return data
+
+
+def _disk_set(key, data):
+    global _writes_since_check
+    os.makedirs(settings.FACE_DETECTION_CACHE_DIR, exist_ok=True)
+    path = _disk_path(key)
+    temp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+    with open(temp_path, 'wb') as entry:
+        entry.write(data)
+    os.replace(temp_path, path)
+    with _disk_lock:
+        _writes_since_check += 1
+        if _writes_since_check < EVICTION_CHECK_EVERY:
+            return
+        _writes_since_check = 0
+    _evict_disk()
+
+
+def _evict_disk():
+    """Delete least recently used entries until the directory is back under 90% of its size limit."""
+    entries = []
+    with os.scandir(settings.FACE_DETECTION_CACHE_DIR) as scan:
+        for entry in scan:
+            if entry.name.endswith('.npz'):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue  # Evicted by another worker
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+    total = sum(size for _, size, _ in entries)
+    if total <= settings.FACE_DETECTION_CACHE_MAX_BYTES:
+        return
+    target = settings.FACE_DETECTION_CACHE_MAX_BYTES * 0.9
+    for _, size, path in sorted(entries):
+        if total <= target:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+
+
+def _get(key):
+    if settings.FACE_DETECTION_CACHE == 'disk':
+        return _disk_get(key)
+    return caches[settings.FACE_DETECTION_CACHE_ALIAS].get(key)
+
+
+def _set(key, data):
+    if settings.FACE_DETECTION_CACHE == 'disk':
+        _disk_set(key, data)
+    else:
+        caches[settings.FACE_DETECTION_CACHE_ALIAS].set(key, data, settings.FACE_DETECTION_CACHE_TIMEOUT)
+
+
+def get_upload_faces(uploads, images, max_side):
+    """
+    get_faces_batch for decoded uploads, skipping detection and recognition
+    for uploads seen before (a re-sent photo or a retried request) when
+    FACE_DETECTION_CACHE is on. A cache that can't be read or written is
+    logged and bypassed rather than failing the request.
+    """
+    if settings.FACE_DETECTION_CACHE == 'off':
+        return get_faces_batch(images)
+    keys, results = [], []
+    for upload in uploads:
+        key = None
+        try:
+            key = upload_key(upload, max_side)
+            data = _get(key)
+            results.append(_load(data) if data is not None else None)
+        except Exception:
+            logger.warning("Face detection cache lookup failed", exc_info=True)
+            results.append(None)
+        keys.append(key)
+
+    missing = [index for index, faces in enumerate(results) if faces is None]
+    if missing:
+        for index, faces in zip(missing, get_faces_batch([images[index] for index in missing])):
+            results[index] = faces
+            if keys[index] is None:
+                continue
+            try:
+                _set(keys[index], _dump(faces))
+            except Exception:
+                logger.warning("Could not store faces in the detection cache", exc_info=True)
+    return results
@@ -0,0 +1,222 @@
+import threading
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Max
+from .ann import IVFIndex, normalize_rows
+from .models import FacePrototype, StudentProfile
+
+
+class FaceGallery:
+    """
+    Process-wide matrix of every enrolled student's prototype embeddings.
+
+    Rows are L2-normalised, so one (faces x prototypes) matrix product gives
+    the cosine similarity of every detected face against every prototype, and
+    a face's best prototype names its student. Changes made in this process
+    are applied row by row through the FacePrototype signals once they
+    commit; changes made by other workers are picked up through a cheap
+    count/last-modified stamp that is checked before each match and triggers
+    a full reload. The stamp only ever holds values read from the database:
+    when it has moved, the rows modified since the last read must all be this
+    process's own writes for the reload to be skipped.
+
+    With FACE_GALLERY_INDEX = 'ivf', galleries of at least
+    FACE_GALLERY_ANN_MIN_SIZE prototypes are searched through an IVFIndex
+    instead of the exact matrix product.
+
+    Matches can be scoped to one school class: its students' rows are cut
+    out into a small cached sub-gallery, rebuilt when the gallery changes or
+    the class roster differs from the one it was built for. Faces whose best
+    in-class similarity is below FACE_CLASS_GALLERY_MIN_SIMILARITY are
+    matched against the whole school instead.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._matrix = np.empty((0, 0), dtype=np.float32)
+        self._prototype_ids = np.empty(0, dtype=np.int64)
+        self._student_ids = np.empty(0, dtype=np.int64)
+        self._rows = {}
+        self._size = 0
+        self._index = None
+        self._stamp = None
+        self._own_writes = {}  # Prototype id -> updated_at of rows saved here since the stamp was read
+        self._own_count_change = 0
+        self._stale = True
+        self._version = 0  # Bumped on every change; class sub-galleries are built for one version
+        self._class_galleries = {}
+
+    def invalidate(self):
+        self._stale = True
+
+    def _current_stamp(self):
+        stats = FacePrototype.objects.aggregate(count=Count('id'), last_updated=Max('updated_at'))
+        return stats['count'], stats['last_updated']
+
+    def _only_own_writes(self, stamp):
+        """Whether the change from the held stamp to stamp is explained by this process's writes alone."""
+        count, _ = self._stamp
+        if stamp[0] != count + self._own_count_change:
+            return False
+        modified = FacePrototype.objects.all()
+        if self._stamp[1] is not None:
+            modified = modified.filter(updated_at__gt=self._stamp[1])
+        return all(self._own_writes.get(prototype_id) == updated_at for prototype_id, updated_at in modified.values_list('id', 'updated_at'))
+
+    def _load(self):
+        self._version += 1
+        self._class_galleries = {}
+        rows = FacePrototype.objects.values_list('id', 'student_id', 'embedding')
+        rows = [row for row in rows if row[2] is not None and len(row[2])]
+        self._rows = {prototype_id: row for row, (prototype_id, _, _) in enumerate(rows)}
+        self._size = len(rows)
+        if not rows:
+            self._matrix = np.empty((0, 0), dtype=np.float32)
+            self._prototype_ids = np.empty(0, dtype=np.int64)
+            self._student_ids = np.empty(0, dtype=np.int64)
+            self._index = None
+            return
+        self._prototype_ids = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+        self._student_ids = np.fromiter((row[1] for row in rows), dtype=np.int64, count=len(rows))
+        self._matrix = np.ascontiguousarray(normalize_rows(np.stack([row[2] for row in rows])))
+        self._index = self._build_index()
+
+    def _build_index(self):
+        if settings.FACE_GALLERY_INDEX != 'ivf' or self._size < settings.FACE_GALLERY_ANN_MIN_SIZE:
+            return None
+        return IVFIndex(self._matrix[:self._size], self._prototype_ids[:self._size], nprobe=settings.FACE_GALLERY_IVF_NPROBE)
+
+    def refresh(self):
+        stamp = self._current_stamp()
+        if not self._stale and stamp == self._stamp:
+            return
+        with self._lock:
+            if not self._stale and stamp == self._stamp:
+                return
+            if self._stale or not self._only_own_writes(stamp):
+                # Clear the flag before loading so an invalidation that races
+                # with the load triggers another reload instead of being lost.
+                self._stale = False
+                self._load()
+            self._stamp = stamp
+            self._own_writes = {}
+            self._own_count_change = 0
+
+    def _upsert_row(self, prototype_id, student_id, embedding):
+        vector = normalize_rows(np.asarray(embedding).reshape(1, -1))[0]
+        row = self._rows.get(prototype_id)
+        if row is None:
+            if self._size == len(self._matrix):
+                # Grow the buffers geometrically so appends stay amortised O(1)
+                grown = np.empty((max(16, 2 * self._size), len(vector)), dtype=np.float32)
+                grown_prototype_ids = np.empty(len(grown), dtype=np.int64)
+                grown_student_ids = np.empty(len(grown), dtype=np.int64)
+                if self._size:
+                    grown[:self._size] = self._matrix[:self._size]
+                    grown_prototype_ids[:self._size] = self._prototype_ids[:self._size]
+                    grown_student_ids[:self._size] = self._student_ids[:self._size]
+                self._matrix, self._prototype_ids, self._student_ids = grown, grown_prototype_ids, grown_student_ids
+            row = self._size
+            self._size += 1
+            self._rows[prototype_id] = row
+            self._prototype_ids[row] = prototype_id
+        self._student_ids[row] = student_id
+        self._matrix[row] = vector
+        if self._index is not None:
+            self._index.add(prototype_id, vector)
+        elif settings.FACE_GALLERY_INDEX == 'ivf' and self._size >= settings.FACE_GALLERY_ANN_MIN_SIZE:
+            self._index = self._build_index()
+
+    def _remove_row(self, prototype_id):
+        row = self._rows.pop(prototype_id, None)
+        if row is None:
+            return
+        last = self._size - 1
+        if row != last:
+            # Move the last row into the freed slot to keep the matrix dense
+            self._matrix[row] = self._matrix[last]
+            self._prototype_ids[row] = self._prototype_ids[last]
+            self._student_ids[row] = self._student_ids[last]
+            self._rows[int(self._prototype_ids[row])] = row
+        self._size = last
+        if self._index is not None:
+            self._index.remove(prototype_id)
+
+    def apply_change(self, instance, deleted=False, created=False):
+        """
+        Apply one saved or deleted FacePrototype without a full reload once
+        the surrounding transaction (if any) commits; a rolled-back write
+        never reaches the gallery or counts as one of our own writes.
+        """
+        # Read now: the instance may change again, and deletion clears its id
+        change = (instance.id, instance.student_id, instance.embedding, instance.updated_at)
+        transaction.on_commit(lambda: self._apply_change(*change, deleted, created))
+
+    def _apply_change(self, prototype_id, student_id, embedding, updated_at, deleted, created):
+        with self._lock:
+            if self._stale or self._stamp is None:
+                return
+            self._version += 1
+            # Recorded so the next refresh can tell our own writes from other workers'
+            if deleted:
+                self._own_count_change -= 1
+                self._remove_row(prototype_id)
+            else:
+                self._own_count_change += int(created)
+                self._own_writes[prototype_id] = updated_at
+                if embedding is not None and len(embedding):
+                    self._upsert_row(prototype_id, student_id, embedding)
+                else:
+                    self._remove_row(prototype_id)
+
+    def __len__(self):
+        return self._size
+
+    def _class_gallery(self, school_class_id):
+        """Student ids and matrix of one class's prototype rows, cached per gallery version and roster."""
+        members = frozenset(StudentProfile.objects.filter(school_class_id=school_class_id).values_list('id', flat=True))
+        with self._lock:
+            cached = self._class_galleries.get(school_class_id)
+            if cached is None or cached[0] != self._version or cached[1] != members:
+                rows = np.flatnonzero(np.isin(self._student_ids[:self._size], list(members)))
+                cached = (self._version, members, self._student_ids[rows], np.ascontiguousarray(self._matrix[rows]))
+                self._class_galleries[school_class_id] = cached
+            return cached[2], cached[3]
+
+    def _match_all(self, queries):
+        with self._lock:
+            if not len(queries) or not self._size:
+                return np.full(len(queries), -1, dtype=np.int64), np.zeros(len(queries), dtype=np.float32)
+            if self._index is not None:
+                prototype_ids, similarities = self._index.search(queries)
+                student_ids = np.array([self._student_ids[self._rows[key]] if key >= 0 else -1 for key in prototype_ids.tolist()], dtype=np.int64)
+                return student_ids, similarities
+            queries = normalize_rows(queries)
+            similarities = queries @ self._matrix[:self._size].T
+            best = similarities.argmax(axis=1)
+            return self._student_ids[best], similarities[np.arange(len(queries)), best]
+
+    def match(self, embeddings, school_class_id=None):
+        """
+        Match a (faces x dim) array of embeddings against the gallery, or
+        first against the students of school_class_id if given.
+        Returns (student_ids, similarities); faces with no candidate get id -1.
+        """
+        self.refresh()
+        queries = np.asarray(embeddings, dtype=np.float32).reshape(len(embeddings), -1)
+        if school_class_id is None or not len(queries):
+            return self._match_all(queries)
+        class_student_ids, class_matrix = self._class_gallery(school_class_id)
+        if not len(class_student_ids):
+            return self._match_all(queries)
+        similarities = normalize_rows(queries) @ class_matrix.T
+        best = similarities.argmax(axis=1)
+        student_ids, similarities = class_student_ids[best], similarities[np.arange(len(queries)), best]
+        # Faces that don't clearly belong to the class are looked up school-wide
+        fallback = similarities < settings.FACE_CLASS_GALLERY_MIN_SIMILARITY
+        if fallback.any():
+            student_ids[fallback], similarities[fallback] = self._match_all(queries[fallback])
+        return student_ids, similarities
+
+face_gallery = FaceGallery()
@@ -0,0 +1,60 @@
+from io import BytesIO
+import cv2
+import numpy as np
+from django.core.files.base import ContentFile
+from PIL import Image, ImageOps
+
+# IMREAD flags that let libjpeg decode straight to 1/2, 1/4 or 1/8 size
+_REDUCED_FLAGS = ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4), (2, cv2.IMREAD_REDUCED_COLOR_2))
+
+
+def read_upload(image_file):
+    image_file.seek(0)
+    data = image_file.read()
+    image_file.seek(0)
+    return data
+
+
+def _reduced_flag(data, max_side):
+    """Largest JPEG scale-down whose output still covers max_side, read from the header only."""
+    if not max_side:
+        return cv2.IMREAD_COLOR
+    with Image.open(BytesIO(data)) as header:
+        if header.format != 'JPEG':
+            return cv2.IMREAD_COLOR
+        longest = max(header.size)
+    for factor, flag in _REDUCED_FLAGS:
+        if longest / factor >= max_side:
+            return flag
+    return cv2.IMREAD_COLOR
+
+
+def downscale(image, max_side):
+    h, w = image.shape[:2]
+    if not max_side or max(h, w) <= max_side:
+        return image
+    scale = max_side / max(h, w)
+    return cv2.resize(image, (round(w * scale), round(h * scale)), interpolation=cv2.INTER_AREA)
+
+
+def decode_image(image_file, max_side=None):
+    """
+    Decode an uploaded image straight to an upright BGR uint8 array whose
+    longer side is at most max_side. JPEGs are decoded at reduced size by
+    libjpeg where possible and cv2 applies EXIF orientation while decoding;
+    formats cv2 can't read go through PIL instead.
+    """
+    data = read_upload(image_file)
+    image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), _reduced_flag(data, max_side))
+    if image is None:
+        pil_image = ImageOps.exif_transpose(Image.open(BytesIO(data))).convert('RGB')
+        image = cv2.cvtColor(np.asarray(pil_image), cv2.COLOR_RGB2BGR)
+    return downscale(image, max_side)
+
+
+def encode_jpeg(image, name, quality=85):
+    """Encode a BGR array as a JPEG ContentFile for storage."""
+    ok, buffer = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    if not ok:
+        raise ValueError("Could not encode image as JPEG.")
+    return ContentFile(buffer.tobytes(), name=name)
@@ -0,0 +1,430 @@
+import glob
+import hashlib
+import logging
+import os
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from django.conf import settings
+from django.db import connection
+from .inference_server import request_faces, request_model_version
+
+logger = logging.getLogger(__name__)
+
+# Plain result record, so workers talking to the inference server never have
+# to import insightface just to unpickle its Face objects.
+DetectedFace = namedtuple('DetectedFace', ['bbox', 'kps', 'det_score', 'normed_embedding'])
+
+# Input size and score threshold the detector is prepared with
+DETECTION_SIZE = (640, 640)
+DETECTION_THRESHOLD = 0.4
+
+_face_analysis = None
+_load_seconds = None
+_model_version = None
+_lock = threading.Lock()
+
+
+def parallelism():
+    """
+    Return (pool workers, ONNX intra-op threads per session). Whichever of
+    FACE_DETECTION_WORKERS / FACE_ORT_INTRA_OP_THREADS isn't set is derived
+    from the other so that workers x threads stays close to the core count.
+    """
+    cores = os.cpu_count() or 1
+    workers = settings.FACE_DETECTION_WORKERS
+    threads = settings.FACE_ORT_INTRA_OP_THREADS
+    if not workers:
+        workers = max(1, cores // threads) if threads else min(4, cores)
+    if not threads:
+        threads = max(1, cores // workers)
+    return workers, threads
+
+
+class SharedPool:
+    """
+    A process-wide ThreadPoolExecutor started on first use, so its sizes
+    (callables, usually reading settings) are looked up once Django is
+    configured. Tasks queued with submit() close their thread's DB
+    connection when they finish. With max_pending, submit() blocks while
+    that many tasks are queued or running.
+    """
+
+    def __init__(self, thread_name_prefix, max_workers, max_pending=None):
+        self.thread_name_prefix = thread_name_prefix
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self._executor = None
+        self._slots = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    if self.max_pending is not None:
+                        self._slots = threading.BoundedSemaphore(self.max_pending())
+                    self._executor = ThreadPoolExecutor(max_workers=self.max_workers(), thread_name_prefix=self.thread_name_prefix)
+        return self._executor
+
+    def map(self, func, items):
+        return self._get_executor().map(func, items)
+
+    def submit(self, func, *args):
+        executor = self._get_executor()
+        if self._slots is None:
+            return executor.submit(self._run, func, *args)
+        self._slots.acquire()
+        future = executor.submit(self._run, func, *args)
+        future.add_done_callback(lambda future: self._slots.release())
+        return future
+
+    @staticmethod
+    def _run(func, *args):
+        try:
+            return func(*args)
+        finally:
+            # Pool threads outlive requests, so release their DB connection here
+            connection.close()
+
+
+_detect_pool = SharedPool('face-detect', lambda: parallelism()[0])
+
+
+def map_parallel(func, items):
+    """
+    Run func over items on the shared, bounded decode/detection pool.
+    Every request shares the same pool, so concurrent uploads can't spawn
+    more threads than the cores can serve.
+    """
+    items = list(items)
+    if len(items) < 2:
+        return [func(item) for item in items]
+    return list(_detect_pool.map(func, items))
+
+
+# Suffix of the INT8 copies written by manage.py quantize_face_models
+INT8_SUFFIX = '.int8.onnx'
+
+
+def model_dir():
+    from insightface.utils import ensure_available
+    return ensure_available('models', 'buffalo_l', root='~/.insightface')
+
+
+def model_files(directory):
+    """
+    The pack's FP32 ONNX files, each replaced by its INT8 copy when
+    FACE_MODEL_PRECISION = 'int8' and quantize_face_models has passed it.
+    """
+    files = []
+    for path in sorted(glob.glob(os.path.join(directory, '*.onnx'))):
+        if path.endswith(INT8_SUFFIX):
+            continue
+        quantized = path[:-len('.onnx')] + INT8_SUFFIX
+        if settings.FACE_MODEL_PRECISION == 'int8':
+            if os.path.exists(quantized):
+                path = quantized
+            else:
+                logger.warning(f"No INT8 copy of {os.path.basename(path)}; serving FP32. Run quantize_face_models.")
+        files.append(path)
+    return files
+
+
+# Setting values for the ONNX Runtime session enums
+ORT_EXECUTION_MODES = {'sequential': 'ORT_SEQUENTIAL', 'parallel': 'ORT_PARALLEL'}
+ORT_OPTIMIZATION_LEVELS = {'disable': 'ORT_DISABLE_ALL', 'basic': 'ORT_ENABLE_BASIC', 'extended': 'ORT_ENABLE_EXTENDED', 'all': 'ORT_ENABLE_ALL'}
+
+
+def session_options(graph_optimization=None):
+    """SessionOptions for every InsightFace sub-model, from the FACE_ORT_* settings."""
+    import onnxruntime
+
+    options = onnxruntime.SessionOptions()
+    options.intra_op_num_threads = parallelism()[1]
+    options.inter_op_num_threads = settings.FACE_ORT_INTER_OP_THREADS
+    options.execution_mode = getattr(onnxruntime.ExecutionMode, ORT_EXECUTION_MODES[settings.FACE_ORT_EXECUTION_MODE])
+    options.graph_optimization_level = getattr(
+        onnxruntime.GraphOptimizationLevel, ORT_OPTIMIZATION_LEVELS[graph_optimization or settings.FACE_ORT_GRAPH_OPTIMIZATION]
+    )
+    options.enable_cpu_mem_arena = settings.FACE_ORT_CPU_MEM_ARENA
+    options.enable_mem_pattern = settings.FACE_ORT_MEM_PATTERN
+    if not settings.FACE_ORT_ALLOW_SPINNING:
+        # Idle pool threads sleep instead of spinning on cores other workers need
+        options.add_session_config_entry('session.intra_op.allow_spinning', '0')
+        options.add_session_config_entry('session.inter_op.allow_spinning', '0')
+    if settings.FACE_ORT_INTRA_OP_THREAD_AFFINITIES:
+        options.add_session_config_entry('session.intra_op_thread_affinities', settings.FACE_ORT_INTRA_OP_THREAD_AFFINITIES)
+    return options
+
+
+def _optimized_model_path(onnx_file):
+    name = os.path.basename(onnx_file)[:-len('.onnx')]
+    return os.path.join(settings.FACE_ORT_OPTIMIZED_MODEL_DIR, f'{name}.{settings.FACE_ORT_GRAPH_OPTIMIZATION}.onnx')
+
+
+def _apply_model_metadata(model):
+    # Quantized and optimized files carry the input normalisation of the model they came from
+    metadata = model.session.get_modelmeta().custom_metadata_map
+    if 'input_mean' in metadata:
+        model.input_mean = float(metadata['input_mean'])
+        model.input_std = float(metadata['input_std'])
+
+
+def _save_optimized_model(model, written, cached):
+    import onnx
+
+    optimized = onnx.load(written)
+    onnx.helper.set_model_props(optimized, {'input_mean': str(model.input_mean), 'input_std': str(model.input_std)})
+    onnx.save(optimized, written)
+    os.replace(written, cached)
+
+
+def load_model(onnx_file):
+    """
+    One InsightFace sub-model (SCRFD, ArcFaceONNX, ...) on the CPU, or None
+    if unrecognised. With FACE_ORT_OPTIMIZED_MODEL_DIR set, the graph ONNX
+    Runtime optimizes on first load is saved there, and later loads read it
+    back with optimization off, which makes startup faster.
+    """
+    from insightface.model_zoo.model_zoo import ModelRouter
+
+    providers = ['CPUExecutionProvider']
+    cached = _optimized_model_path(onnx_file) if settings.FACE_ORT_OPTIMIZED_MODEL_DIR else None
+    if cached and os.path.exists(cached) and os.path.getmtime(cached) >= os.path.getmtime(onnx_file):
+        model = ModelRouter(cached).get_model(sess_options=session_options('disable'), providers=providers)
+        if model is not None:
+            _apply_model_metadata(model)
+        return model
+
+    options = session_options()
+    if cached:
+        os.makedirs(settings.FACE_ORT_OPTIMIZED_MODEL_DIR, exist_ok=True)
+        options.optimized_model_filepath = f'{cached}.{os.getpid()}.tmp'
+    model = ModelRouter(onnx_file).get_model(sess_options=options, providers=providers)
+    if model is not None:
+        _apply_model_metadata(model)
+    if cached and os.path.exists(options.optimized_model_filepath):
+        if model is None:
+            os.remove(options.optimized_model_filepath)
+        else:
+            try:
+                _save_optimized_model(model, options.optimized_model_filepath, cached)
+            except Exception:
+                logger.exception(f"Could not cache the optimized graph of {os.path.basename(onnx_file)}")
+    return model
+
+
+def _build_face_analysis():
+    from insightface.app import FaceAnalysis
+
+    # Same model discovery as FaceAnalysis.__init__, which has no way to pass
+    # SessionOptions through to the ONNX sessions it creates.
+    app = FaceAnalysis.__new__(FaceAnalysis)
+    app.models = {}
+    app.model_dir = model_dir()
+    for onnx_file in model_files(app.model_dir):
+        model = load_model(onnx_file)
+        if model is not None and model.taskname in settings.FACE_ANALYSIS_MODULES and model.taskname not in app.models:
+            app.models[model.taskname] = model
+    app.det_model = app.models['detection']
+    app.prepare(ctx_id=0, det_size=DETECTION_SIZE, det_thresh=DETECTION_THRESHOLD)
+    return app
+
+
+def model_version():
+    """
+    Identifies the models that detect and embed faces for this worker, so
+    results cached under it go stale when a model is replaced or quantized.
+    With FACE_INFERENCE_SOCKET set it comes from the inference server, which
+    owns the model files; the worker needs none of its own.
+    """
+    if settings.FACE_INFERENCE_SOCKET:
+        return request_model_version()
+    return local_model_version()
+
+
+def local_model_version():
+    """Digest of the name, size and modification time of every model file this process would serve."""
+    global _model_version
+    if _model_version is None:
+        digest = hashlib.sha256()
+        for path in model_files(model_dir()):
+            stat = os.stat(path)
+            digest.update(f'{os.path.basename(path)}:{stat.st_size}:{stat.st_mtime_ns};'.encode())
+        _model_version = digest.hexdigest()[:16]
+    return _model_version
+
+
+def get_face_analysis():
+    """
+    Return the process-wide InsightFace model, loading it on first use.
+
+    insightface (and onnxruntime behind it) is only imported here, so
+    management commands, URL resolution and tests that never run inference
+    don't pay for the model load.
+    """
+    global _face_analysis, _load_seconds
+    if _face_analysis is None:
+        with _lock:
+            if _face_analysis is None:
+                start = time.perf_counter()
+                app = _build_face_analysis()
+                _load_seconds = time.perf_counter() - start
+                _face_analysis = app
+    return _face_analysis
+
+
+def detection_windows(height, width):
+    """
+    Regions (x0, y0, x1, y1) the detector runs on for one image. Always the
+    whole image; with FACE_DETECTION_TILING = 'always', or 'auto' and a
+    longer side of at least FACE_DETECTION_TILING_MIN_SIDE, also overlapping
+    FACE_DETECTION_TILE_SIZE tiles, which the detector sees at full
+    resolution instead of shrunk to fit 640x640 with the rest of the photo.
+    """
+    windows = [(0, 0, width, height)]
+    mode = settings.FACE_DETECTION_TILING
+    tile = settings.FACE_DETECTION_TILE_SIZE
+    if mode == 'off' or (mode == 'auto' and max(height, width) < settings.FACE_DETECTION_TILING_MIN_SIDE):
+        return windows
+    if max(height, width) <= tile:
+        return windows
+    stride = max(1, int(tile * (1 - settings.FACE_DETECTION_TILE_OVERLAP)))
+
+    def starts(length):
+        if length <= tile:
+            return [0]
+        return list(range(0, length - tile, stride)) + [length - tile]
+
+    windows.extend((x, y, min(x + tile, width), min(y + tile, height)) for y in starts(height) for x in starts(width))
+    return windows
+
+
+def non_max_suppression(bboxes, threshold):
+    """Indices of the (n x 5) score-carrying boxes kept by greedy NMS."""
+    order = np.argsort(-bboxes[:, 4])
+    x0, y0, x1, y1 = bboxes[:, 0], bboxes[:, 1], bboxes[:, 2], bboxes[:, 3]
+    areas = (x1 - x0) * (y1 - y0)
+    keep = []
+    while len(order):
+        best, rest = order[0], order[1:]
+        keep.append(best)
+        width = np.clip(np.minimum(x1[best], x1[rest]) - np.maximum(x0[best], x0[rest]), 0, None)
+        height = np.clip(np.minimum(y1[best], y1[rest]) - np.maximum(y0[best], y0[rest]), 0, None)
+        intersection = width * height
+        order = rest[intersection / np.maximum(areas[best] + areas[rest] - intersection, 1e-6) <= threshold]
+    return np.array(keep, dtype=np.int64)
+
+
+# Tile detections this close to an inner tile edge are cut-off faces that a
+# neighbouring tile or the whole-image pass sees in full
+TILE_EDGE_MARGIN = 2
+
+
+def merge_window_detections(window_detections, height, width):
+    """
+    Combine (window, bboxes, kpss) detector outputs for one image into image
+    coordinates, dropping faces cut by a tile edge and duplicates (NMS).
+    """
+    merged_bboxes, merged_kpss = [], []
+    for (x0, y0, x1, y1), bboxes, kpss in window_detections:
+        if not len(bboxes):
+            continue
+        keep = np.ones(len(bboxes), dtype=bool)
+        if (x0, y0, x1, y1) != (0, 0, width, height):
+            keep &= (x0 == 0) | (bboxes[:, 0] > TILE_EDGE_MARGIN)
+            keep &= (y0 == 0) | (bboxes[:, 1] > TILE_EDGE_MARGIN)
+            keep &= (x1 == width) | (bboxes[:, 2] < x1 - x0 - TILE_EDGE_MARGIN)
+            keep &= (y1 == height) | (bboxes[:, 3] < y1 - y0 - TILE_EDGE_MARGIN)
+        offset = np.array([x0, y0], dtype=np.float32)
+        bboxes = bboxes[keep].copy()
+        bboxes[:, :4] += np.tile(offset, 2)
+        merged_bboxes.append(bboxes)
+        merged_kpss.append(kpss[keep] + offset)
+    if not merged_bboxes:
+        return np.empty((0, 5), dtype=np.float32), np.empty((0, 5, 2), dtype=np.float32)
+    bboxes, kpss = np.concatenate(merged_bboxes), np.concatenate(merged_kpss)
+    if len(window_detections) == 1:
+        return bboxes, kpss
+    keep = non_max_suppression(bboxes, settings.FACE_DETECTION_TILE_NMS_THRESHOLD)
+    return bboxes[keep], kpss[keep]
+
+
+def analyze_images(images, batch_size=None):
+    """
+    Detect and embed every face in each BGR image using the model in this
+    process. Detection runs per image, or per tile for large images (see
+    detection_windows), on the shared pool; the aligned crops of all faces
+    from all images then go through the recognition model in batches of
+    FACE_RECOGNITION_BATCH_SIZE instead of one ONNX call per face.
+    5-point keypoints are kept only when FACE_ANALYSIS_KEEP_KEYPOINTS is set.
+    """
+    from insightface.utils import face_align
+
+    app = get_face_analysis()
+    recognition = app.models['recognition']
+    batch_size = batch_size or settings.FACE_RECOGNITION_BATCH_SIZE
+    keep_keypoints = settings.FACE_ANALYSIS_KEEP_KEYPOINTS
+
+    # One flat list of detector runs, so tiles of one image and different
+    # images share the pool without nesting
+    windows = [(image_no, window) for image_no, image in enumerate(images) for window in detection_windows(*image.shape[:2])]
+
+    def detect(job):
+        image_no, (x0, y0, x1, y1) = job
+        return app.det_model.detect(images[image_no][y0:y1, x0:x1], max_num=0, metric='default')
+
+    window_detections = [[] for _ in images]
+    for (image_no, window), (bboxes, kpss) in zip(windows, map_parallel(detect, windows)):
+        window_detections[image_no].append((window, bboxes, kpss))
+
+    def align(image_no):
+        image = images[image_no]
+        bboxes, kpss = merge_window_detections(window_detections[image_no], *image.shape[:2])
+        crops = [face_align.norm_crop(image, landmark=kps, image_size=recognition.input_size[0]) for kps in kpss]
+        return bboxes, kpss, crops
+
+    detections = []
+    crops = []
+    for image_no, (bboxes, kpss, image_crops) in enumerate(map_parallel(align, range(len(images)))):
+        detections.extend((image_no, bbox, kps) for bbox, kps in zip(bboxes, kpss))
+        crops.extend(image_crops)
+
+    results = [[] for _ in images]
+    if not crops:
+        return results
+    embeddings = np.concatenate([
+        recognition.get_feat(crops[start:start + batch_size]) for start in range(0, len(crops), batch_size)
+    ])
+    embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+    for (image_no, bbox, kps), embedding in zip(detections, embeddings):
+        results[image_no].append(DetectedFace(bbox[:4], kps if keep_keypoints else None, float(bbox[4]), embedding))
+    return results
+
+
+def get_faces_batch(images):
+    """
+    Detect and embed every face in each BGR image, through the shared
+    inference server when FACE_INFERENCE_SOCKET is set, otherwise in this
+    process. Returns one DetectedFace list per image.
+    """
+    if settings.FACE_INFERENCE_SOCKET:
+        return request_faces(images)
+    return analyze_images(images)
+
+
+def get_faces(image):
+    return get_faces_batch([image])[0]
+
+
+def is_model_loaded():
+    return _face_analysis is not None
+
+
+def warmup():
+    """Load the model in this process and run one inference so the first request isn't slow."""
+    analyze_images([np.zeros((640, 640, 3), dtype=np.uint8)])
+    return _load_seconds
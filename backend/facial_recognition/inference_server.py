@@ -0,0 +1,169 @@
+import logging
+import os
+import queue
+import threading
+import time
+from multiprocessing.connection import Client, Listener
+from multiprocessing import AuthenticationError
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+_client = threading.local()
+
+# Sent instead of a list of images to ask for the served models' version
+MODEL_VERSION_REQUEST = 'model_version'
+
+
+class InferenceServerError(Exception):
+    pass
+
+
+def _request(message):
+    """
+    Send one message to the inference server and return its reply's payload.
+    Each thread keeps its own connection and reconnects once if the server
+    restarted since the last call.
+    """
+    for attempt in range(2):
+        connection = getattr(_client, 'connection', None)
+        try:
+            if connection is None:
+                connection = _client.connection = Client(
+                    settings.FACE_INFERENCE_SOCKET, family='AF_UNIX', authkey=settings.FACE_INFERENCE_AUTHKEY.encode()
+                )
+                # A restarted server may serve different models
+                _client.model_version = None
+            connection.send(message)
+            outcome, payload = connection.recv()
+            break
+        except (EOFError, OSError) as e:
+            if connection is not None:
+                connection.close()
+            _client.connection = None
+            if attempt:
+                raise InferenceServerError(f"Inference server unavailable: {str(e)}") from e
+    if outcome == 'error':
+        raise InferenceServerError(payload)
+    return payload
+
+
+def request_faces(images):
+    """Client shim: send a list of BGR images to the inference server and return one DetectedFace list per image."""
+    return _request(images)
+
+
+def request_model_version():
+    """Version of the models the inference server runs, asked once per connection."""
+    version = getattr(_client, 'model_version', None)
+    if version is None:
+        version = _request(MODEL_VERSION_REQUEST)
+        _client.model_version = version
+    return version
+
+
+class InferenceServer:
+    """
+    Owns the only copy of the face model and serves get_faces requests from
+    every Django worker over a Unix socket.
+
+    Each connection is read by its own thread, but all requests go through one
+    queue and one inference thread, so workers never compete for CPU cores
+    with separate ONNX sessions. Up to batch_size requests that arrive within
+    batch_wait of each other are run together, so their face crops share
+    recognition batches.
+    """
+
+    def __init__(self, address, authkey, batch_size=8, batch_wait=0.005):
+        self.address = address
+        self.authkey = authkey
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self._requests = queue.Queue()
+
+    def serve_forever(self):
+        if os.path.exists(self.address):
+            os.remove(self.address)
+        listener = Listener(self.address, family='AF_UNIX', authkey=self.authkey)
+        threading.Thread(target=self._run_batches, daemon=True).start()
+        logger.info(f"Inference server listening on {self.address}")
+        try:
+            while True:
+                try:
+                    connection = listener.accept()
+                except AuthenticationError:
+                    logger.warning("Rejected inference client with a bad authkey")
+                    continue
+                threading.Thread(target=self._serve_connection, args=(connection,), daemon=True).start()
+        finally:
+            listener.close()
+
+    def _serve_connection(self, connection):
+        try:
+            while True:
+                images = connection.recv()
+                if images == MODEL_VERSION_REQUEST:
+                    connection.send(self._model_version())
+                    continue
+                reply = {}
+                done = threading.Event()
+                self._requests.put((images, reply, done))
+                done.wait()
+                connection.send(reply['result'])
+        except (EOFError, OSError):
+            pass
+        finally:
+            connection.close()
+
+    def _model_version(self):
+        from .inference import local_model_version
+
+        try:
+            return ('ok', local_model_version())
+        except Exception as e:
+            logger.exception("Could not read the model version")
+            return ('error', str(e))
+
+    def _next_batch(self):
+        batch = [self._requests.get()]
+        deadline = time.monotonic() + self.batch_wait
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self._requests.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run_batches(self):
+        from .inference import analyze_images
+
+        while True:
+            batch = self._next_batch()
+            try:
+                faces = analyze_images([image for images, _, _ in batch for image in images])
+                results = []
+                for images, _, _ in batch:
+                    results.append(('ok', faces[:len(images)]))
+                    faces = faces[len(images):]
+            except Exception as e:
+                if len(batch) == 1:
+                    logger.exception("Inference request failed")
+                    results = [('error', str(e))]
+                else:
+                    # Run each request alone so one bad image doesn't fail the others batched with it
+                    logger.warning("Inference batch failed, retrying its requests one by one", exc_info=True)
+                    results = [self._run_alone(analyze_images, images) for images, _, _ in batch]
+            for (_, reply, done), result in zip(batch, results):
+                reply['result'] = result
+                done.set()
+
+    @staticmethod
+    def _run_alone(analyze_images, images):
+        try:
+            return ('ok', analyze_images(images))
+        except Exception as e:
+            logger.exception("Inference request failed")
+            return ('error', str(e))
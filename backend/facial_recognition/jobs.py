@@ -0,0 +1,54 @@
+import logging
+import os
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from .inference import SharedPool
+from .metrics import timed_request
+from .models import VideoAttendanceJob
+
+logger = logging.getLogger(__name__)
+
+_pool = SharedPool('video-job', lambda: settings.VIDEO_JOB_WORKERS)
+
+
+def submit_video_job(job, video_path):
+    """
+    Queue a saved video for processing on the local job pool. The job runs
+    independently of the request that submitted it, so a client disconnect
+    or proxy timeout doesn't cancel it. It is queued once the surrounding
+    transaction (if any) commits, so the worker always sees the job row.
+    """
+    transaction.on_commit(lambda: _pool.submit(run_video_job, job.pk, video_path))
+
+
+def run_video_job(job_id, video_path):
+    from .views import process_attendance_video, VideoProcessingError
+
+    jobs = VideoAttendanceJob.objects.filter(pk=job_id)
+
+    def update(**fields):
+        # QuerySet.update() skips auto_now, so stamp updated_at for clients polling the job
+        jobs.update(updated_at=timezone.now(), **fields)
+
+    try:
+        update(status='processing')
+        attendance_status, school_class_id = jobs.values_list('attendance_status', 'school_class_id').get()
+
+        def progress(frames_done, frames_total, faces_found):
+            update(frames_done=frames_done, frames_total=frames_total, faces_found=faces_found)
+
+        with timed_request('video_job'):
+            recognized_student_ids = process_attendance_video(
+                video_path, attendance_status, progress=progress, school_class_id=school_class_id
+            )
+        update(status='completed', recognized_students=sorted(recognized_student_ids))
+    except VideoProcessingError as e:
+        logger.error(f"Video job {job_id} rejected: {str(e)}")
+        update(status='failed', error=str(e))
+    except Exception as e:
+        logger.exception(f"Video job {job_id} failed")
+        update(status='failed', error=f"Error processing video: {str(e)}")
+    finally:
+        if os.path.exists(video_path):
+            os.remove(video_path)
@@ -0,0 +1,249 @@
+import csv
+import json
+import os
+import platform
+import statistics
+import subprocess
+import tempfile
+from datetime import date, datetime, timezone
+import cv2
+import numpy as np
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.test import override_settings
+from facial_recognition.gallery import face_gallery
+from facial_recognition.inference import detection_windows, get_face_analysis, map_parallel
+from facial_recognition.management.timing import timed_runs
+from facial_recognition.models import FacePrototype, StudentProfile
+from facial_recognition.views import decode_upload, mark_recognized_students, match_detected_faces
+from users.models import CustomUser
+
+STAGES = ['decode', 'detect', 'embed', 'match', 'persist']
+USERNAME_PREFIX = 'benchmark-student-'
+
+
+class _Rollback(Exception):
+    pass
+
+
+def _classroom_jpeg(width, height, seed):
+    # Smooth random texture: compresses and decodes like a photo, unlike white noise
+    rng = np.random.default_rng(seed)
+    small = rng.integers(0, 255, size=(height // 16, width // 16, 3), dtype=np.uint8)
+    image = cv2.GaussianBlur(cv2.resize(small, (width, height), interpolation=cv2.INTER_CUBIC), (5, 5), 0)
+    return cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, 90])[1].tobytes()
+
+
+def _run_with_commit_callbacks(run):
+    """
+    Run `run`, then the on_commit callbacks it registered (and any those
+    register), which the benchmark's rolled-back transaction would drop.
+    """
+    connection = transaction.get_connection()
+    start = len(connection.run_on_commit)
+    run()
+    while len(connection.run_on_commit) > start:
+        _, callback, _ = connection.run_on_commit.pop(start)
+        callback()
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True, cwd=settings.BASE_DIR
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = (
+        "Time the attendance pipeline stage by stage (decode, detect, embed, match, persist) for synthetic "
+        "galleries and classroom photos, and write a JSON or CSV report that can be compared between commits. "
+        "Gallery rows are created in a transaction that is rolled back."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--gallery-sizes', type=int, nargs='+', default=[100, 1000, 10000, 50000], help="Enrolled students.")
+        parser.add_argument('--faces', type=int, nargs='+', default=[1, 10, 30, 60], help="Faces per classroom photo.")
+        parser.add_argument('--image', help="Classroom photo to decode and detect on instead of a generated 1920x1080 one.")
+        parser.add_argument('--stages', nargs='+', choices=STAGES, default=STAGES,
+                            help="Leave out detect and embed to run without the face model.")
+        parser.add_argument('--iterations', type=int, default=5, help="Timed runs per measurement; the median is reported.")
+        parser.add_argument('--output', help="Write the report here; .csv for CSV, anything else for JSON.")
+        parser.add_argument('--compare', help="Earlier JSON report to compare against.")
+        parser.add_argument('--max-regression', type=float, default=0.2,
+                            help="With --compare, fail if a stage got slower than this fraction.")
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        self.rng = np.random.default_rng(options['seed'])
+        self.iterations = options['iterations']
+        stages = options['stages']
+        if options['image']:
+            with open(options['image'], 'rb') as image_file:
+                jpeg = image_file.read()
+        else:
+            jpeg = _classroom_jpeg(1920, 1080, options['seed'])
+        image = decode_upload(ContentFile(jpeg))
+
+        # Decode, detect and embed don't depend on the gallery, so they are timed once
+        per_image = {}
+        if 'decode' in stages:
+            per_image['decode'] = self._time(lambda: decode_upload(ContentFile(jpeg)))
+        if 'detect' in stages:
+            per_image['detect'] = self._time_detection(image)
+        embed = {}
+        if 'embed' in stages:
+            recognition = get_face_analysis().models['recognition']
+            for faces in options['faces']:
+                crops = [self.rng.integers(0, 255, size=(112, 112, 3), dtype=np.uint8) for _ in range(faces)]
+                batch_size = settings.FACE_RECOGNITION_BATCH_SIZE
+                embed[faces] = self._time(lambda: [recognition.get_feat(crops[start:start + batch_size]) for start in range(0, faces, batch_size)])
+
+        rows = []
+        for gallery_size in options['gallery_sizes']:
+            for faces, timings in self._time_gallery(gallery_size, options['faces'], image, stages).items():
+                row = {'gallery_size': gallery_size, 'faces': faces, **{f'{stage}_ms': None for stage in STAGES}}
+                for stage, seconds in {**per_image, 'embed': embed.get(faces), **timings}.items():
+                    if seconds is not None:
+                        row[f'{stage}_ms'] = round(seconds * 1000, 3)
+                row['total_ms'] = round(sum(row[f'{stage}_ms'] or 0 for stage in STAGES), 3)
+                rows.append(row)
+                self._print_row(row, header=len(rows) == 1)
+
+        report = {
+            'commit': _git_commit(),
+            'created_at': datetime.now(timezone.utc).isoformat(),
+            'host': {'python': platform.python_version(), 'machine': platform.machine(), 'cores': os.cpu_count()},
+            'settings': {
+                name: getattr(settings, name, None)
+                for name in ('FACE_GALLERY_INDEX', 'FACE_MODEL_PRECISION', 'FACE_DECODE_MAX_SIDE', 'FACE_DETECTION_TILING',
+                             'FACE_RECOGNITION_BATCH_SIZE', 'FACE_ORT_INTRA_OP_THREADS', 'FACE_DETECTION_WORKERS')
+            },
+            'image': options['image'] or 'generated 1920x1080',
+            'iterations': self.iterations,
+            'results': rows,
+        }
+        if options['output']:
+            self._write_report(report, options['output'])
+        if options['compare']:
+            self._compare(report, options['compare'], options['max_regression'])
+
+    def _time(self, run):
+        _, samples = timed_runs(run, self.iterations)
+        return statistics.median(samples)
+
+    def _time_detection(self, image):
+        # The detector runs of analyze_images, without alignment and recognition
+        app = get_face_analysis()
+        windows = detection_windows(*image.shape[:2])
+        return self._time(lambda: map_parallel(
+            lambda window: app.det_model.detect(image[window[1]:window[3], window[0]:window[2]], max_num=0, metric='default'),
+            windows,
+        ))
+
+    def _time_gallery(self, gallery_size, face_counts, image, stages):
+        timings = {faces: {} for faces in face_counts}
+        if 'match' not in stages and 'persist' not in stages:
+            return timings
+        self.stdout.write(f"Building a gallery of {gallery_size} students...")
+        try:
+            # Crops go to a scratch media directory; rows are rolled back below
+            with tempfile.TemporaryDirectory() as media_root, override_settings(MEDIA_ROOT=media_root, FACE_WRITER_WORKERS=0), transaction.atomic():
+                prototypes = self._create_gallery(gallery_size)
+                face_gallery.invalidate()
+                face_gallery.refresh()
+                for faces in face_counts:
+                    embeddings = self._face_embeddings(prototypes, faces)
+                    if 'match' in stages:
+                        timings[faces]['match'] = self._time(lambda: face_gallery.match(embeddings))
+                    if 'persist' in stages:
+                        timings[faces]['persist'] = self._time_persist(image, embeddings)
+                raise _Rollback
+        except _Rollback:
+            pass
+        finally:
+            face_gallery.invalidate()
+        return timings
+
+    def _create_gallery(self, size):
+        users = CustomUser.objects.bulk_create(
+            [CustomUser(username=f'{USERNAME_PREFIX}{number}', email=None, role='student') for number in range(size)], batch_size=2000
+        )
+        students = StudentProfile.objects.bulk_create([StudentProfile(user=user) for user in users], batch_size=2000)
+        embeddings = self.rng.normal(size=(size, 512)).astype(np.float32)
+        embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+        FacePrototype.objects.bulk_create(
+            [FacePrototype(student=student, embedding=embedding, num_samples=1) for student, embedding in zip(students, embeddings)],
+            batch_size=2000,
+        )
+        return embeddings
+
+    def _face_embeddings(self, prototypes, faces):
+        # Enrolled students photographed with varying noise, so matches land in
+        # every band (learned from, sent for review, unrecognized), plus strangers
+        chosen = prototypes[self.rng.integers(0, len(prototypes), size=faces)]
+        noise = self.rng.normal(size=chosen.shape) * self.rng.uniform(0.0, 1.5, size=(faces, 1)) / np.sqrt(chosen.shape[1])
+        embeddings = chosen + noise
+        strangers = self.rng.random(faces) < 0.1
+        embeddings[strangers] = self.rng.normal(size=(strangers.sum(), chosen.shape[1]))
+        return (embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)).astype(np.float32)
+
+    def _time_persist(self, image, embeddings):
+        # Everything match_detected_faces and MarkAttendanceView write, with
+        # the face writer's work run inline instead of after the response
+        height, width = image.shape[:2]
+        boxes = [(0, 0, min(width, 112), min(height, 112))] * len(embeddings)
+        detections = [(image, box, embedding) for box, embedding in zip(boxes, embeddings)]
+
+        def persist():
+            recognized_student_ids = set()
+            match_detected_faces(detections, recognized_student_ids)
+            mark_recognized_students(recognized_student_ids, 'onTime', date.today(), 'Benchmark')
+
+        # match_detected_faces repeats the gallery search, which the match stage already counts
+        return self._time(lambda: _run_with_commit_callbacks(persist)) - self._time(lambda: face_gallery.match(embeddings))
+
+    def _print_row(self, row, header=False):
+        if header:
+            self.stdout.write(f"{'gallery':>8} {'faces':>6} " + " ".join(f"{stage + ' ms':>11}" for stage in STAGES + ['total']))
+        values = " ".join(f"{row[f'{stage}_ms']:>11.2f}" if row[f'{stage}_ms'] is not None else f"{'-':>11}" for stage in STAGES + ['total'])
+        self.stdout.write(f"{row['gallery_size']:>8} {row['faces']:>6} {values}")
+
+    def _write_report(self, report, path):
+        with open(path, 'w', newline='') as output:
+            if path.endswith('.csv'):
+                writer = csv.DictWriter(output, fieldnames=['commit', *report['results'][0]])
+                writer.writeheader()
+                for row in report['results']:
+                    writer.writerow({'commit': report['commit'], **row})
+            else:
+                json.dump(report, output, indent=2)
+        self.stdout.write(f"Report written to {path}")
+
+    def _compare(self, report, path, max_regression):
+        with open(path) as baseline_file:
+            baseline = json.load(baseline_file)
+        previous = {(row['gallery_size'], row['faces']): row for row in baseline['results']}
+        regressions = []
+        self.stdout.write(f"Compared with {baseline.get('commit') or path}:")
+        for row in report['results']:
+            old = previous.get((row['gallery_size'], row['faces']))
+            if old is None:
+                continue
+            changes = []
+            for stage in STAGES + ['total']:
+                before, after = old.get(f'{stage}_ms'), row[f'{stage}_ms']
+                if not before or after is None:
+                    continue
+                change = after / before - 1
+                changes.append(f"{stage} {change:+.0%}")
+                if change > max_regression:
+                    regressions.append(f"{stage} at {row['gallery_size']} students/{row['faces']} faces ({change:+.0%})")
+            self.stdout.write(f"{row['gallery_size']:>8} {row['faces']:>6}  " + ", ".join(changes))
+        if regressions:
+            raise CommandError("Slower than the baseline: " + "; ".join(regressions))
+        self.stdout.write(self.style.SUCCESS("No stage regressed beyond the limit."))
@@ -0,0 +1,51 @@
+import multiprocessing
+import resource
+import statistics
+import cv2
+from django.core.management.base import BaseCommand, CommandError
+from facial_recognition.inference import DETECTION_SIZE, DETECTION_THRESHOLD
+from facial_recognition.management.timing import timed_runs
+
+CONFIGURATIONS = {
+    'all': None,
+    'detection+recognition': ['detection', 'recognition'],
+}
+
+
+def _measure(allowed_modules, image_path, iterations, results):
+    # Runs in a fresh process so peak RSS reflects only this configuration
+    from insightface.app import FaceAnalysis
+    image = cv2.imread(image_path)
+    baseline_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    app = FaceAnalysis(name='buffalo_l', allowed_modules=allowed_modules, providers=['CPUExecutionProvider'])
+    app.prepare(ctx_id=0, det_size=DETECTION_SIZE, det_thresh=DETECTION_THRESHOLD)
+    faces, samples = timed_runs(lambda: app.get(image), iterations)
+    results.put({
+        'faces': len(faces),
+        'ms_per_image': statistics.mean(samples) * 1000,
+        'model_rss_mb': (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline_kb) / 1024,
+    })
+
+
+class Command(BaseCommand):
+    help = "Compare per-face latency and memory of the full buffalo_l pack against detection+recognition only (CPU)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('image', help="Path to a photo containing one or more faces.")
+        parser.add_argument('--iterations', type=int, default=20)
+
+    def handle(self, *args, **options):
+        if cv2.imread(options['image']) is None:
+            raise CommandError(f"Cannot read image {options['image']}.")
+        context = multiprocessing.get_context('spawn')
+        self.stdout.write(f"{'modules':>22} {'faces':>6} {'ms/image':>9} {'ms/face':>8} {'model RSS MB':>13}")
+        for name, allowed_modules in CONFIGURATIONS.items():
+            results = context.Queue()
+            process = context.Process(target=_measure, args=(allowed_modules, options['image'], options['iterations'], results))
+            process.start()
+            result = results.get()
+            process.join()
+            ms_per_face = result['ms_per_image'] / max(result['faces'], 1)
+            self.stdout.write(
+                f"{name:>22} {result['faces']:>6} {result['ms_per_image']:>9.1f} {ms_per_face:>8.1f} {result['model_rss_mb']:>13.0f}"
+            )
@@ -0,0 +1,50 @@
+import time
+import numpy as np
+from django.core.management.base import BaseCommand
+from facial_recognition.ann import IVFIndex, normalize_rows
+
+
+class Command(BaseCommand):
+    help = "Report recall and latency of the IVF gallery index against exact search on synthetic embeddings."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[2000, 20000, 100000])
+        parser.add_argument('--queries', type=int, default=200)
+        parser.add_argument('--batch', type=int, default=40, help="Faces matched per call, as in one classroom photo.")
+        parser.add_argument('--nprobe', type=int, nargs='+', default=[1, 4, 8, 16, 32])
+        parser.add_argument('--dim', type=int, default=512)
+        parser.add_argument('--noise', type=float, default=0.05, help="Per-dimension noise added to each query face.")
+        parser.add_argument('--clusters', type=int, default=0,
+                            help="Draw students around this many population centres instead of uniformly (0 = uniform, the worst case for IVF).")
+
+    def handle(self, *args, **options):
+        rng = np.random.default_rng(0)
+        self.stdout.write(f"{'students':>9} {'method':>12} {'recall@1':>9} {'ms/batch':>9} {'build s':>8}")
+        for size in options['sizes']:
+            gallery = rng.normal(size=(size, options['dim']))
+            if options['clusters']:
+                centres = rng.normal(size=(options['clusters'], options['dim']))
+                gallery = 2 * centres[rng.integers(0, options['clusters'], size)] + gallery
+            gallery = normalize_rows(gallery)
+            keys = np.arange(size)
+            truth = rng.integers(0, size, options['queries'])
+            queries = normalize_rows(gallery[truth] + rng.normal(scale=options['noise'], size=(len(truth), options['dim'])))
+            batches = [queries[i:i + options['batch']] for i in range(0, len(queries), options['batch'])]
+
+            start = time.perf_counter()
+            exact = np.concatenate([(batch @ gallery.T).argmax(axis=1) for batch in batches])
+            exact_ms = (time.perf_counter() - start) * 1000 / len(batches)
+            self._row(size, 'exact', np.mean(exact == truth), exact_ms, 0)
+
+            start = time.perf_counter()
+            index = IVFIndex(gallery, keys)
+            build_s = time.perf_counter() - start
+            for nprobe in options['nprobe']:
+                start = time.perf_counter()
+                found = np.concatenate([index.search(batch, nprobe=nprobe)[0] for batch in batches])
+                ms = (time.perf_counter() - start) * 1000 / len(batches)
+                # Recall is measured against the exact search result
+                self._row(size, f'ivf/{nprobe}', np.mean(found == exact), ms, build_s)
+
+    def _row(self, size, method, recall, ms, build_s):
+        self.stdout.write(f"{size:>9} {method:>12} {recall:>9.3f} {ms:>9.2f} {build_s:>8.2f}")
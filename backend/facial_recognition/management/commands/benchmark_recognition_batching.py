@@ -0,0 +1,31 @@
+import statistics
+import cv2
+from django.core.management.base import BaseCommand, CommandError
+from facial_recognition.inference import analyze_images, get_face_analysis
+from facial_recognition.management.timing import timed_runs
+
+
+class Command(BaseCommand):
+    help = "Compare faces/second of per-face recognition (FaceAnalysis.get) against the batched pipeline."
+
+    def add_arguments(self, parser):
+        parser.add_argument('images', nargs='+', help="Classroom photos, processed together like one upload.")
+        parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 8, 16, 32, 64])
+        parser.add_argument('--iterations', type=int, default=5)
+
+    def handle(self, *args, **options):
+        images = [cv2.imread(path) for path in options['images']]
+        if any(image is None for image in images):
+            raise CommandError("Cannot read one of the images.")
+        app = get_face_analysis()
+
+        def timed(run):
+            faces, samples = timed_runs(run, options['iterations'])
+            return sum(len(image_faces) for image_faces in faces), statistics.mean(samples)
+
+        self.stdout.write(f"{'path':>16} {'faces':>6} {'s/upload':>9} {'faces/s':>8}")
+        faces, seconds = timed(lambda: [app.get(image) for image in images])
+        self.stdout.write(f"{'per-face':>16} {faces:>6} {seconds:>9.3f} {faces / seconds:>8.1f}")
+        for batch_size in options['batch_sizes']:
+            faces, seconds = timed(lambda: analyze_images(images, batch_size=batch_size))
+            self.stdout.write(f"{f'batched/{batch_size}':>16} {faces:>6} {seconds:>9.3f} {faces / seconds:>8.1f}")
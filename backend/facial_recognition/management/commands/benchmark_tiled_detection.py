@@ -0,0 +1,35 @@
+import statistics
+import cv2
+from django.core.management.base import BaseCommand, CommandError
+from django.test import override_settings
+from facial_recognition.imaging import downscale
+from facial_recognition.inference import analyze_images, detection_windows, get_face_analysis
+from facial_recognition.management.timing import timed_runs
+
+
+class Command(BaseCommand):
+    help = "Compare faces found and wall time of single-pass and tiled detection across image sizes."
+
+    def add_arguments(self, parser):
+        parser.add_argument('images', nargs='+', help="High-resolution classroom photos.")
+        parser.add_argument('--sizes', type=int, nargs='+', default=[1280, 2048, 3072, 4096],
+                            help="Longer sides to scale each photo down to before detection.")
+        parser.add_argument('--iterations', type=int, default=3)
+
+    def handle(self, *args, **options):
+        get_face_analysis()
+        self.stdout.write(f"{'image':>20} {'size':>9} {'mode':>7} {'windows':>8} {'faces':>6} {'seconds':>8}")
+        for path in options['images']:
+            original = cv2.imread(path)
+            if original is None:
+                raise CommandError(f"Cannot read {path}.")
+            for size in options['sizes']:
+                image = downscale(original, size)
+                for mode in ('off', 'always'):
+                    with override_settings(FACE_DETECTION_TILING=mode):
+                        faces, samples = timed_runs(lambda: analyze_images([image])[0], options['iterations'])
+                        seconds = statistics.mean(samples)
+                        windows = len(detection_windows(*image.shape[:2]))
+                    self.stdout.write(
+                        f"{path[-20:]:>20} {image.shape[1]}x{image.shape[0]:<4} {mode:>7} {windows:>8} {len(faces):>6} {seconds:>8.2f}"
+                    )
@@ -0,0 +1,80 @@
+import time
+import cv2
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from facial_recognition.imaging import downscale
+from facial_recognition.video import SAMPLING_POLICIES, iter_sampled_frames
+
+
+class Command(BaseCommand):
+    help = "Compare decode time per minute of video for seek-based frame sampling and the single-pass streaming decoder."
+
+    def add_arguments(self, parser):
+        parser.add_argument('video')
+        parser.add_argument('--policies', nargs='+', choices=SAMPLING_POLICIES, default=list(SAMPLING_POLICIES))
+        parser.add_argument('--max-frames', type=int, default=settings.VIDEO_MAX_SAMPLED_FRAMES)
+        parser.add_argument('--iterations', type=int, default=3)
+
+    def open(self, path):
+        cap = cv2.VideoCapture(path)
+        if not cap.isOpened():
+            raise CommandError(f"Cannot open {path}.")
+        return cap
+
+    def timed(self, run):
+        best = None
+        for _ in range(self.options['iterations']):
+            start = time.perf_counter()
+            indices = run()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        return indices, best
+
+    def stream(self, policy):
+        cap = self.open(self.options['video'])
+        try:
+            return [index for index, _ in iter_sampled_frames(
+                cap,
+                policy=policy,
+                every_n=settings.VIDEO_SAMPLE_EVERY_N_FRAMES,
+                samples_per_second=settings.VIDEO_SAMPLES_PER_SECOND,
+                scene_threshold=settings.VIDEO_SCENE_CHANGE_THRESHOLD,
+                max_frames=self.options['max_frames'],
+                max_side=settings.VIDEO_MAX_FRAME_SIDE,
+            )]
+        finally:
+            cap.release()
+
+    def seek(self, indices):
+        # The previous approach: jump to each frame with CAP_PROP_POS_FRAMES
+        cap = self.open(self.options['video'])
+        try:
+            for index in indices:
+                cap.set(cv2.CAP_PROP_POS_FRAMES, index)
+                ret, frame = cap.read()
+                if ret:
+                    downscale(frame, settings.VIDEO_MAX_FRAME_SIDE)
+            return indices
+        finally:
+            cap.release()
+
+    def handle(self, *args, **options):
+        self.options = options
+        cap = self.open(options['video'])
+        frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        fps = cap.get(cv2.CAP_PROP_FPS) or 25
+        width, height = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        cap.release()
+        minutes = frame_count / fps / 60
+        if minutes <= 0:
+            raise CommandError("Video reports no frames.")
+        self.stdout.write(f"{width}x{height}, {frame_count} frames at {fps:.1f} fps ({minutes * 60:.1f}s)")
+
+        self.stdout.write(f"{'policy':>10} {'frames':>7} {'seek s/min':>11} {'stream s/min':>13} {'speedup':>8}")
+        for policy in options['policies']:
+            indices, stream_seconds = self.timed(lambda: self.stream(policy))
+            _, seek_seconds = self.timed(lambda: self.seek(indices))
+            self.stdout.write(
+                f"{policy:>10} {len(indices):>7} {seek_seconds / minutes:>11.3f} "
+                f"{stream_seconds / minutes:>13.3f} {seek_seconds / stream_seconds:>7.1f}x"
+            )
@@ -0,0 +1,14 @@
+import time
+from django.core.management.base import BaseCommand
+from facial_recognition.clustering import recluster_unrecognized_faces
+
+
+class Command(BaseCommand):
+    help = "Re-cluster all open unrecognized faces for bulk review. Run periodically, e.g. nightly from cron."
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        faces, clusters = recluster_unrecognized_faces()
+        self.stdout.write(self.style.SUCCESS(
+            f"Clustered {faces} unrecognized faces into {clusters} clusters in {time.perf_counter() - start:.2f}s."
+        ))
@@ -0,0 +1,261 @@
+import os
+import random
+import shutil
+import tempfile
+import cv2
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from facial_recognition.imaging import decode_image
+from facial_recognition.inference import DETECTION_SIZE, DETECTION_THRESHOLD, INT8_SUFFIX, load_model, model_dir
+from facial_recognition.management.timing import timed_runs
+from facial_recognition.models import FaceImage
+from facial_recognition.tracking import box_iou
+from facial_recognition.views import HIGH_CONFIDENCE_THRESHOLD, SIMILARITY_THRESHOLD
+
+
+def _detection_blob(detector, image):
+    # Same letterboxing and normalisation as SCRFD.detect
+    image_ratio = image.shape[0] / image.shape[1]
+    if image_ratio > DETECTION_SIZE[1] / DETECTION_SIZE[0]:
+        height = DETECTION_SIZE[1]
+        width = int(height / image_ratio)
+    else:
+        width = DETECTION_SIZE[0]
+        height = int(width * image_ratio)
+    letterboxed = np.zeros((DETECTION_SIZE[1], DETECTION_SIZE[0], 3), dtype=np.uint8)
+    letterboxed[:height, :width] = cv2.resize(image, (width, height))
+    mean = (detector.input_mean,) * 3
+    return cv2.dnn.blobFromImage(letterboxed, 1.0 / detector.input_std, DETECTION_SIZE, mean, swapRB=True)
+
+
+def _recognition_blob(recognizer, crop):
+    mean = (recognizer.input_mean,) * 3
+    return cv2.dnn.blobFromImage(crop, 1.0 / recognizer.input_std, recognizer.input_size, mean, swapRB=True)
+
+
+def _calibration_reader(input_name, blobs):
+    from onnxruntime.quantization import CalibrationDataReader
+
+    class Reader(CalibrationDataReader):
+        def __init__(self):
+            self._blobs = iter(blobs)
+
+        def get_next(self):
+            blob = next(self._blobs, None)
+            return None if blob is None else {input_name: blob}
+
+    return Reader()
+
+
+def _quantize(source, target, method, model, calibration_blobs):
+    import onnx
+    import onnx.version_converter
+    from onnxruntime.quantization import QuantFormat, QuantType, quantize_dynamic, quantize_static
+    from onnxruntime.quantization.shape_inference import quant_pre_process
+
+    if method == 'dynamic':
+        # ConvInteger, which dynamic quantization emits for convolutions, only takes uint8 weights on CPU
+        quantize_dynamic(source, target, weight_type=QuantType.QUInt8)
+    else:
+        prepared = f'{target}.prep.onnx'
+        original = onnx.load(source)
+        if next(opset.version for opset in original.opset_import if opset.domain in ('', 'ai.onnx')) < 13:
+            # Per-channel QDQ needs the axis attribute of opset 13's (De)QuantizeLinear
+            original = onnx.version_converter.convert_version(original, 13)
+        onnx.save(original, prepared)
+        quant_pre_process(prepared, prepared, skip_symbolic_shape=True)
+        try:
+            quantize_static(
+                prepared, target, _calibration_reader(model.input_name, calibration_blobs),
+                quant_format=QuantFormat.QDQ, per_channel=True,
+                activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8,
+            )
+        finally:
+            os.remove(prepared)
+    # ArcFaceONNX guesses input normalisation from the first graph nodes, which
+    # quantization rewrites; record the FP32 values for load_model to apply
+    quantized = onnx.load(target)
+    onnx.helper.set_model_props(quantized, {'input_mean': str(model.input_mean), 'input_std': str(model.input_std)})
+    onnx.save(quantized, target)
+
+
+def _timed(func, items):
+    results, [seconds] = timed_runs(lambda: [func(item) for item in items], warmup=lambda: func(items[0]))
+    return results, seconds
+
+
+def _band(similarity):
+    """0 unrecognized, 1 sent for review, 2 recognized and learned from, as in match_detected_faces."""
+    return int(similarity >= SIMILARITY_THRESHOLD) + int(similarity >= HIGH_CONFIDENCE_THRESHOLD)
+
+
+def _leave_one_out(embeddings, labels):
+    """Best match of each face against the mean of every student's other faces: (student, similarity) arrays."""
+    students = sorted(set(labels))
+    sums = np.stack([embeddings[labels == student].sum(axis=0) for student in students])
+    counts = np.array([(labels == student).sum() for student in students])
+    own = np.searchsorted(students, labels)
+    best_students, best_similarities = [], []
+    for embedding, row in zip(embeddings, own):
+        means = sums.copy()
+        means[row] -= embedding
+        means /= np.maximum(counts - (np.arange(len(students)) == row), 1)[:, None]
+        norms = np.linalg.norm(means, axis=1)
+        similarities = np.where(norms > 0, means @ embedding / np.maximum(norms, 1e-12), -1.0)
+        best = similarities.argmax()
+        best_students.append(students[best])
+        best_similarities.append(similarities[best])
+    return np.array(best_students), np.array(best_similarities)
+
+
+class Command(BaseCommand):
+    help = (
+        "Quantize the buffalo_l detection and recognition models to INT8, calibrated on enrolled face images, "
+        "and compare speed and match accuracy against FP32 on the same labeled images. The INT8 files are only "
+        "installed (served with FACE_MODEL_PRECISION=int8) if accuracy stays within the given limits."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--models', nargs='+', choices=['detection', 'recognition'], default=['detection', 'recognition'])
+        parser.add_argument('--method', choices=['static', 'dynamic'], default='static',
+                            help="static: QDQ with per-channel weights, calibrated on enrolled crops; dynamic: weights only (ConvInteger, often slower on CPU).")
+        parser.add_argument('--images', type=int, default=1000, help="Enrolled images to load (random sample).")
+        parser.add_argument('--calibration-images', type=int, default=200)
+        parser.add_argument('--max-accuracy-drop', type=float, default=0.01,
+                            help="Largest allowed drop in leave-one-out top-1 accuracy (fraction of faces).")
+        parser.add_argument('--max-crossing-rate', type=float, default=0.02,
+                            help="Largest allowed fraction of faces moving between the unrecognized/review/recognized bands.")
+        parser.add_argument('--max-detection-loss', type=float, default=0.02,
+                            help="Largest allowed fraction of FP32 detections the INT8 detector misses.")
+        parser.add_argument('--force', action='store_true', help="Install the INT8 files even if the accuracy gate fails.")
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        directory = model_dir()
+        models = {}
+        for name in sorted(os.listdir(directory)):
+            if name.endswith('.onnx') and not name.endswith(INT8_SUFFIX):
+                model = load_model(os.path.join(directory, name))
+                if model is not None and model.taskname in ('detection', 'recognition') and model.taskname not in models:
+                    models[model.taskname] = (os.path.join(directory, name), model)
+        missing = {'detection', 'recognition'} - set(models)
+        if missing:
+            raise CommandError(f"{directory} has no {' or '.join(sorted(missing))} model.")
+        detector, recognizer = models['detection'][1], models['recognition'][1]
+        detector.prepare(ctx_id=0, input_size=DETECTION_SIZE, det_thresh=DETECTION_THRESHOLD)
+
+        images, crops, labels = self._load_labeled_faces(detector, recognizer, options)
+        rng = random.Random(options['seed'])
+        calibration = rng.sample(range(len(images)), min(options['calibration_images'], len(images)))
+        self.stdout.write(
+            f"{len(images)} enrolled images of {len(set(labels.tolist()))} students; {len(calibration)} used for calibration."
+        )
+
+        failures = []
+        with tempfile.TemporaryDirectory() as workdir:
+            quantized = {}
+            for task in options['models']:
+                source, model = models[task]
+                if task == 'detection':
+                    blobs = [_detection_blob(detector, images[i]) for i in calibration]
+                else:
+                    blobs = [_recognition_blob(recognizer, crops[i]) for i in calibration]
+                target = os.path.join(workdir, os.path.basename(source)[:-len('.onnx')] + INT8_SUFFIX)
+                self.stdout.write(f"Quantizing {os.path.basename(source)} ({options['method']})...")
+                _quantize(source, target, options['method'], model, blobs)
+                quantized[task] = (source, target)
+
+            if 'detection' in quantized:
+                int8_detector = load_model(quantized['detection'][1])
+                int8_detector.prepare(ctx_id=0, input_size=DETECTION_SIZE, det_thresh=DETECTION_THRESHOLD)
+                failures += self._compare_detection(detector, int8_detector, images, options)
+            if 'recognition' in quantized:
+                int8_recognizer = load_model(quantized['recognition'][1])
+                failures += self._compare_recognition(recognizer, int8_recognizer, crops, labels, options)
+
+            if failures and not options['force']:
+                raise CommandError("INT8 models not installed: " + "; ".join(failures))
+            for source, target in quantized.values():
+                installed = source[:-len('.onnx')] + INT8_SUFFIX
+                shutil.move(target, installed)
+                self.stdout.write(f"Installed {installed}")
+        self.stdout.write(self.style.SUCCESS("Set FACE_MODEL_PRECISION=int8 to serve the INT8 models."))
+
+    def _load_labeled_faces(self, detector, recognizer, options):
+        from insightface.utils import face_align
+
+        face_images = list(FaceImage.objects.exclude(image='').values_list('student_id', 'image'))
+        random.Random(options['seed']).shuffle(face_images)
+        images, crops, labels = [], [], []
+        for student_id, name in face_images[:options['images']]:
+            try:
+                with FaceImage._meta.get_field('image').storage.open(name) as image_file:
+                    image = decode_image(image_file, max_side=settings.FACE_DECODE_MAX_SIDE)
+            except Exception as e:
+                self.stderr.write(f"Skipping {name}: {e}")
+                continue
+            bboxes, kpss = detector.detect(image, max_num=1)
+            if not len(bboxes):
+                continue
+            images.append(image)
+            crops.append(face_align.norm_crop(image, landmark=kpss[0], image_size=recognizer.input_size[0]))
+            labels.append(student_id)
+        if len(images) < 2:
+            raise CommandError("Need at least two enrolled images with a detectable face.")
+        return images, crops, np.array(labels)
+
+    def _compare_detection(self, fp32, int8, images, options):
+        fp32_results, fp32_seconds = _timed(lambda image: fp32.detect(image)[0], images)
+        int8_results, int8_seconds = _timed(lambda image: int8.detect(image)[0], images)
+        fp32_seconds, int8_seconds = fp32_seconds / len(images), int8_seconds / len(images)
+        found = sum(len(boxes) for boxes in fp32_results)
+        missed = sum(
+            sum(1 for box in expected if not len(actual) or box_iou(actual[:, :4], box[:4]).max() < 0.5)
+            for expected, actual in zip(fp32_results, int8_results)
+        )
+        loss = missed / max(found, 1)
+        self.stdout.write(
+            f"detection:   FP32 {fp32_seconds * 1000:.1f} ms/image, INT8 {int8_seconds * 1000:.1f} ms/image "
+            f"({fp32_seconds / int8_seconds:.2f}x); faces {found} -> {sum(len(boxes) for boxes in int8_results)}, "
+            f"FP32 faces missed {missed} ({loss:.1%})"
+        )
+        return [f"detector misses {loss:.1%} of faces"] if loss > options['max_detection_loss'] else []
+
+    def _compare_recognition(self, fp32, int8, crops, labels, options):
+        # Batched as in analyze_images
+        batch_size = settings.FACE_RECOGNITION_BATCH_SIZE
+        batches = [crops[start:start + batch_size] for start in range(0, len(crops), batch_size)]
+        fp32_embeddings, fp32_seconds = _timed(fp32.get_feat, batches)
+        int8_embeddings, int8_seconds = _timed(int8.get_feat, batches)
+        fp32_seconds, int8_seconds = fp32_seconds / len(crops), int8_seconds / len(crops)
+        fp32_embeddings = np.concatenate(fp32_embeddings)
+        int8_embeddings = np.concatenate(int8_embeddings)
+        fp32_embeddings /= np.linalg.norm(fp32_embeddings, axis=1, keepdims=True)
+        int8_embeddings /= np.linalg.norm(int8_embeddings, axis=1, keepdims=True)
+        agreement = (fp32_embeddings * int8_embeddings).sum(axis=1)
+
+        # Only students with another enrolled image can be matched
+        scorable = np.array([(labels == label).sum() > 1 for label in labels])
+        if scorable.sum() == 0:
+            raise CommandError("Need a student with at least two enrolled images to measure match accuracy.")
+        fp32_students, fp32_similarities = _leave_one_out(fp32_embeddings[scorable], labels[scorable])
+        int8_students, int8_similarities = _leave_one_out(int8_embeddings[scorable], labels[scorable])
+        truth = labels[scorable]
+        fp32_accuracy = np.mean((fp32_students == truth) & (fp32_similarities >= SIMILARITY_THRESHOLD))
+        int8_accuracy = np.mean((int8_students == truth) & (int8_similarities >= SIMILARITY_THRESHOLD))
+        crossings = np.mean([_band(a) != _band(b) for a, b in zip(fp32_similarities, int8_similarities)])
+        self.stdout.write(
+            f"recognition: FP32 {fp32_seconds * 1000:.1f} ms/face, INT8 {int8_seconds * 1000:.1f} ms/face "
+            f"({fp32_seconds / int8_seconds:.2f}x); FP32/INT8 embedding cosine mean {agreement.mean():.4f}, min {agreement.min():.4f}"
+        )
+        self.stdout.write(
+            f"matching:    {scorable.sum()} faces, accuracy FP32 {fp32_accuracy:.1%} -> INT8 {int8_accuracy:.1%}, "
+            f"threshold band changes {crossings:.1%}, mean similarity change {np.mean(int8_similarities - fp32_similarities):+.4f}"
+        )
+        failures = []
+        if fp32_accuracy - int8_accuracy > options['max_accuracy_drop']:
+            failures.append(f"match accuracy drops {fp32_accuracy - int8_accuracy:.1%}")
+        if crossings > options['max_crossing_rate']:
+            failures.append(f"{crossings:.1%} of faces change threshold band")
+        return failures
@@ -0,0 +1,60 @@
+import time
+import numpy as np
+from django.core.management.base import BaseCommand
+from facial_recognition.models import FaceEmbedding, FaceImage
+
+
+class Command(BaseCommand):
+    help = "Rebuild every student's running embedding sum, count and average from their FaceImages in bulk."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true', help="Only report students whose stored sums have drifted.")
+        parser.add_argument('--tolerance', type=float, default=1e-3, help="Largest per-dimension difference of the average treated as consistent.")
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        sums, counts = {}, {}
+        for student_id, embedding in FaceImage.objects.filter(embedding__isnull=False).values_list('student_id', 'embedding').iterator(chunk_size=2000):
+            if student_id in sums:
+                sums[student_id] += embedding
+            else:
+                sums[student_id] = np.array(embedding, dtype=np.float32)
+            counts[student_id] = counts.get(student_id, 0) + 1
+
+        # High-confidence attendance faces are added to the running sums without
+        # a FaceImage; learned_sum holds their part, which is kept as it is.
+        drifted, orphaned = [], []
+        for face_embedding in FaceEmbedding.objects.iterator(chunk_size=2000):
+            student_id = face_embedding.student_id
+            if student_id not in sums:
+                orphaned.append(face_embedding.pk)
+                continue
+            embedding_sum, count = sums.pop(student_id), counts[student_id]
+            if face_embedding.learned_samples:
+                embedding_sum = embedding_sum + face_embedding.learned_sum
+                count += face_embedding.learned_samples
+            average = embedding_sum / count
+            stored = face_embedding.avg_embedding
+            if (
+                face_embedding.num_samples != count
+                or stored is None or face_embedding.embedding_sum is None
+                or np.abs(stored - average).max() > options['tolerance']
+            ):
+                face_embedding.embedding_sum = embedding_sum
+                face_embedding.avg_embedding = average
+                face_embedding.num_samples = count
+                drifted.append(face_embedding)
+        # Students with face images but no FaceEmbedding row
+        missing = [
+            FaceEmbedding(student_id=student_id, embedding_sum=embedding_sum, avg_embedding=embedding_sum / counts[student_id], num_samples=counts[student_id])
+            for student_id, embedding_sum in sums.items()
+        ]
+
+        summary = f"{len(drifted)} drifted, {len(missing)} missing, {len(orphaned)} without face images"
+        if options['check']:
+            self.stdout.write(f"Checked in {time.perf_counter() - start:.2f}s: {summary}.")
+            return
+        FaceEmbedding.objects.bulk_update(drifted, ['embedding_sum', 'avg_embedding', 'num_samples'], batch_size=500)
+        FaceEmbedding.objects.bulk_create(missing, batch_size=500)
+        FaceEmbedding.objects.filter(pk__in=orphaned).delete()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt embeddings in {time.perf_counter() - start:.2f}s: {summary}."))
@@ -0,0 +1,20 @@
+import time
+from django.core.management.base import BaseCommand
+from facial_recognition.models import FaceImage, FacePrototype
+from facial_recognition.prototypes import rebuild_prototypes
+from school_data.models import StudentProfile
+
+
+class Command(BaseCommand):
+    help = "Rebuild every student's prototype embeddings from their enrolled FaceImages."
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        embeddings = {}
+        for student_id, embedding in FaceImage.objects.filter(embedding__isnull=False).values_list('student_id', 'embedding').iterator(chunk_size=2000):
+            embeddings.setdefault(student_id, []).append(embedding)
+        for student in StudentProfile.objects.filter(id__in=embeddings):
+            rebuild_prototypes(student, embeddings[student.id])
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebuilt {FacePrototype.objects.count()} prototypes for {len(embeddings)} students in {time.perf_counter() - start:.2f}s."
+        ))
@@ -0,0 +1,31 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from facial_recognition.inference import warmup
+from facial_recognition.inference_server import InferenceServer
+
+
+class Command(BaseCommand):
+    help = (
+        "Run the shared face inference server. Django workers started with the same "
+        "FACE_INFERENCE_SOCKET send detection and embedding requests to it instead of "
+        "loading their own model."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--socket', default=settings.FACE_INFERENCE_SOCKET, help="Unix socket path to listen on.")
+        parser.add_argument('--batch-size', type=int, default=settings.FACE_INFERENCE_BATCH_SIZE)
+        parser.add_argument('--batch-wait-ms', type=int, default=settings.FACE_INFERENCE_BATCH_WAIT_MS)
+
+    def handle(self, *args, **options):
+        if not options['socket']:
+            raise CommandError("Set FACE_INFERENCE_SOCKET or pass --socket.")
+        load_seconds = warmup()
+        self.stdout.write(self.style.SUCCESS(
+            f"Face model loaded in {load_seconds:.2f}s; serving on {options['socket']}."
+        ))
+        InferenceServer(
+            options['socket'],
+            settings.FACE_INFERENCE_AUTHKEY.encode(),
+            batch_size=options['batch_size'],
+            batch_wait=options['batch_wait_ms'] / 1000,
+        ).serve_forever()
@@ -0,0 +1,114 @@
+import itertools
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test import override_settings
+from facial_recognition.inference import (
+    DETECTION_SIZE, DETECTION_THRESHOLD, ORT_EXECUTION_MODES, ORT_OPTIMIZATION_LEVELS, load_model, model_dir, model_files,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Time detection and recognition under combinations of ONNX Runtime session options, with as many "
+        "concurrent callers as the host's workers would run, and print the fastest FACE_ORT_* settings."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--image', help="Classroom photo to detect on (a blank 1280x720 frame by default).")
+        parser.add_argument('--faces', type=int, default=8, help="Face crops embedded per call.")
+        parser.add_argument('--concurrency', type=int, default=os.cpu_count() or 1,
+                            help="Calls in flight at once, e.g. web workers x FACE_DETECTION_WORKERS.")
+        parser.add_argument('--threads', type=int, nargs='+', help="Intra-op thread counts (default: powers of two up to the core count).")
+        parser.add_argument('--inter-op-threads', type=int, nargs='+', default=[0])
+        parser.add_argument('--execution-modes', nargs='+', choices=list(ORT_EXECUTION_MODES), default=['sequential', 'parallel'])
+        parser.add_argument('--optimization-levels', nargs='+', choices=list(ORT_OPTIMIZATION_LEVELS), default=['basic', 'extended', 'all'])
+        parser.add_argument('--spinning', nargs='+', choices=['on', 'off'], default=['on', 'off'])
+        parser.add_argument('--calls', type=int, default=20, help="Timed calls per configuration.")
+
+    def handle(self, *args, **options):
+        image = cv2.imread(options['image']) if options['image'] else np.zeros((720, 1280, 3), dtype=np.uint8)
+        if image is None:
+            raise CommandError(f"Cannot read image {options['image']}.")
+        crops = [np.zeros((112, 112, 3), dtype=np.uint8)] * options['faces']
+        cores = os.cpu_count() or 1
+        thread_counts = options['threads'] or sorted({min(2 ** i, cores) for i in range(cores.bit_length() + 1)})
+        files = model_files(model_dir())
+
+        configurations = [
+            {'threads': threads, 'inter_op_threads': inter, 'execution_mode': mode, 'optimization': level, 'spinning': spinning}
+            for threads, inter, mode, level, spinning in itertools.product(
+                thread_counts, options['inter_op_threads'], options['execution_modes'], options['optimization_levels'], options['spinning']
+            )
+            # Inter-op threads only apply in parallel mode
+            if mode == 'parallel' or inter == options['inter_op_threads'][0]
+        ]
+        self.stdout.write(
+            f"{len(configurations)} configurations, {options['concurrency']} concurrent callers, {cores} cores"
+        )
+        self.stdout.write(
+            f"{'threads':>7} {'inter':>5} {'mode':>10} {'optimize':>8} {'spin':>4} {'load s':>7} {'calls/s':>8} {'p50 ms':>7} {'p95 ms':>7}"
+        )
+        results = []
+        for config in configurations:
+            with override_settings(
+                FACE_ORT_INTRA_OP_THREADS=config['threads'],
+                FACE_ORT_INTER_OP_THREADS=config['inter_op_threads'],
+                FACE_ORT_EXECUTION_MODE=config['execution_mode'],
+                FACE_ORT_GRAPH_OPTIMIZATION=config['optimization'],
+                FACE_ORT_ALLOW_SPINNING=config['spinning'] == 'on',
+                FACE_ORT_OPTIMIZED_MODEL_DIR='',
+            ):
+                result = self._measure(files, image, crops, options)
+            results.append((config, result))
+            self.stdout.write(
+                f"{config['threads']:>7} {config['inter_op_threads']:>5} {config['execution_mode']:>10} {config['optimization']:>8} "
+                f"{config['spinning']:>4} {result['load_seconds']:>7.2f} {result['calls_per_second']:>8.2f} "
+                f"{result['p50_ms']:>7.1f} {result['p95_ms']:>7.1f}"
+            )
+
+        best, result = max(results, key=lambda item: item[1]['calls_per_second'])
+        self.stdout.write(self.style.SUCCESS(f"Fastest: {result['calls_per_second']:.2f} calls/s with"))
+        self.stdout.write(f"FACE_ORT_INTRA_OP_THREADS={best['threads']}")
+        if best['execution_mode'] == 'parallel':
+            self.stdout.write(f"FACE_ORT_INTER_OP_THREADS={best['inter_op_threads']}")
+        self.stdout.write(f"FACE_ORT_EXECUTION_MODE={best['execution_mode']}")
+        self.stdout.write(f"FACE_ORT_GRAPH_OPTIMIZATION={best['optimization']}")
+        self.stdout.write(f"FACE_ORT_ALLOW_SPINNING={best['spinning'] == 'on'}")
+
+    def _measure(self, files, image, crops, options):
+        start = time.perf_counter()
+        models = {}
+        for onnx_file in files:
+            model = load_model(onnx_file)
+            if model is not None and model.taskname in ('detection', 'recognition') and model.taskname in settings.FACE_ANALYSIS_MODULES:
+                models.setdefault(model.taskname, model)
+        if not models:
+            raise CommandError("No detection or recognition model found.")
+        if 'detection' in models:
+            models['detection'].prepare(ctx_id=0, input_size=DETECTION_SIZE, det_thresh=DETECTION_THRESHOLD)
+        load_seconds = time.perf_counter() - start
+
+        def call(_):
+            started = time.perf_counter()
+            if 'detection' in models:
+                models['detection'].detect(image)
+            if 'recognition' in models:
+                models['recognition'].get_feat(crops)
+            return time.perf_counter() - started
+
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as pool:
+            list(pool.map(call, range(options['concurrency'])))  # Warm-up, excluded from timing
+            start = time.perf_counter()
+            latencies = sorted(pool.map(call, range(options['calls'])))
+            elapsed = time.perf_counter() - start
+        return {
+            'load_seconds': load_seconds,
+            'calls_per_second': options['calls'] / elapsed,
+            'p50_ms': latencies[len(latencies) // 2] * 1000,
+            'p95_ms': latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000,
+        }
@@ -0,0 +1,14 @@
+import time
+from django.core.management.base import BaseCommand
+from facial_recognition.inference import warmup
+
+
+class Command(BaseCommand):
+    help = "Load the InsightFace model (downloading it if needed) and run one inference."
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        load_seconds = warmup()
+        self.stdout.write(self.style.SUCCESS(
+            f"Face model ready: loaded in {load_seconds:.2f}s, warmed up in {time.perf_counter() - start:.2f}s."
+        ))
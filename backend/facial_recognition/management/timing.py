@@ -0,0 +1,17 @@
+import time
+
+
+def timed_runs(run, iterations=1, warmup=None):
+    """
+    Call run iterations times after one untimed warm-up call (of warmup if
+    given, else run itself), so one-off costs such as ONNX Runtime's first
+    allocations don't count. Returns the last call's result and the seconds
+    each timed call took.
+    """
+    (warmup or run)()  # Warm-up run, excluded from timing
+    result, samples = None, []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        result = run()
+        samples.append(time.perf_counter() - start)
+    return result, samples
@@ -0,0 +1,124 @@
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# Upper bounds (seconds) of the stage duration buckets
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+FACE_BUCKETS = (0, 1, 2, 5, 10, 20, 30, 45, 60, 100, 200)
+
+_current = ContextVar('face_request_timer', default=None)
+
+
+class Histogram:
+    """Cumulative Prometheus-style histogram keyed by label values."""
+
+    def __init__(self, name, description, buckets, labelnames):
+        self.name = name
+        self.description = description
+        self.buckets = tuple(buckets)
+        self.labelnames = labelnames
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        with self._lock:
+            series = self._series.setdefault(labels, {'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0})
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series['buckets'][index] += 1
+            series['sum'] += value
+            series['count'] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            for labels, series in sorted(self._series.items()):
+                label_text = ''.join(f'{name}="{value}",' for name, value in zip(self.labelnames, labels))
+                for bound, count in zip(self.buckets, series['buckets']):
+                    lines.append(f'{self.name}_bucket{{{label_text}le="{bound}"}} {count}')
+                lines.append(f'{self.name}_bucket{{{label_text}le="+Inf"}} {series["count"]}')
+                suffix = f'{{{label_text.rstrip(",")}}}' if label_text else ''
+                lines.append(f'{self.name}_sum{suffix} {series["sum"]}')
+                lines.append(f'{self.name}_count{suffix} {series["count"]}')
+        return lines
+
+
+stage_seconds = Histogram(
+    'attendai_face_stage_seconds', 'Time spent in each stage of a face recognition request.', STAGE_BUCKETS, ('endpoint', 'stage')
+)
+faces_per_request = Histogram(
+    'attendai_faces_per_request', 'Faces detected per face recognition request.', FACE_BUCKETS, ('endpoint',)
+)
+
+
+class RequestTimer:
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.stages = {}
+        self.faces = None
+        self.started = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - start
+
+    def server_timing(self):
+        """Server-Timing header value; durations in milliseconds."""
+        entries = {**self.stages, 'total': time.perf_counter() - self.started}
+        return ', '.join(f'{name};dur={seconds * 1000:.1f}' for name, seconds in entries.items())
+
+
+@contextmanager
+def timed_request(endpoint):
+    """
+    Collect the stages timed with stage() while the block runs, then record
+    them, the total and the face count in this process's histograms.
+    """
+    timer = RequestTimer(endpoint)
+    token = _current.set(timer)
+    try:
+        yield timer
+    finally:
+        _current.reset(token)
+        for name, seconds in timer.stages.items():
+            stage_seconds.observe(seconds, endpoint, name)
+        stage_seconds.observe(time.perf_counter() - timer.started, endpoint, 'total')
+        if timer.faces is not None:
+            faces_per_request.observe(timer.faces, endpoint)
+
+
+@contextmanager
+def stage(name):
+    """Time the block as one stage of the current request; a no-op outside timed_request."""
+    timer = _current.get()
+    if timer is None:
+        yield
+        return
+    with timer.stage(name):
+        yield
+
+
+def count_faces(count):
+    timer = _current.get()
+    if timer is not None:
+        timer.faces = (timer.faces or 0) + count
+
+
+def observe_stage(endpoint, name, seconds):
+    """Record work done outside a request, e.g. by the background face writer."""
+    stage_seconds.observe(seconds, endpoint, name)
+
+
+def render(gallery_size):
+    lines = stage_seconds.render() + faces_per_request.render()
+    lines += [
+        '# HELP attendai_face_gallery_size Prototype embeddings in this process\'s recognition gallery.',
+        '# TYPE attendai_face_gallery_size gauge',
+        f'attendai_face_gallery_size {gallery_size}',
+    ]
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,62 @@
+import numpy as np
+from django.db import migrations
+import facial_recognition.fields
+
+# (model, field) pairs whose JSON list embeddings move to packed float32
+EMBEDDING_FIELDS = [
+    ('faceimage', 'embedding'),
+    ('faceembedding', 'avg_embedding'),
+    ('unrecognizedface', 'embedding'),
+    ('reviewface', 'embedding'),
+]
+BATCH_SIZE = 500
+
+
+def _copy(apps, source, target, convert):
+    for model_name, field_name in EMBEDDING_FIELDS:
+        model = apps.get_model('facial_recognition', model_name)
+        src, dst = source.format(field_name), target.format(field_name)
+        batch = []
+        for obj in model.objects.exclude(**{f'{src}__isnull': True}).only('pk', src).iterator(chunk_size=BATCH_SIZE):
+            setattr(obj, dst, convert(getattr(obj, src)))
+            batch.append(obj)
+            if len(batch) >= BATCH_SIZE:
+                model.objects.bulk_update(batch, [dst])
+                batch = []
+        if batch:
+            model.objects.bulk_update(batch, [dst])
+
+
+def json_to_binary(apps, schema_editor):
+    _copy(apps, '{}', '{}_binary', lambda value: np.asarray(value, dtype='<f4') if value else None)
+
+
+def binary_to_json(apps, schema_editor):
+    _copy(apps, '{}_binary', '{}', lambda value: value.tolist())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('facial_recognition', '0007_faceembedding_updated_at'),
+    ]
+
+    operations = [
+        *[
+            migrations.AddField(
+                model_name=model_name,
+                name=f'{field_name}_binary',
+                field=facial_recognition.fields.EmbeddingField(blank=True, null=True),
+            )
+            for model_name, field_name in EMBEDDING_FIELDS
+        ],
+        migrations.RunPython(json_to_binary, binary_to_json),
+        *[
+            migrations.RemoveField(model_name=model_name, name=field_name)
+            for model_name, field_name in EMBEDDING_FIELDS
+        ],
+        *[
+            migrations.RenameField(model_name=model_name, old_name=f'{field_name}_binary', new_name=field_name)
+            for model_name, field_name in EMBEDDING_FIELDS
+        ],
+    ]
@@ -0,0 +1,28 @@
+import django.db.models.deletion
+import facial_recognition.fields
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('facial_recognition', '0009_videoattendancejob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UnrecognizedFaceCluster',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('centroid', facial_recognition.fields.EmbeddingField(blank=True, null=True)),
+                ('size', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='unrecognizedface',
+            name='cluster',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='faces', to='facial_recognition.unrecognizedfacecluster'),
+        ),
+    ]
@@ -0,0 +1,43 @@
+import django.db.models.deletion
+import facial_recognition.fields
+from django.db import migrations, models
+
+BATCH_SIZE = 500
+
+
+def seed_prototypes(apps, schema_editor):
+    # Start every enrolled student with their current average as the only
+    # prototype; manage.py rebuild_face_prototypes splits them from FaceImages.
+    FaceEmbedding = apps.get_model('facial_recognition', 'FaceEmbedding')
+    FacePrototype = apps.get_model('facial_recognition', 'FacePrototype')
+    batch = []
+    for student_id, embedding, num_samples in FaceEmbedding.objects.filter(avg_embedding__isnull=False).values_list(
+        'student_id', 'avg_embedding', 'num_samples'
+    ).iterator(chunk_size=BATCH_SIZE):
+        if len(embedding):
+            batch.append(FacePrototype(student_id=student_id, embedding=embedding, num_samples=num_samples))
+        if len(batch) >= BATCH_SIZE:
+            FacePrototype.objects.bulk_create(batch)
+            batch = []
+    FacePrototype.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('facial_recognition', '0010_unrecognizedfacecluster'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FacePrototype',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('embedding', facial_recognition.fields.EmbeddingField()),
+                ('num_samples', models.PositiveIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('student', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='face_prototypes', to='school_data.studentprofile')),
+            ],
+        ),
+        migrations.RunPython(seed_prototypes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,33 @@
+from django.db import migrations
+import facial_recognition.fields
+
+BATCH_SIZE = 500
+
+
+def fill_embedding_sums(apps, schema_editor):
+    FaceEmbedding = apps.get_model('facial_recognition', 'FaceEmbedding')
+    batch = []
+    for face_embedding in FaceEmbedding.objects.filter(avg_embedding__isnull=False).only('pk', 'avg_embedding', 'num_samples').iterator(chunk_size=BATCH_SIZE):
+        face_embedding.embedding_sum = face_embedding.avg_embedding * max(face_embedding.num_samples, 1)
+        batch.append(face_embedding)
+        if len(batch) >= BATCH_SIZE:
+            FaceEmbedding.objects.bulk_update(batch, ['embedding_sum'])
+            batch = []
+    if batch:
+        FaceEmbedding.objects.bulk_update(batch, ['embedding_sum'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('facial_recognition', '0011_faceprototype'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='faceembedding',
+            name='embedding_sum',
+            field=facial_recognition.fields.EmbeddingField(blank=True, null=True),
+        ),
+        migrations.RunPython(fill_embedding_sums, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('facial_recognition', '0012_faceembedding_embedding_sum'),
+        ('school_data', '0002_remove_parentprofile_phone_number_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='videoattendancejob',
+            name='school_class',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='school_data.schoolclass'),
+        ),
+    ]
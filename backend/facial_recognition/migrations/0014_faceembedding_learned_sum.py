@@ -0,0 +1,22 @@
+from django.db import migrations, models
+import facial_recognition.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('facial_recognition', '0013_videoattendancejob_school_class'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='faceembedding',
+            name='learned_sum',
+            field=facial_recognition.fields.EmbeddingField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='faceembedding',
+            name='learned_samples',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
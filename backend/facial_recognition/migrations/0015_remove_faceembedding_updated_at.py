@@ -0,0 +1,15 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('facial_recognition', '0014_faceembedding_learned_sum'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='faceembedding',
+            name='updated_at',
+        ),
+    ]
@@ -1,11 +1,14 @@
+import uuid
 from django.db import models
-from school_data.models import StudentProfile
+from django.conf import settings
+from school_data.models import SchoolClass, StudentProfile
 from django.core.files.storage import default_storage
+from .fields import EmbeddingField
 
 class FaceImage(models.Model):
     student = models.ForeignKey(StudentProfile, on_delete=models.CASCADE, related_name='face_images')
     image = models.ImageField(upload_to='student_faces/')
-    embedding = models.JSONField(null=True, blank=True)  # Face embedding as JSON
+    embedding = EmbeddingField(null=True, blank=True)  # Face embedding as packed float32
     created_at = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
@@ -13,18 +16,41 @@ class FaceImage(models.Model):
 
 class FaceEmbedding(models.Model):
     student = models.OneToOneField(StudentProfile, on_delete=models.CASCADE, related_name='face_embedding')
-    avg_embedding = models.JSONField(null=True, blank=True)  # Average embedding for recognition
+    avg_embedding = EmbeddingField(null=True, blank=True)  # Average embedding for recognition
+    embedding_sum = EmbeddingField(null=True, blank=True)  # Running sum of the samples, so one can be added or removed in O(1)
     num_samples = models.PositiveIntegerField(default=0)  # Number of samples used
+    # Part of the sum and count from high-confidence attendance faces, which have no FaceImage to rebuild them from
+    learned_sum = EmbeddingField(null=True, blank=True)
+    learned_samples = models.PositiveIntegerField(default=0)
 
     def __str__(self):
         return f"FaceEmbedding for {self.student.user.username}"
 
+class FacePrototype(models.Model):
+    student = models.ForeignKey(StudentProfile, on_delete=models.CASCADE, related_name='face_prototypes')
+    embedding = EmbeddingField()  # Mean of the normalised embeddings assigned to this prototype
+    num_samples = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)  # Lets other workers notice gallery changes
+
+    def __str__(self):
+        return f"FacePrototype {self.id} for {self.student.user.username}"
+
+class UnrecognizedFaceCluster(models.Model):
+    centroid = EmbeddingField(null=True, blank=True)  # Mean of the members' normalised embeddings
+    size = models.PositiveIntegerField(default=0)  # Faces averaged into the centroid
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"UnrecognizedFaceCluster {self.id} ({self.size} faces)"
+
 class UnrecognizedFace(models.Model):
     image = models.ImageField(upload_to='unrecognized_faces/')  # Cropped face image
-    embedding = models.JSONField(null=True, blank=True)
+    embedding = EmbeddingField(null=True, blank=True)
     timestamp = models.DateTimeField(auto_now_add=True)
     identified_student = models.ForeignKey(StudentProfile, on_delete=models.SET_NULL, null=True, blank=True)
     discarded = models.BooleanField(default=False)  # Soft-delete flag for admin review
+    cluster = models.ForeignKey(UnrecognizedFaceCluster, on_delete=models.SET_NULL, null=True, blank=True, related_name='faces')
 
     def __str__(self):
         return f"UnrecognizedFace {self.id} at {self.timestamp}"
@@ -32,7 +58,7 @@ class UnrecognizedFace(models.Model):
 class ReviewFace(models.Model):
     suggested_student = models.ForeignKey(StudentProfile, on_delete=models.CASCADE, null=True, blank=True, related_name='review_faces')
     image = models.ImageField(upload_to='review_faces/')  # Cropped face image
-    embedding = models.JSONField(null=True, blank=True)
+    embedding = EmbeddingField(null=True, blank=True)
     similarity = models.FloatField()  # Similarity score to suggested student
     timestamp = models.DateTimeField(auto_now_add=True)
     confirmed_student = models.ForeignKey(StudentProfile, on_delete=models.SET_NULL, null=True, blank=True, related_name='confirmed_review_faces')
@@ -40,4 +66,27 @@ class ReviewFace(models.Model):
     face_image = models.OneToOneField('FaceImage', on_delete=models.SET_NULL, null=True, blank=True, related_name='review_face')
 
     def __str__(self):
-        return f"ReviewFace {self.id} at {self.timestamp}"
\ No newline at end of file
+        return f"ReviewFace {self.id} at {self.timestamp}"
+
+class VideoAttendanceJob(models.Model):
+    STATUS_CHOICES = (
+        ('queued', 'Queued'),
+        ('processing', 'Processing'),
+        ('completed', 'Completed'),
+        ('failed', 'Failed'),
+    )
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    submitted_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True, related_name='video_attendance_jobs')
+    attendance_status = models.CharField(max_length=10)  # 'onTime' or 'late', as submitted
+    school_class = models.ForeignKey(SchoolClass, on_delete=models.SET_NULL, null=True, blank=True)  # Class the video was taken in, if given
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='queued')
+    frames_total = models.PositiveIntegerField(default=0)
+    frames_done = models.PositiveIntegerField(default=0)
+    faces_found = models.PositiveIntegerField(default=0)
+    recognized_students = models.JSONField(default=list)  # Student ids, filled in on completion
+    error = models.TextField(blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"VideoAttendanceJob {self.id} ({self.status})"
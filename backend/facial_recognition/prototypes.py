@@ -0,0 +1,69 @@
+import numpy as np
+from django.conf import settings
+from .ann import normalize_rows, spherical_kmeans
+from .models import FacePrototype
+
+
+def add_to_prototypes(student, new_embeddings):
+    """
+    Online k-means step over a student's prototypes. Each new embedding
+    starts a prototype of its own while the student has fewer than
+    FACE_PROTOTYPES_PER_STUDENT and none is at least
+    FACE_PROTOTYPE_SPLIT_THRESHOLD similar; otherwise it is averaged into
+    the most similar prototype.
+    """
+    prototypes = list(FacePrototype.objects.filter(student=student))
+    changed = set()
+    for vector in normalize_rows(np.asarray(new_embeddings, dtype=np.float32).reshape(len(new_embeddings), -1)):
+        best = None
+        if prototypes:
+            similarities = normalize_rows(np.stack([prototype.embedding for prototype in prototypes])) @ vector
+            best = int(similarities.argmax())
+            if len(prototypes) < settings.FACE_PROTOTYPES_PER_STUDENT and similarities[best] < settings.FACE_PROTOTYPE_SPLIT_THRESHOLD:
+                best = None
+        if best is None:
+            prototypes.append(FacePrototype(student=student, embedding=vector, num_samples=1))
+            changed.add(len(prototypes) - 1)
+        else:
+            prototype = prototypes[best]
+            prototype.embedding = (prototype.embedding * prototype.num_samples + vector) / (prototype.num_samples + 1)
+            prototype.num_samples += 1
+            changed.add(best)
+    # Saved one by one so the gallery signals see every change (at most K rows)
+    for index in changed:
+        prototypes[index].save()
+
+
+def remove_from_prototypes(student, embeddings):
+    """Take each embedding back out of the prototype nearest to it, dropping prototypes that empty."""
+    prototypes = list(FacePrototype.objects.filter(student=student))
+    changed = set()
+    for vector in normalize_rows(np.asarray(embeddings, dtype=np.float32).reshape(len(embeddings), -1)):
+        if not prototypes:
+            break
+        best = int((normalize_rows(np.stack([prototype.embedding for prototype in prototypes])) @ vector).argmax())
+        prototype = prototypes[best]
+        if prototype.num_samples <= 1:
+            changed.discard(prototype)
+            prototype.delete()
+            prototypes.pop(best)
+            continue
+        prototype.embedding = (prototype.embedding * prototype.num_samples - vector) / (prototype.num_samples - 1)
+        prototype.num_samples -= 1
+        changed.add(prototype)
+    for prototype in changed:
+        prototype.save()
+
+
+def rebuild_prototypes(student, embeddings):
+    """Replace a student's prototypes with spherical k-means centroids of their face embeddings."""
+    FacePrototype.objects.filter(student=student).delete()
+    if not len(embeddings):
+        return
+    vectors = normalize_rows(np.asarray(embeddings, dtype=np.float32).reshape(len(embeddings), -1))
+    n_clusters = min(settings.FACE_PROTOTYPES_PER_STUDENT, len(vectors))
+    centroids = spherical_kmeans(vectors, n_clusters) if n_clusters > 1 else vectors.mean(axis=0, keepdims=True)
+    assignment = (vectors @ normalize_rows(centroids).T).argmax(axis=1)
+    for cluster in np.unique(assignment):
+        members = vectors[assignment == cluster]
+        FacePrototype.objects.create(student=student, embedding=members.mean(axis=0), num_samples=len(members))
@@ -1,13 +1,29 @@
 from rest_framework import serializers
-from .models import FaceImage, UnrecognizedFace, ReviewFace, StudentProfile
+from .models import FaceImage, UnrecognizedFace, UnrecognizedFaceCluster, ReviewFace, StudentProfile, VideoAttendanceJob
+from school_data.models import SchoolClass
+from scheduling.models import RoutineEntry
 
 # Serializer for enrolling a face image
 class EnrollFaceSerializer(serializers.Serializer):
     student_id = serializers.IntegerField()
     image = serializers.ImageField()
 
+# Optional class being marked: faces are matched against its students first
+class ClassScopeSerializerMixin(serializers.Serializer):
+    school_class = serializers.PrimaryKeyRelatedField(queryset=SchoolClass.objects.all(), required=False, allow_null=True)
+    routine_entry = serializers.PrimaryKeyRelatedField(queryset=RoutineEntry.objects.all(), required=False, allow_null=True)
+
+    def validate(self, attrs):
+        attrs = super().validate(attrs)
+        routine_entry = attrs.pop('routine_entry', None)
+        if routine_entry is not None:
+            if attrs.get('school_class') not in (None, routine_entry.school_class):
+                raise serializers.ValidationError({"routine_entry": "Routine entry belongs to a different class."})
+            attrs['school_class'] = routine_entry.school_class
+        return attrs
+
 # Serializer for marking attendance
-class MarkAttendanceSerializer(serializers.Serializer):
+class MarkAttendanceSerializer(ClassScopeSerializerMixin):
     images = serializers.ListField(child=serializers.ImageField(), allow_empty=False)
     status = serializers.ChoiceField(choices=['onTime', 'late'], default='onTime')
 
@@ -16,6 +32,12 @@ class AssignUnrecognizedFaceSerializer(serializers.Serializer):
     face_id = serializers.IntegerField()
     student_id = serializers.IntegerField(required=False, allow_null=True)
 
+# Serializer for assigning a whole cluster of unrecognized faces
+class AssignUnrecognizedFaceClusterSerializer(serializers.Serializer):
+    cluster_id = serializers.IntegerField()
+    student_id = serializers.IntegerField()
+    exclude_face_ids = serializers.ListField(child=serializers.IntegerField(), required=False, default=list)
+
 # Serializer for confirming a review face
 class ConfirmReviewFaceSerializer(serializers.Serializer):
     face_id = serializers.IntegerField()
@@ -35,6 +57,15 @@ class UnrecognizedFaceSerializer(serializers.ModelSerializer):
         model = UnrecognizedFace
         fields = ['id', 'image', 'timestamp', 'identified_student', 'identified_student_name', 'discarded']
 
+# Serializer for listing clusters of unrecognized faces
+class UnrecognizedFaceClusterSerializer(serializers.ModelSerializer):
+    face_count = serializers.IntegerField(read_only=True)
+    faces = UnrecognizedFaceSerializer(source='open_faces', many=True, read_only=True)
+
+    class Meta:
+        model = UnrecognizedFaceCluster
+        fields = ['id', 'face_count', 'faces', 'created_at', 'updated_at']
+
 # Serializer for listing review faces
 class ReviewFaceSerializer(serializers.ModelSerializer):
     suggested_student_name = serializers.CharField(source='suggested_student.user.username', read_only=True)
@@ -44,6 +75,12 @@ class ReviewFaceSerializer(serializers.ModelSerializer):
         model = ReviewFace
         fields = ['id', 'image', 'similarity', 'timestamp', 'suggested_student', 'suggested_student_name', 'confirmed_student', 'confirmed_student_name', 'discarded']
 
-class MarkAttendanceVideoSerializer(serializers.Serializer):
+class MarkAttendanceVideoSerializer(ClassScopeSerializerMixin):
     video = serializers.FileField()
-    status = serializers.ChoiceField(choices=['onTime', 'late'], default='onTime')
\ No newline at end of file
+    status = serializers.ChoiceField(choices=['onTime', 'late'], default='onTime')
+
+class VideoAttendanceJobSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = VideoAttendanceJob
+        fields = ['id', 'status', 'attendance_status', 'school_class', 'frames_total', 'frames_done', 'faces_found', 'recognized_students', 'error', 'created_at', 'updated_at']
+        read_only_fields = fields
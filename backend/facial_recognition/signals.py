@@ -1,11 +1,73 @@
-from django.db.models.signals import post_delete
+import logging
+import threading
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 from django.core.files.storage import default_storage
-from .models import FaceImage
-from .utils import recalculate_embedding
+from .models import FaceImage, FacePrototype, StudentProfile
+from .utils import remove_face_embeddings
+from .gallery import face_gallery
+
+logger = logging.getLogger(__name__)
+
+_local = threading.local()
+
+
+class _DeletedFaceImages:
+    """
+    FaceImages deleted in one transaction or savepoint. Cascades (deleting a
+    student or bulk-deleting users) delete many images at once, so the
+    embedding of each surviving student is updated once and the files are
+    removed together, after the transaction commits. Nothing happens for the
+    deletes of a savepoint or transaction that rolls back.
+    """
+
+    def __init__(self, savepoint_ids):
+        self.savepoint_ids = savepoint_ids
+        self.embeddings = {}  # student id -> embeddings of their deleted images
+        self.files = []
+
+    def add(self, face_image):
+        if face_image.image:
+            self.files.append(face_image.image.name)
+        self.embeddings.setdefault(face_image.student_id, []).append(face_image.embedding)
+
+    def flush(self):
+        if getattr(_local, 'pending', None) is self:
+            _local.pending = None
+        for name in self.files:
+            try:
+                default_storage.delete(name)
+            except Exception:
+                logger.exception(f"Could not delete face image file {name}")
+        # Students deleted along with their images need no update
+        for student in StudentProfile.objects.filter(id__in=self.embeddings):
+            remove_face_embeddings(student, self.embeddings[student.id])
 
 @receiver(post_delete, sender=FaceImage)
 def delete_face_image_file(sender, instance, **kwargs):
-    if instance.image:
-        default_storage.delete(instance.image.name)
-    recalculate_embedding(instance.student)
\ No newline at end of file
+    pending = getattr(_local, 'pending', None)
+    connection = transaction.get_connection()
+    savepoint_ids = tuple(connection.savepoint_ids)
+    # Batch only within one savepoint: rolling it back drops the on_commit
+    # callbacks registered inside it, and must drop its deletes with them.
+    # A rolled-back transaction drops its callbacks too; start afresh then.
+    if (
+        pending is not None
+        and pending.savepoint_ids == savepoint_ids
+        and any(callback == pending.flush for _, callback, _ in connection.run_on_commit)
+    ):
+        pending.add(instance)
+        return
+    pending = _local.pending = _DeletedFaceImages(savepoint_ids)
+    pending.add(instance)
+    # Runs right away outside a transaction
+    transaction.on_commit(pending.flush)
+
+@receiver(post_save, sender=FacePrototype)
+def update_face_gallery(sender, instance, created, **kwargs):
+    face_gallery.apply_change(instance, created=created)
+
+@receiver(post_delete, sender=FacePrototype)
+def remove_from_face_gallery(sender, instance, **kwargs):
+    face_gallery.apply_change(instance, deleted=True)
@@ -1,3 +1,398 @@
-from django.test import TestCase
+import os
+import tempfile
+import threading
+import time
+from importlib import import_module
+from io import BytesIO, StringIO
+from unittest import mock
+import cv2
+import numpy as np
+from django.apps import apps
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection, migrations, models, transaction
+from django.db.migrations.state import ProjectState
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from users.models import CustomUser
+from . import detection_cache, inference, inference_server
+from .fields import EMBEDDING_DTYPE
+from .inference import SharedPool
+from .gallery import FaceGallery
+from .models import FaceEmbedding, FaceImage, FacePrototype, StudentProfile
+from .utils import add_face_embeddings, recalculate_embedding, remove_face_embeddings
+from .video import iter_sampled_frames
 
-# Create your tests here.
+
+binary_embeddings_migration = import_module('facial_recognition.migrations.0008_binary_embeddings')
+
+
+class EmbeddingFieldTests(TestCase):
+    def setUp(self):
+        self.student = StudentProfile.objects.create(user=CustomUser.objects.create(username='student', role='student'))
+
+    def _stored_bytes(self, face_image):
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT embedding FROM {FaceImage._meta.db_table} WHERE id = %s', [face_image.pk])
+            return cursor.fetchone()[0]
+
+    def test_round_trip_as_packed_float32(self):
+        values = np.random.default_rng(0).standard_normal(512)
+        for value in (values.tolist(), values, values.astype(np.float32)):
+            with self.subTest(type=type(value).__name__, dtype=getattr(value, 'dtype', None)):
+                face_image = FaceImage.objects.create(student=self.student, image='face.jpg', embedding=value)
+                self.assertEqual(len(self._stored_bytes(face_image)), 512 * 4)
+                embedding = FaceImage.objects.get(pk=face_image.pk).embedding
+                self.assertEqual(embedding.dtype, EMBEDDING_DTYPE)
+                self.assertEqual(embedding.shape, (512,))
+                np.testing.assert_array_equal(embedding, values.astype(np.float32))
+
+    def test_none_round_trip(self):
+        face_image = FaceImage.objects.create(student=self.student, image='face.jpg', embedding=None)
+        self.assertIsNone(self._stored_bytes(face_image))
+        self.assertIsNone(FaceImage.objects.get(pk=face_image.pk).embedding)
+
+    def test_serialized_round_trip(self):
+        field = FaceImage._meta.get_field('embedding')
+        face_image = FaceImage(student=self.student, embedding=np.arange(512, dtype=np.float64))
+        embedding = field.to_python(field.value_to_string(face_image))
+        self.assertEqual(embedding.dtype, EMBEDDING_DTYPE)
+        np.testing.assert_array_equal(embedding, np.arange(512, dtype=np.float32))
+
+
+class BinaryEmbeddingsMigrationTests(TransactionTestCase):
+    def setUp(self):
+        # Undo 0008's schema changes, leaving the JSON columns next to the empty binary ones its RunPython fills
+        fields = binary_embeddings_migration.EMBEDDING_FIELDS
+        self.state = ProjectState.from_apps(apps)
+        self._apply([
+            *[migrations.RenameField(model_name, field_name, f'{field_name}_binary') for model_name, field_name in fields],
+            *[migrations.AddField(model_name, field_name, models.JSONField(blank=True, null=True)) for model_name, field_name in fields],
+        ])
+        self.student = StudentProfile.objects.create(user=CustomUser.objects.create(username='student', role='student'))
+
+    def _apply(self, operations):
+        with connection.schema_editor() as editor:
+            for operation in operations:
+                from_state = self.state.clone()
+                operation.state_forwards('facial_recognition', self.state)
+                operation.database_forwards('facial_recognition', editor, from_state, self.state)
+
+    def test_json_embeddings_become_packed_float32(self):
+        values = np.random.default_rng(0).standard_normal(512).tolist()
+        OldFaceImage = self.state.apps.get_model('facial_recognition', 'FaceImage')
+        OldFaceEmbedding = self.state.apps.get_model('facial_recognition', 'FaceEmbedding')
+        with_embedding = OldFaceImage.objects.create(student_id=self.student.pk, image='face.jpg', embedding=values)
+        without_embedding = OldFaceImage.objects.create(student_id=self.student.pk, image='face.jpg', embedding=None)
+        empty_embedding = OldFaceImage.objects.create(student_id=self.student.pk, image='face.jpg', embedding=[])
+        OldFaceEmbedding.objects.create(student_id=self.student.pk, avg_embedding=values[:4])
+
+        fields = binary_embeddings_migration.EMBEDDING_FIELDS
+        self._apply(binary_embeddings_migration.Migration.operations[len(fields):])
+
+        embedding = FaceImage.objects.get(pk=with_embedding.pk).embedding
+        self.assertEqual(embedding.dtype, EMBEDDING_DTYPE)
+        np.testing.assert_array_equal(embedding, np.asarray(values, dtype=np.float32))
+        self.assertIsNone(FaceImage.objects.get(pk=without_embedding.pk).embedding)
+        self.assertIsNone(FaceImage.objects.get(pk=empty_embedding.pk).embedding)
+        np.testing.assert_array_equal(
+            FaceEmbedding.objects.get(student=self.student).avg_embedding, np.asarray(values[:4], dtype=np.float32)
+        )
+
+
+class IterSampledFramesTests(SimpleTestCase):
+    def _write_clip(self, seconds, fps=10):
+        handle, path = tempfile.mkstemp(suffix='.avi')
+        os.close(handle)
+        self.addCleanup(os.remove, path)
+        writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'MJPG'), fps, (64, 48))
+        for index in range(seconds * fps):
+            writer.write(np.full((48, 64, 3), index % 256, dtype=np.uint8))
+        writer.release()
+        return path
+
+    def _sample(self, path, **kwargs):
+        cap = cv2.VideoCapture(path)
+        try:
+            return [index for index, _ in iter_sampled_frames(cap, **kwargs)]
+        finally:
+            cap.release()
+
+    def test_samples_span_clip_longer_than_max_frames(self):
+        # 30 seconds at one sample per second would be 30 samples; 10 must still reach the end
+        path = self._write_clip(seconds=30)
+        for policy in ('rate', 'every_n', 'scene'):
+            with self.subTest(policy=policy):
+                indices = self._sample(path, policy=policy, every_n=10, samples_per_second=1.0, max_frames=10)
+                self.assertLessEqual(len(indices), 10)
+                self.assertEqual(indices[0], 0)
+                self.assertGreaterEqual(indices[-1], 270)
+
+    def test_short_clip_keeps_policy_rate(self):
+        path = self._write_clip(seconds=5)
+        self.assertEqual(self._sample(path, policy='rate', samples_per_second=1.0, max_frames=60), [0, 10, 20, 30, 40])
+
+
+class _Rollback(Exception):
+    pass
+
+
+class DeletedFaceImageTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root.name))
+        self.student = StudentProfile.objects.create(user=CustomUser.objects.create(username='student', role='student'))
+        embeddings = np.eye(3, 512, dtype=np.float32)
+        self.images = [
+            FaceImage.objects.create(student=self.student, image=ContentFile(b'jpeg', name=f'face{index}.jpg'), embedding=embedding)
+            for index, embedding in enumerate(embeddings)
+        ]
+        add_face_embeddings(self.student, embeddings)
+
+    def test_delete_in_rolled_back_savepoint_is_kept(self):
+        kept, removed = self.images[0], self.images[1]
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                removed.delete()
+                try:
+                    with transaction.atomic():
+                        FaceImage.objects.get(pk=kept.pk).delete()
+                        raise _Rollback
+                except _Rollback:
+                    pass
+
+        self.assertTrue(FaceImage.objects.filter(pk=kept.pk).exists())
+        self.assertTrue(default_storage.exists(kept.image.name))
+        self.assertFalse(default_storage.exists(removed.image.name))
+        face_embedding = FaceEmbedding.objects.get(student=self.student)
+        self.assertEqual(face_embedding.num_samples, 2)
+        np.testing.assert_allclose(face_embedding.embedding_sum, self.images[0].embedding + self.images[2].embedding)
+
+
+class RunningEmbeddingSumTests(TestCase):
+    def setUp(self):
+        self.student = StudentProfile.objects.create(user=CustomUser.objects.create(username='student', role='student'))
+        embeddings = np.random.default_rng(0).standard_normal((4, 512)).astype(np.float32)
+        self.embeddings = embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+
+    def _add_image(self, embedding):
+        FaceImage.objects.create(student=self.student, image='face.jpg', embedding=embedding)
+        add_face_embeddings(self.student, [embedding])
+
+    def _stored(self):
+        face_embedding = FaceEmbedding.objects.get(student=self.student)
+        return face_embedding.embedding_sum.copy(), face_embedding.avg_embedding.copy(), face_embedding.num_samples
+
+    def _assert_matches_recompute(self):
+        embedding_sum, average, num_samples = self._stored()
+        recalculate_embedding(self.student)
+        expected_sum, expected_average, expected_samples = self._stored()
+        self.assertEqual(num_samples, expected_samples)
+        np.testing.assert_allclose(embedding_sum, expected_sum, atol=1e-5)
+        np.testing.assert_allclose(average, expected_average, atol=1e-6)
+
+    def test_add_remove_readd_matches_recompute(self):
+        for embedding in self.embeddings[:3]:
+            self._add_image(embedding)
+        # Removal as the FaceImage post_delete signal does it, without running its on_commit batch
+        FaceImage.objects.filter(embedding=self.embeddings[1].tobytes()).delete()
+        remove_face_embeddings(self.student, [self.embeddings[1]])
+        self._add_image(self.embeddings[1])
+        self._add_image(self.embeddings[3])
+        self._assert_matches_recompute()
+
+    def test_learned_faces_are_not_drift(self):
+        for embedding in self.embeddings[:2]:
+            self._add_image(embedding)
+        add_face_embeddings(self.student, self.embeddings[2:], learned=True)
+        self._assert_matches_recompute()
+        self.assertEqual(self._stored()[2], 4)
+
+        out = StringIO()
+        call_command('rebuild_face_embeddings', '--check', stdout=out)
+        self.assertIn('0 drifted', out.getvalue())
+
+        FaceEmbedding.objects.filter(student=self.student).update(num_samples=3)
+        out = StringIO()
+        call_command('rebuild_face_embeddings', stdout=out)
+        self.assertIn('1 drifted', out.getvalue())
+        self.assertEqual(self._stored()[2], 4)
+
+
+class FaceGalleryStampTests(TestCase):
+    def setUp(self):
+        self.gallery = FaceGallery()
+        self.prototypes = [
+            FacePrototype.objects.create(
+                student=StudentProfile.objects.create(user=CustomUser.objects.create(username=f'student{index}', role='student')),
+                embedding=np.eye(1, 512, index, dtype=np.float32)[0],
+                num_samples=1,
+            )
+            for index in range(2)
+        ]
+        self.gallery.refresh()
+
+    def _apply_local(self, prototype):
+        # What the FacePrototype post_save signal does in this process
+        with self.captureOnCommitCallbacks(execute=True):
+            prototype.save()
+            self.gallery.apply_change(prototype)
+
+    def test_local_write_after_other_worker_write_reloads(self):
+        other, local = self.prototypes
+        # Another worker moves a prototype; no signal reaches this process
+        FacePrototype.objects.filter(pk=other.pk).update(embedding=np.eye(1, 512, 5, dtype=np.float32)[0], updated_at=timezone.now())
+        local.embedding = np.eye(1, 512, 7, dtype=np.float32)[0]
+        self._apply_local(local)
+
+        student_ids, similarities = self.gallery.match(np.eye(1, 512, 5, dtype=np.float32))
+        self.assertEqual(student_ids[0], other.student_id)
+        self.assertAlmostEqual(float(similarities[0]), 1.0, places=5)
+
+    def test_own_writes_do_not_reload(self):
+        local = self.prototypes[1]
+        local.embedding = np.eye(1, 512, 7, dtype=np.float32)[0]
+        self._apply_local(local)
+        version = self.gallery._version
+        self.gallery.refresh()
+        self.assertEqual(self.gallery._version, version)
+        student_ids, _ = self.gallery.match(np.eye(1, 512, 7, dtype=np.float32))
+        self.assertEqual(student_ids[0], local.student_id)
+
+    def test_rolled_back_write_is_not_applied(self):
+        local = self.prototypes[1]
+        with self.captureOnCommitCallbacks(execute=True):
+            try:
+                with transaction.atomic():
+                    local.embedding = np.eye(1, 512, 7, dtype=np.float32)[0]
+                    local.save()
+                    self.gallery.apply_change(local)
+                    raise _Rollback
+            except _Rollback:
+                pass
+
+        self.assertEqual(self.gallery._own_writes, {})
+        student_ids, similarities = self.gallery.match(np.eye(1, 512, 1, dtype=np.float32))
+        self.assertEqual(student_ids[0], local.student_id)
+        self.assertAlmostEqual(float(similarities[0]), 1.0, places=5)
+
+
+def start_inference_server(address, **kwargs):
+    """Serve on address from a daemon thread; it runs until the test process exits."""
+    server = inference_server.InferenceServer(address, b'test-key', **kwargs)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    for _ in range(100):
+        if os.path.exists(address):
+            return
+        time.sleep(0.01)
+
+
+@override_settings(FACE_DETECTION_CACHE='django')
+class DetectionCacheSocketModeTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.inferred = []
+        self.version_threads = []
+        # Not cleaned up: the server's listener unlinks its socket when the process exits
+        self.socket = os.path.join(tempfile.mkdtemp(), 'inference.sock')
+        self.addCleanup(self._close_client)
+
+    def _close_client(self):
+        connection = getattr(inference_server._client, 'connection', None)
+        if connection is not None:
+            connection.close()
+        inference_server._client.connection = None
+
+    def _analyze(self, images):
+        self.inferred.extend(images)
+        return [[inference.DetectedFace(np.array([0, 0, 10, 10], dtype=np.float32), None, 0.9, np.ones(512, dtype=np.float32))] for _ in images]
+
+    def _server_model_version(self):
+        self.version_threads.append(threading.current_thread())
+        return 'server-models'
+
+    def _upload(self):
+        upload = BytesIO(b'classroom photo')
+        upload.name = 'class.jpg'
+        return upload
+
+    def test_socket_mode_needs_no_local_models(self):
+        image = np.zeros((32, 32, 3), dtype=np.uint8)
+        with mock.patch.object(inference, 'analyze_images', self._analyze), \
+                mock.patch.object(inference, 'local_model_version', self._server_model_version), \
+                mock.patch.object(inference, 'model_dir', side_effect=AssertionError("worker read local model files")):
+            start_inference_server(self.socket, batch_size=4, batch_wait=0.001)
+            with override_settings(FACE_INFERENCE_SOCKET=self.socket, FACE_INFERENCE_AUTHKEY='test-key'):
+                first = detection_cache.get_upload_faces([self._upload()], [image], 1280)
+                second = detection_cache.get_upload_faces([self._upload()], [image], 1280)
+
+        self.assertEqual(len(self.inferred), 1)
+        self.assertEqual(len(first[0]), 1)
+        np.testing.assert_array_equal(second[0][0].normed_embedding, first[0][0].normed_embedding)
+        # Only the server's connection threads read the model version
+        self.assertTrue(self.version_threads)
+        self.assertNotIn(threading.current_thread(), self.version_threads)
+
+    def test_key_failure_skips_cache(self):
+        image = np.zeros((32, 32, 3), dtype=np.uint8)
+        with mock.patch.object(detection_cache, 'model_version', side_effect=ConnectionError("no model")), \
+                mock.patch.object(detection_cache, 'get_faces_batch', self._analyze), \
+                self.assertLogs(detection_cache.logger, 'WARNING'):
+            faces = detection_cache.get_upload_faces([self._upload(), self._upload()], [image, image], 1280)
+        self.assertEqual(len(self.inferred), 2)
+        self.assertEqual([len(image_faces) for image_faces in faces], [1, 1])
+
+
+class SharedPoolTests(SimpleTestCase):
+    def test_submit_releases_db_connection(self):
+        pool = SharedPool('test-pool', lambda: 1, max_pending=lambda: 1)
+        with mock.patch.object(inference, 'connection') as db_connection:
+            self.assertEqual(pool.submit(sum, [1, 2]).result(), 3)
+            with self.assertRaises(ZeroDivisionError):
+                pool.submit(divmod, 1, 0).result()
+        pool._executor.shutdown()
+        self.assertEqual(db_connection.close.call_count, 2)
+        # Both slots were given back
+        self.assertTrue(pool._slots.acquire(blocking=False))
+
+
+class InferenceServerBatchTests(SimpleTestCase):
+    def setUp(self):
+        self.batches = []
+
+    def _analyze(self, images):
+        self.batches.append(len(images))
+        if any(image.size == 0 for image in images):
+            raise ValueError("empty image")
+        return [[int(image[0, 0, 0])] for image in images]
+
+    def _request(self, image, results, index):
+        try:
+            results[index] = inference_server.request_faces([image])
+        except inference_server.InferenceServerError as e:
+            results[index] = e
+        finally:
+            inference_server._client.connection.close()
+
+    def test_failed_batch_retries_requests_alone(self):
+        # Not cleaned up: the server's listener unlinks its socket when the process exits
+        socket = os.path.join(tempfile.mkdtemp(), 'inference.sock')
+        images = [np.full((8, 8, 3), 1, dtype=np.uint8), np.empty((0, 0, 3), dtype=np.uint8), np.full((8, 8, 3), 3, dtype=np.uint8)]
+        results = [None] * len(images)
+        with mock.patch.object(inference, 'analyze_images', self._analyze), \
+                override_settings(FACE_INFERENCE_SOCKET=socket, FACE_INFERENCE_AUTHKEY='test-key'), \
+                self.assertLogs(inference_server.logger, 'WARNING'):
+            start_inference_server(socket, batch_size=len(images), batch_wait=5)
+            clients = [threading.Thread(target=self._request, args=(image, results, index)) for index, image in enumerate(images)]
+            for client in clients:
+                client.start()
+            for client in clients:
+                client.join()
+
+        self.assertEqual(self.batches, [3, 1, 1, 1])
+        self.assertEqual(results[0], [[1]])
+        self.assertIsInstance(results[1], inference_server.InferenceServerError)
+        self.assertEqual(results[2], [[3]])
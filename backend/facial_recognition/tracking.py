@@ -0,0 +1,98 @@
+import numpy as np
+from .ann import normalize_rows
+
+
+def box_iou(boxes, box):
+    """IoU of one (left, top, right, bottom) box against an (n x 4) array of boxes."""
+    boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+    width = np.clip(np.minimum(boxes[:, 2], box[2]) - np.maximum(boxes[:, 0], box[0]), 0, None)
+    height = np.clip(np.minimum(boxes[:, 3], box[3]) - np.maximum(boxes[:, 1], box[1]), 0, None)
+    intersection = width * height
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    union = areas + (box[2] - box[0]) * (box[3] - box[1]) - intersection
+    return intersection / np.maximum(union, 1e-6)
+
+
+class FaceTrack:
+    """One person followed across sampled frames."""
+
+    def __init__(self, sample, crop, box, embedding, quality):
+        self.box = box
+        self.last_sample = sample
+        self.detections = 1
+        self._embedding_sum = np.array(embedding, dtype=np.float32)
+        # Copy so a crop that is a view into its frame doesn't keep the frame alive
+        self.crop = np.array(crop)
+        self.quality = quality
+
+    @property
+    def embedding(self):
+        """Mean of the track's normalised embeddings, renormalised."""
+        return normalize_rows(self._embedding_sum.reshape(1, -1))[0]
+
+    def add(self, sample, crop, box, embedding, quality):
+        self.box = box
+        self.last_sample = sample
+        self.detections += 1
+        self._embedding_sum += embedding
+        # Keep the sharpest, largest view of the face for review and storage
+        if quality > self.quality:
+            self.crop, self.quality = np.array(crop), quality
+
+
+class FaceTracker:
+    """
+    Links face detections from consecutive sampled frames into tracks.
+
+    A detection joins the track it is most similar to when their embeddings
+    have cosine similarity of at least `similarity_threshold`, or when its box
+    overlaps the track's last box by at least `iou_threshold`, the track was
+    seen within the last `max_gap` sampled frames and the embeddings still
+    agree at half the similarity threshold.
+    Each track and each detection is linked at most once per frame, greedily
+    from the best pair down; unlinked detections start new tracks.
+    """
+
+    def __init__(self, iou_threshold=0.3, similarity_threshold=0.5, max_gap=3):
+        self.iou_threshold = iou_threshold
+        self.similarity_threshold = similarity_threshold
+        self.max_gap = max_gap
+        self.tracks = []
+        self._samples = 0
+
+    def __len__(self):
+        return len(self.tracks)
+
+    def update(self, faces):
+        """Add the next sampled frame's faces, given as (crop, box, embedding, det_score) tuples."""
+        self._samples += 1
+        if not faces:
+            return
+        embeddings = normalize_rows(np.stack([embedding for _, _, embedding, _ in faces]))
+        pairs = []
+        if self.tracks:
+            similarities = embeddings @ np.stack([track.embedding for track in self.tracks]).T
+            recent = [t for t, track in enumerate(self.tracks) if self._samples - track.last_sample <= self.max_gap]
+            for d, (_, box, _, _) in enumerate(faces):
+                overlaps = np.zeros(len(self.tracks), dtype=np.float32)
+                if recent:
+                    overlaps[recent] = box_iou([self.tracks[t].box for t in recent], box)
+                linked = (similarities[d] >= self.similarity_threshold) | (
+                    (overlaps >= self.iou_threshold) & (similarities[d] >= self.similarity_threshold / 2)
+                )
+                pairs.extend((similarities[d, t] + overlaps[t], d, t) for t in np.flatnonzero(linked))
+
+        assigned = {}
+        used_tracks = set()
+        for _, d, t in sorted(pairs, reverse=True):
+            if d not in assigned and t not in used_tracks:
+                assigned[d] = t
+                used_tracks.add(t)
+
+        for d, (crop, box, _, det_score) in enumerate(faces):
+            # Detector confidence weighted by face size, so close, clear faces win
+            quality = float(det_score) * np.sqrt(max(1, (box[2] - box[0]) * (box[3] - box[1])))
+            if d in assigned:
+                self.tracks[assigned[d]].add(self._samples, crop, box, embeddings[d], quality)
+            else:
+                self.tracks.append(FaceTrack(self._samples, crop, box, embeddings[d], quality))
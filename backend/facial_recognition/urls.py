@@ -6,9 +6,15 @@ from .views import (
     MarkAttendanceView,
     UnrecognizedFaceListView,
     AssignUnrecognizedFaceView,
+    UnrecognizedFaceClusterListView,
+    AssignUnrecognizedFaceClusterView,
     ReviewFaceListView,
     ConfirmReviewFaceView,
     MarkAttendanceVideoView,
+    ModelReadinessView,
+    FaceMetricsView,
+    VideoAttendanceJobCreateView,
+    VideoAttendanceJobDetailView,
 )
 
 urlpatterns = [
@@ -18,7 +24,13 @@ urlpatterns = [
     path('mark/', MarkAttendanceView.as_view(), name='mark-attendance'),
     path('unrecognized/list/', UnrecognizedFaceListView.as_view(), name='unrecognized-face-list'),
     path('unrecognized/assign/', AssignUnrecognizedFaceView.as_view(), name='assign-unrecognized-face'),
+    path('unrecognized/clusters/', UnrecognizedFaceClusterListView.as_view(), name='unrecognized-face-cluster-list'),
+    path('unrecognized/clusters/assign/', AssignUnrecognizedFaceClusterView.as_view(), name='assign-unrecognized-face-cluster'),
     path('review/list/', ReviewFaceListView.as_view(), name='review-face-list'),
     path('review/confirm/', ConfirmReviewFaceView.as_view(), name='confirm-review-face'),
     path('mark/video/', MarkAttendanceVideoView.as_view(), name='mark-attendance-video'),
+    path('mark/video/jobs/', VideoAttendanceJobCreateView.as_view(), name='video-attendance-job-create'),
+    path('mark/video/jobs/<uuid:pk>/', VideoAttendanceJobDetailView.as_view(), name='video-attendance-job-detail'),
+    path('ready/', ModelReadinessView.as_view(), name='face-model-ready'),
+    path('metrics/', FaceMetricsView.as_view(), name='face-metrics'),
 ]
\ No newline at end of file
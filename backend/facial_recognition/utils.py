@@ -1,15 +1,76 @@
 import numpy as np
 from django.core.files.storage import default_storage
-from .models import FaceEmbedding
+from django.db import transaction
+from .models import FaceEmbedding, FacePrototype
+from .prototypes import add_to_prototypes, rebuild_prototypes, remove_from_prototypes
 
 def recalculate_embedding(student):
-    face_images = student.face_images.all()
-    embeddings = [img.embedding for img in face_images if img.embedding]
+    # values_list skips model instantiation; each value is a float32 array
+    embeddings = [embedding for embedding in student.face_images.values_list('embedding', flat=True) if embedding is not None]
     if embeddings:
-        avg_embedding = np.mean(embeddings, axis=0).tolist()
+        embedding_sum = np.sum(embeddings, axis=0, dtype=np.float32)
         face_embedding, created = FaceEmbedding.objects.get_or_create(student=student)
-        face_embedding.avg_embedding = avg_embedding
-        face_embedding.num_samples = len(embeddings)
+        num_samples = len(embeddings)
+        if face_embedding.learned_samples:
+            # Learned attendance faces have no FaceImage, so carry them over
+            embedding_sum = embedding_sum + face_embedding.learned_sum
+            num_samples += face_embedding.learned_samples
+        face_embedding.embedding_sum = embedding_sum
+        face_embedding.avg_embedding = embedding_sum / num_samples
+        face_embedding.num_samples = num_samples
         face_embedding.save()
     else:
-        FaceEmbedding.objects.filter(student=student).delete()
\ No newline at end of file
+        FaceEmbedding.objects.filter(student=student).delete()
+    rebuild_prototypes(student, embeddings)
+
+def add_face_embeddings(student, embeddings, learned=False):
+    """
+    Add embeddings to the student's running sum and average; O(1) in the
+    number of stored faces. learned marks attendance faces stored without a
+    FaceImage; they are also kept in learned_sum so rebuilds can keep them.
+    """
+    embeddings = np.asarray(embeddings, dtype=np.float32).reshape(len(embeddings), -1)
+    if not len(embeddings):
+        return
+    with transaction.atomic():
+        face_embedding, created = FaceEmbedding.objects.select_for_update().get_or_create(student=student)
+        embedding_sum = embeddings.sum(axis=0)
+        if face_embedding.embedding_sum is not None and len(face_embedding.embedding_sum):
+            embedding_sum += face_embedding.embedding_sum
+        face_embedding.embedding_sum = embedding_sum
+        face_embedding.num_samples += len(embeddings)
+        face_embedding.avg_embedding = embedding_sum / face_embedding.num_samples
+        if learned:
+            learned_sum = embeddings.sum(axis=0)
+            if face_embedding.learned_samples:
+                learned_sum += face_embedding.learned_sum
+            face_embedding.learned_sum = learned_sum
+            face_embedding.learned_samples += len(embeddings)
+        face_embedding.save()
+    add_to_prototypes(student, embeddings)
+
+def remove_face_embeddings(student, embeddings):
+    """
+    Take embeddings of faces that no longer belong to the student out of the
+    running sum and average. Once the student has no face images left the
+    FaceEmbedding and prototypes are dropped, as recalculate_embedding does.
+    """
+    embeddings = np.asarray([embedding for embedding in embeddings if embedding is not None], dtype=np.float32)
+    with transaction.atomic():
+        face_embedding = FaceEmbedding.objects.select_for_update().filter(student=student).first()
+        if not student.face_images.exists():
+            if face_embedding:
+                face_embedding.delete()
+            FacePrototype.objects.filter(student=student).delete()
+            return
+        if face_embedding is None or face_embedding.embedding_sum is None or not len(embeddings):
+            return
+        if face_embedding.num_samples <= len(embeddings):
+            # More removed than recorded: the sums have drifted, so start over
+            recalculate_embedding(student)
+            return
+        face_embedding.embedding_sum = face_embedding.embedding_sum - embeddings.reshape(len(embeddings), -1).sum(axis=0)
+        face_embedding.num_samples -= len(embeddings)
+        face_embedding.avg_embedding = face_embedding.embedding_sum / face_embedding.num_samples
+        face_embedding.save()
+    remove_from_prototypes(student, embeddings)
@@ -0,0 +1,77 @@
+import logging
+import math
+import cv2
+import numpy as np
+from .imaging import downscale
+
+logger = logging.getLogger(__name__)
+
+SAMPLING_POLICIES = ('every_n', 'rate', 'scene')
+
+# Frames compared by the scene-change policy are shrunk to this size first
+SCENE_THUMBNAIL_SIZE = (64, 36)
+
+
+def iter_sampled_frames(cap, policy='rate', every_n=30, samples_per_second=1.0, scene_threshold=12.0,
+                        max_frames=60, max_side=1280, progress=None):
+    """
+    Decode a video front to back once, yielding (frame_index, frame) for the
+    frames picked by the sampling policy:
+
+    - 'every_n': every `every_n`-th frame.
+    - 'rate': `samples_per_second` frames per second of video.
+    - 'scene': a frame whenever it differs from the last sampled one by more
+      than `scene_threshold` (mean absolute grey-level difference), checked
+      at `samples_per_second` * 4 and never more than 2 seconds apart.
+
+    At most `max_frames` frames are sampled. When the policy would sample
+    more over the whole video (as told by CAP_PROP_FRAME_COUNT), the step is
+    widened to frame_count / max_frames so the samples still span the clip
+    instead of stopping partway through it.
+
+    Skipped frames are only grabbed, not converted, and sampled frames are
+    shrunk to `max_side` right after decoding so full-size frames are never
+    kept. Unlike seeking with CAP_PROP_POS_FRAMES, no frame is decoded twice.
+    progress(frames_done, frames_total) is called after every sampled frame.
+    """
+    if policy not in SAMPLING_POLICIES:
+        raise ValueError(f"Unknown sampling policy {policy!r}.")
+    fps = cap.get(cv2.CAP_PROP_FPS) or 25
+    frames_total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    if policy == 'every_n':
+        step = max(1, every_n)
+    elif policy == 'rate':
+        step = max(1, round(fps / samples_per_second))
+    else:
+        step = max(1, round(fps / (samples_per_second * 4)))
+        max_gap = round(2 * fps)
+    if frames_total > 0 and max_frames:
+        step = max(step, math.ceil(frames_total / max_frames))
+        if policy == 'scene':
+            max_gap = max(max_gap, step)
+
+    sampled = 0
+    last_thumbnail = None
+    last_sampled_index = None
+    index = -1
+    while sampled < max_frames and cap.grab():
+        index += 1
+        if index % step:
+            continue
+        ret, frame = cap.retrieve()
+        if not ret:
+            continue
+        if policy == 'scene':
+            thumbnail = cv2.resize(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY), SCENE_THUMBNAIL_SIZE, interpolation=cv2.INTER_AREA)
+            changed = last_thumbnail is None or np.abs(thumbnail.astype(np.int16) - last_thumbnail).mean() > scene_threshold
+            if not changed and index - last_sampled_index < max_gap:
+                continue
+            last_thumbnail = thumbnail.astype(np.int16)
+            last_sampled_index = index
+        sampled += 1
+        yield index, downscale(frame, max_side)
+        if progress:
+            progress(index + 1, max(frames_total, index + 1))
+    if sampled >= max_frames and (frames_total <= 0 or index + step < frames_total) and cap.grab():
+        # Only when the frame count was missing or understated
+        logger.warning(f"Stopped sampling at frame {index} after {sampled} samples; the rest of the video was not used")
@@ -1,51 +1,64 @@
 from rest_framework import status
 from rest_framework.response import Response
-from rest_framework.generics import GenericAPIView, ListAPIView, DestroyAPIView
+from rest_framework.generics import GenericAPIView, ListAPIView, DestroyAPIView, RetrieveAPIView
+from django.http import HttpResponse
 from django.shortcuts import get_object_or_404
-from .models import FaceImage, FaceEmbedding, StudentProfile, UnrecognizedFace, ReviewFace
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Prefetch, Q
+from rest_framework.pagination import PageNumberPagination
+from .models import FaceImage, StudentProfile, UnrecognizedFace, UnrecognizedFaceCluster, ReviewFace, VideoAttendanceJob
 from .serializers import (
     EnrollFaceSerializer, MarkAttendanceSerializer, AssignUnrecognizedFaceSerializer,
-    ConfirmReviewFaceSerializer, FaceImageSerializer, UnrecognizedFaceSerializer, ReviewFaceSerializer, MarkAttendanceVideoSerializer
+    ConfirmReviewFaceSerializer, FaceImageSerializer, UnrecognizedFaceSerializer, ReviewFaceSerializer, MarkAttendanceVideoSerializer,
+    VideoAttendanceJobSerializer, UnrecognizedFaceClusterSerializer, AssignUnrecognizedFaceClusterSerializer
 )
 from attendance.models import AttendanceRecord as CentralAttendanceRecord
-from insightface.app import FaceAnalysis
+from attendance.utils import upsert_attendance_records
 import numpy as np
 import cv2
 from PIL import Image
 from datetime import date
-from sklearn.metrics.pairwise import cosine_similarity
+import os
 import uuid
-from PIL import Image as PilImage
-from io import BytesIO
-from django.core.files import File
-from django.core.files.base import ContentFile
-from .utils import recalculate_embedding
-
-from rest_framework.permissions import IsAuthenticated
+from .utils import add_face_embeddings, remove_face_embeddings
+from .gallery import face_gallery
+from .clustering import OPEN_FACES
+from .imaging import decode_image, encode_jpeg
+from .inference import get_faces, get_faces_batch, is_model_loaded, map_parallel, warmup
+from .detection_cache import get_upload_faces
+from .jobs import submit_video_job
+from .metrics import count_faces, render as render_metrics, stage, timed_request
+from .writer import PendingReviewFace, PendingUnrecognizedFace, submit_face_crops
+
+from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.views import APIView
 from .permissions import AdminOnlyPermission, TeacherOrAdminPermission
 
 
-# Initialize InsightFace model
-app = FaceAnalysis(name='buffalo_l', providers=['CPUExecutionProvider'])
-app.prepare(ctx_id=0, det_size=(640, 640), det_thresh=0.4)
-
 # Thresholds
 SIMILARITY_THRESHOLD = 0.4
 HIGH_CONFIDENCE_THRESHOLD = 0.9
 
+# Enrolment photos are stored as JPEGs of at most this size
+ENROLL_IMAGE_MAX_SIDE = 640
+ENROLL_IMAGE_QUALITY = 85
+
 # Helper functions
-def compute_embedding(image_file):
-    image = Image.open(image_file).convert('RGB')
-    image = cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR)
-    faces = app.get(image)
+def decode_upload(image_file, max_side=None):
+    return decode_image(image_file, max_side=max_side or settings.FACE_DECODE_MAX_SIDE)
+
+def compute_embedding(image, image_file=None, max_side=None):
+    # With the upload it was decoded from, a photo enrolled before skips inference
+    faces = get_faces(image) if image_file is None else get_upload_faces([image_file], [image], max_side)[0]
+    count_faces(len(faces))
     if len(faces) != 1:
         return None
-    return faces[0].normed_embedding.tolist()
+    return faces[0].normed_embedding
 
 def crop_face(image_file):
-    image = Image.open(image_file).convert('RGB')
-    image = cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR)
-    faces = app.get(image)
+    image = decode_upload(image_file)
+    faces = get_faces(image)
     if not faces:
         return None
     face = faces[0]
@@ -53,52 +66,121 @@ def crop_face(image_file):
     cropped = Image.fromarray(cv2.cvtColor(image[bbox[1]:bbox[3], bbox[0]:bbox[2]], cv2.COLOR_BGR2RGB))
     return cropped
 
-def update_embedding_with_new_face(student, new_embedding):
-    face_embedding, created = FaceEmbedding.objects.get_or_create(student=student)
-    if not face_embedding.avg_embedding:
-        face_embedding.avg_embedding = new_embedding
-        face_embedding.num_samples = 1
-    else:
-        current_embedding = np.array(face_embedding.avg_embedding)
-        new_embedding = np.array(new_embedding)
-        avg_embedding = (current_embedding * face_embedding.num_samples + new_embedding) / (face_embedding.num_samples + 1)
-        face_embedding.avg_embedding = avg_embedding.tolist()
-        face_embedding.num_samples += 1
-    face_embedding.save()
-
-def save_pil_image_to_file(pil_image, filename):
-    buffer = BytesIO()
-    pil_image.save(buffer, format='JPEG')
-    buffer.seek(0)
-    return File(buffer, name=filename)
-
-def compress_image(image_file, max_size=(640, 640), quality=85):
-    img = PilImage.open(image_file)
-    img = img.convert('RGB')
-    img.thumbnail(max_size, PilImage.Resampling.LANCZOS)  # Resize while preserving aspect ratio
-    output = BytesIO()
-    img.save(output, format='JPEG', quality=quality)  # Compress to JPEG
-    output.seek(0)
-    return ContentFile(output.read(), name=image_file.name)
+def update_embedding_with_new_face(student, new_embedding, learned=False):
+    update_embedding_with_new_faces(student, [new_embedding], learned)
+
+def update_embedding_with_new_faces(student, new_embeddings, learned=False):
+    """Fold several new embeddings into the student's running average with one save; see add_face_embeddings for learned."""
+    add_face_embeddings(student, new_embeddings, learned)
+
+def match_detected_faces(detections, recognized_student_ids, school_class_id=None):
+    """
+    Match every (image, box, embedding) detection against the gallery in one
+    pass, then mark, queue for review or store as unrecognized per face.
+    With school_class_id, faces are matched against that class's students first.
+    Review and unrecognized crops are written by the background face writer
+    once the response is on its way.
+    """
+    if not detections:
+        return
+    with stage('match'):
+        student_ids, similarities = face_gallery.match(
+            np.stack([embedding for _, _, embedding in detections]), school_class_id=school_class_id
+        )
+        students = StudentProfile.objects.in_bulk([int(student_id) for student_id in set(student_ids.tolist()) if student_id >= 0])
+    review_faces, unrecognized_faces = [], []
+
+    for (image, (left, top, right, bottom), embedding), student_id, similarity in zip(detections, student_ids, similarities):
+        best_match = students.get(int(student_id))
+        highest_similarity = float(similarity)
+
+        # Process based on similarity
+        if best_match and highest_similarity >= SIMILARITY_THRESHOLD:  # 0.4 or higher
+            # Mark attendance
+            recognized_student_ids.add(best_match.id)
+
+            if highest_similarity >= HIGH_CONFIDENCE_THRESHOLD:  # 0.9 or higher
+                # High confidence: update embedding automatically
+                with stage('learn'):
+                    update_embedding_with_new_face(best_match, embedding, learned=True)
+            else:  # Between 0.4 and 0.9
+                # Medium confidence: save for admin review
+                review_faces.append(PendingReviewFace(
+                    image[top:bottom, left:right].copy(), best_match.id, embedding, highest_similarity
+                ))
+        else:
+            # No match or similarity < 0.4: save as unrecognized
+            unrecognized_faces.append(PendingUnrecognizedFace(image[top:bottom, left:right].copy(), embedding))
+
+    # Time spent waiting for a writer slot, or writing the crops with FACE_WRITER_WORKERS = 0
+    with stage('crops'):
+        submit_face_crops(review_faces, unrecognized_faces)
+
+def mark_recognized_students(recognized_student_ids, status_input, day, note):
+    """Mark every recognized student in one statement; records already made that day are kept."""
+    with stage('attendance'):
+        upsert_attendance_records([
+            CentralAttendanceRecord(
+                student_id=student_id,
+                date=day,
+                status='present' if status_input == 'onTime' else 'late',
+                recorded_by=None,  # Automated marking, no specific user
+                note=note,
+            )
+            for student_id in recognized_student_ids
+        ], overwrite=False)
+
+def clip_face_box(face, image):
+    """Clip a face bbox to the image; returns None if the crop would be empty."""
+    bbox = face.bbox.astype(int)
+    h, w = image.shape[:2]
+    left = max(0, bbox[0])
+    top = max(0, bbox[1])
+    right = min(w, bbox[2])
+    bottom = min(h, bbox[3])
+    if right <= left or bottom <= top:
+        return None
+    return left, top, right, bottom
+
+class StageTimingMixin:
+    """
+    Times the request's stages (see metrics.stage) and returns them in a
+    Server-Timing header, besides adding them to the histograms served by
+    FaceMetricsView under timing_endpoint.
+    """
+    timing_endpoint = None
+
+    def dispatch(self, request, *args, **kwargs):
+        with timed_request(self.timing_endpoint) as timer:
+            response = super().dispatch(request, *args, **kwargs)
+        response['Server-Timing'] = timer.server_timing()
+        return response
 
 
 # Enroll a single face image
-class EnrollFaceView(GenericAPIView):
+class EnrollFaceView(StageTimingMixin, GenericAPIView):
     permission_classes = [IsAuthenticated, AdminOnlyPermission]
     serializer_class = EnrollFaceSerializer
+    timing_endpoint = 'enroll'
 
     def post(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
         if serializer.is_valid():
             student_id = serializer.validated_data['student_id']
             image_file = serializer.validated_data['image']
-            compressed_image = compress_image(image_file)  # Compress the image
             student = get_object_or_404(StudentProfile, pk=student_id)
-            embedding = compute_embedding(compressed_image)  # Use compressed image
-            if not embedding:
+            # Decode once at the stored size; the same array is embedded and saved
+            with stage('decode'):
+                image = decode_upload(image_file, max_side=ENROLL_IMAGE_MAX_SIDE)
+            with stage('detect'):
+                embedding = compute_embedding(image, image_file, ENROLL_IMAGE_MAX_SIDE)
+            if embedding is None:
                 return Response({"error": "Image must contain exactly one face."}, status=status.HTTP_400_BAD_REQUEST)
-            FaceImage.objects.create(student=student, image=compressed_image, embedding=embedding)
-            update_embedding_with_new_face(student, embedding)
+            with stage('store'):
+                stored_image = encode_jpeg(image, f"{os.path.splitext(image_file.name)[0]}.jpg", quality=ENROLL_IMAGE_QUALITY)
+                FaceImage.objects.create(student=student, image=stored_image, embedding=embedding)
+            with stage('learn'):
+                update_embedding_with_new_face(student, embedding)
             return Response({"message": "Image enrolled successfully."}, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
     
@@ -111,17 +193,8 @@ class RemoveFaceImageView(DestroyAPIView):
 
     def destroy(self, request, *args, **kwargs):
         face_image = self.get_object()
-        student = face_image.student
+        # The post_delete signal takes the face out of the average and the prototypes
         face_image.delete()
-        # Recalculate average embedding
-        face_images = student.face_images.all()
-        embeddings = [img.embedding for img in face_images if img.embedding]
-        if embeddings:
-            avg_embedding = np.mean(embeddings, axis=0).tolist()
-            face_embedding = student.face_embedding
-            face_embedding.avg_embedding = avg_embedding
-            face_embedding.num_samples = len(embeddings)
-            face_embedding.save()
         return Response({"message": "Image removed successfully."}, status=status.HTTP_200_OK)
 
 # List a student’s face images
@@ -135,9 +208,10 @@ class StudentFaceImagesView(ListAPIView):
         return student.face_images.all()
 
 
-class MarkAttendanceView(GenericAPIView):
+class MarkAttendanceView(StageTimingMixin, GenericAPIView):
     permission_classes = [IsAuthenticated, TeacherOrAdminPermission]
     serializer_class = MarkAttendanceSerializer
+    timing_endpoint = 'mark'
 
     def post(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
@@ -147,82 +221,29 @@ class MarkAttendanceView(GenericAPIView):
             today = date.today()
             recognized_student_ids = set()
 
-            # Process each uploaded image for face recognition
-            for image_file in images:
-                # Convert uploaded image to a format suitable for face detection
-                image = Image.open(image_file).convert('RGB')
-                image = cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR)
-                faces = app.get(image)  # Detect all faces in the image
-
+            # Convert uploaded images to a format suitable for face detection,
+            # decoding them in parallel on the shared pool
+            with stage('decode'):
+                decoded_images = map_parallel(decode_upload, images)
+            # Detect faces in every image (crops share recognition batches;
+            # photos seen before come from the detection cache), then match
+            # them all at once
+            detections = []
+            with stage('detect'):
+                faces_per_image = get_upload_faces(images, decoded_images, settings.FACE_DECODE_MAX_SIDE)
+            for image, faces in zip(decoded_images, faces_per_image):
                 for face in faces:
-                    embedding = face.normed_embedding.tolist()
-                    bbox = face.bbox.astype(int)
-                    # Get image dimensions
-                    h, w = image.shape[:2]
-                    # Clip bounding box coordinates to image boundaries
-                    left = max(0, bbox[0])
-                    top = max(0, bbox[1])
-                    right = min(w, bbox[2])
-                    bottom = min(h, bbox[3])
-                    # Check if the cropped region would be empty
-                    if right <= left or bottom <= top:
-                        continue  # Skip this face
-                    # Crop the face using the validated bounding box
-                    cropped = image[top:bottom, left:right]
-                    cropped_pil = Image.fromarray(cv2.cvtColor(cropped, cv2.COLOR_BGR2RGB))
-
-                    students = StudentProfile.objects.filter(face_embedding__isnull=False)
-                    best_match = None
-                    highest_similarity = 0
-
-                    # Find the best match among enrolled students
-                    for student in students:
-                        avg_embedding = student.face_embedding.avg_embedding
-                        if avg_embedding:
-                            similarity = cosine_similarity([embedding], [avg_embedding])[0][0]
-                            if similarity > highest_similarity:
-                                highest_similarity = similarity
-                                best_match = student
-
-                    # Process based on similarity
-                    if best_match and highest_similarity >= SIMILARITY_THRESHOLD:  # 0.4 or higher
-                        # Mark attendance
-                        recognized_student_ids.add(best_match.id)
-                        
-                        if highest_similarity >= HIGH_CONFIDENCE_THRESHOLD:  # 0.9 or higher
-                            # High confidence: update embedding automatically
-                            update_embedding_with_new_face(best_match, embedding)
-                        else:  # Between 0.4 and 0.9
-                            # Medium confidence: save for admin review
-                            filename = f'review_{uuid.uuid4()}.jpg'
-                            image_file_review = save_pil_image_to_file(cropped_pil, filename)
-                            ReviewFace.objects.create(
-                                suggested_student=best_match,
-                                image=image_file_review,
-                                embedding=embedding,
-                                similarity=highest_similarity
-                            )
-                    else:
-                        # No match or similarity < 0.4: save as unrecognized
-                        filename = f'unrecognized_{uuid.uuid4()}.jpg'
-                        image_file_unrec = save_pil_image_to_file(cropped_pil, filename)
-                        UnrecognizedFace.objects.create(
-                            image=image_file_unrec,
-                            embedding=embedding
-                        )
+                    box = clip_face_box(face, image)
+                    if box is None:
+                        continue  # Skip faces whose crop would be empty
+                    detections.append((image, box, face.normed_embedding))
+            count_faces(len(detections))
+
+            school_class = serializer.validated_data.get('school_class')
+            match_detected_faces(detections, recognized_student_ids, school_class_id=school_class.id if school_class else None)
 
             # Mark attendance for recognized students using the attendance app's model
-            for student_id in recognized_student_ids:
-                student = StudentProfile.objects.get(id=student_id)
-                CentralAttendanceRecord.objects.get_or_create(
-                    student=student,  # Assumes StudentProfile has a 'user' field linked to User
-                    date=today,
-                    defaults={
-                        'status': 'present' if status_input == 'onTime' else 'late',
-                        'recorded_by': None,  # Automated marking, no specific user
-                        'note': 'Marked via facial recognition'
-                    }
-                )
+            mark_recognized_students(recognized_student_ids, status_input, today, 'Marked via facial recognition')
 
             # Return success response
             return Response({
@@ -276,7 +297,62 @@ class AssignUnrecognizedFaceView(GenericAPIView):
                     status=status.HTTP_200_OK
                 )
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
-    
+
+class UnrecognizedFaceClusterPagination(PageNumberPagination):
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+# List clusters of unassigned unrecognized faces, largest first
+class UnrecognizedFaceClusterListView(ListAPIView):
+    permission_classes = [IsAuthenticated, TeacherOrAdminPermission]
+    serializer_class = UnrecognizedFaceClusterSerializer
+    pagination_class = UnrecognizedFaceClusterPagination
+
+    def get_queryset(self):
+        open_faces = UnrecognizedFace.objects.filter(OPEN_FACES).select_related('identified_student__user')
+        return (
+            UnrecognizedFaceCluster.objects
+            .annotate(face_count=Count('faces', filter=Q(faces__identified_student__isnull=True, faces__discarded=False)))
+            .filter(face_count__gt=0)
+            .prefetch_related(Prefetch('faces', queryset=open_faces, to_attr='open_faces'))
+            .order_by('-face_count', '-updated_at')
+        )
+
+# Assign every open face of a cluster to one student
+class AssignUnrecognizedFaceClusterView(GenericAPIView):
+    permission_classes = [IsAuthenticated, TeacherOrAdminPermission]
+    serializer_class = AssignUnrecognizedFaceClusterSerializer
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        if serializer.is_valid():
+            cluster = get_object_or_404(UnrecognizedFaceCluster, pk=serializer.validated_data['cluster_id'])
+            student = get_object_or_404(StudentProfile, pk=serializer.validated_data['student_id'])
+            exclude_face_ids = serializer.validated_data['exclude_face_ids']
+
+            with transaction.atomic():
+                open_faces = cluster.faces.select_for_update().filter(OPEN_FACES)
+                # Faces the admin left out go back to the pool for the next re-clustering
+                open_faces.filter(id__in=exclude_face_ids).update(cluster=None)
+                faces = [face for face in open_faces.exclude(id__in=exclude_face_ids) if face.embedding is not None]
+                if not faces:
+                    return Response({"error": "Cluster has no faces left to assign."}, status=status.HTTP_400_BAD_REQUEST)
+
+                UnrecognizedFace.objects.filter(id__in=[face.id for face in faces]).update(identified_student=student)
+                # One running-average update for the whole cluster
+                update_embedding_with_new_faces(student, [face.embedding for face in faces])
+                FaceImage.objects.bulk_create([
+                    FaceImage(student=student, image=face.image, embedding=face.embedding) for face in faces
+                ])
+
+            return Response(
+                {"message": f"{len(faces)} faces assigned, embedding updated, and images added to student's photos.",
+                 "assigned_faces": len(faces)},
+                status=status.HTTP_200_OK
+            )
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
 # List review faces
 class ReviewFaceListView(ListAPIView):
     permission_classes = [IsAuthenticated, TeacherOrAdminPermission]
@@ -314,9 +390,9 @@ class ConfirmReviewFaceView(GenericAPIView):
                         # Move the FaceImage to the new student
                         face.face_image.student = confirmed_student
                         face.face_image.save()
-                        # Recalculate embeddings
-                        recalculate_embedding(old_student)
-                        recalculate_embedding(confirmed_student)
+                        # Move the face's embedding between the running sums
+                        remove_face_embeddings(old_student, [face.face_image.embedding])
+                        add_face_embeddings(confirmed_student, [face.face_image.embedding])
                     else:
                         # Shouldn’t happen, but create FaceImage if missing
                         face_image = FaceImage.objects.create(
@@ -325,7 +401,7 @@ class ConfirmReviewFaceView(GenericAPIView):
                             embedding=face.embedding
                         )
                         face.face_image = face_image
-                        recalculate_embedding(confirmed_student)
+                        add_face_embeddings(confirmed_student, [face_image.embedding])
                 else:
                     # First confirmation or same student
                     if not face.face_image:
@@ -335,7 +411,7 @@ class ConfirmReviewFaceView(GenericAPIView):
                             embedding=face.embedding
                         )
                         face.face_image = face_image
-                        recalculate_embedding(confirmed_student)
+                        add_face_embeddings(confirmed_student, [face_image.embedding])
                     # If face_image exists, no action needed unless student changed
 
                 face.confirmed_student = confirmed_student
@@ -344,9 +420,9 @@ class ConfirmReviewFaceView(GenericAPIView):
 
             elif action == 'discard':
                 if face.face_image:
-                    student = face.face_image.student
+                    # The post_delete signal takes the face out of the student's embedding
                     face.face_image.delete()
-                    recalculate_embedding(student)
+                    face.face_image = None
                 face.discarded = True
                 face.save()
                 return Response({"message": "Review face discarded."}, status=200)
@@ -356,169 +432,234 @@ class ConfirmReviewFaceView(GenericAPIView):
 
 import logging
 import traceback
-import os
+import time
+from itertools import islice
+from .video import iter_sampled_frames
+from .tracking import FaceTracker
 
 logger = logging.getLogger(__name__)
 
-class MarkAttendanceVideoView(GenericAPIView):
+# Upper bound and polling step for ?wait= on the video job endpoint
+JOB_LONG_POLL_MAX_SECONDS = 30
+JOB_LONG_POLL_INTERVAL_SECONDS = 0.5
+# Sampled video frames sent to the detector together
+VIDEO_DETECTION_CHUNK_FRAMES = 8
+
+# Readiness probe: loads the model in this worker (or checks the shared
+# inference server is answering) before the worker takes traffic. Probes
+# call it anonymously and only get the status code; admins also get details.
+class ModelReadinessView(APIView):
+    permission_classes = [AllowAny]
+
+    def get(self, request, *args, **kwargs):
+        if is_model_loaded():
+            return self._respond(request, {"ready": True}, status.HTTP_200_OK)
+        try:
+            if settings.FACE_INFERENCE_SOCKET:
+                get_faces(np.zeros((64, 64, 3), dtype=np.uint8))
+                return self._respond(request, {"ready": True, "inference_server": settings.FACE_INFERENCE_SOCKET}, status.HTTP_200_OK)
+            load_seconds = warmup()
+        except Exception as e:
+            logger.error(f"Face model warmup failed: {str(e)}")
+            return self._respond(request, {"ready": False, "error": str(e)}, status.HTTP_503_SERVICE_UNAVAILABLE)
+        return self._respond(request, {"ready": True, "load_seconds": round(load_seconds, 2)}, status.HTTP_200_OK)
+
+    def _respond(self, request, details, status_code):
+        if AdminOnlyPermission().has_permission(request, self):
+            return Response(details, status=status_code)
+        return Response(status=status_code)
+
+# Per-stage timings and gallery size of this worker process, in Prometheus
+# text format for admins; each worker keeps its own, so scrape them one by one
+class FaceMetricsView(APIView):
+    permission_classes = [IsAuthenticated, AdminOnlyPermission]
+
+    def get(self, request, *args, **kwargs):
+        return HttpResponse(render_metrics(len(face_gallery)), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+class VideoProcessingError(Exception):
+    """A video that can't be used for attendance (unreadable, too short, ...)."""
+
+def save_video_upload(video_file):
+    # Save video file temporarily to disk
+    temp_video_path = f"/tmp/{uuid.uuid4()}.mp4"
+    logger.info(f"Saving video to: {temp_video_path}")
+    with open(temp_video_path, 'wb') as f:
+        for chunk in video_file.chunks():
+            f.write(chunk)
+    return temp_video_path
+
+def process_attendance_video(temp_video_path, status_input, progress=None, school_class_id=None):
+    """
+    Sample frames from a saved video, recognize the faces in them and mark
+    attendance. Returns the set of recognized student ids. If given,
+    progress(frames_done, frames_total, faces_found) is called as work advances,
+    and faces are matched against the students of school_class_id first.
+    """
+    recognized_student_ids = set()
+
+    # Open video with OpenCV
+    logger.info("Opening video with cv2.VideoCapture")
+    cap = cv2.VideoCapture(temp_video_path)
+    try:
+        if not cap.isOpened():
+            raise VideoProcessingError("Unable to open video file.")
+
+        # Get video properties
+        frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        logger.info(f"Video properties: frame_count={frame_count}, fps={fps}, sampling={settings.VIDEO_SAMPLING_POLICY}")
+
+        frames = iter_sampled_frames(
+            cap,
+            policy=settings.VIDEO_SAMPLING_POLICY,
+            every_n=settings.VIDEO_SAMPLE_EVERY_N_FRAMES,
+            samples_per_second=settings.VIDEO_SAMPLES_PER_SECOND,
+            scene_threshold=settings.VIDEO_SCENE_CHANGE_THRESHOLD,
+            max_frames=settings.VIDEO_MAX_SAMPLED_FRAMES,
+            max_side=settings.VIDEO_MAX_FRAME_SIDE,
+        )
+
+        # Detect faces a chunk of frames at a time while decoding continues and
+        # link them into tracks, so only one chunk of frames (plus one crop per
+        # track) is held in memory
+        tracker = FaceTracker(
+            iou_threshold=settings.VIDEO_TRACK_IOU_THRESHOLD,
+            similarity_threshold=settings.VIDEO_TRACK_SIMILARITY_THRESHOLD,
+            max_gap=settings.VIDEO_TRACK_MAX_GAP,
+        )
+        detection_count = 0
+        frames_sampled = 0
+        frames_done = 0
+        while True:
+            with stage('decode'):
+                chunk = list(islice(frames, VIDEO_DETECTION_CHUNK_FRAMES))
+            if not chunk:
+                break
+            frames_sampled += len(chunk)
+            with stage('detect'):
+                faces_per_frame = get_faces_batch([frame for _, frame in chunk])
+            for (idx, frame), faces in zip(chunk, faces_per_frame):
+                logger.info(f"Found {len(faces)} faces in frame {idx}")
+                frame_faces = []
+                for face in faces:
+                    box = clip_face_box(face, frame)
+                    if box is None:
+                        logger.warning(f"Invalid bounding box for face in frame {idx}")
+                        continue
+                    left, top, right, bottom = box
+                    frame_faces.append((frame[top:bottom, left:right], box, face.normed_embedding, face.det_score))
+                with stage('track'):
+                    tracker.update(frame_faces)
+                detection_count += len(frame_faces)
+            frames_done = chunk[-1][0] + 1
+            if progress:
+                progress(frames_done, max(frame_count, frames_done), len(tracker))
+    finally:
+        cap.release()
+
+    if not frames_sampled:
+        raise VideoProcessingError("No frames could be read from the video.")
+    logger.info(f"Sampled {frames_sampled} of {frames_done} decoded frames; {detection_count} faces in {len(tracker)} tracks")
+    if progress:
+        progress(frames_done, frames_done, len(tracker))
+
+    # Match each track once, by its mean embedding and its best crop
+    detections = [
+        (track.crop, (0, 0, track.crop.shape[1], track.crop.shape[0]), track.embedding)
+        for track in tracker.tracks
+    ]
+    count_faces(len(detections))
+    match_detected_faces(detections, recognized_student_ids, school_class_id=school_class_id)
+
+    # Mark attendance for recognized students
+    mark_recognized_students(recognized_student_ids, status_input, date.today(), 'Marked via facial recognition (video)')
+
+    logger.info(f"Attendance marked for {len(recognized_student_ids)} students")
+    return recognized_student_ids
+
+class MarkAttendanceVideoView(StageTimingMixin, GenericAPIView):
     permission_classes = [IsAuthenticated, TeacherOrAdminPermission]
     serializer_class = MarkAttendanceVideoSerializer
+    timing_endpoint = 'mark_video'
 
     def post(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
         if serializer.is_valid():
             video_file = serializer.validated_data['video']
             status_input = serializer.validated_data['status']
-            today = date.today()
-            recognized_student_ids = set()
+            school_class = serializer.validated_data.get('school_class')
 
             try:
                 # Log video file details
                 logger.info(f"Received video: name={video_file.name}, size={video_file.size} bytes")
-
-                # Save video file temporarily to disk
-                temp_video_path = f"/tmp/{uuid.uuid4()}.mp4"
-                logger.info(f"Saving video to: {temp_video_path}")
-                with open(temp_video_path, 'wb') as f:
-                    for chunk in video_file.chunks():
-                        f.write(chunk)
-
-                # Verify file was written
-                if not os.path.exists(temp_video_path):
-                    logger.error(f"Temporary video file not created: {temp_video_path}")
-                    return Response({"error": "Failed to save video file."}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-
-                # Open video with OpenCV
-                logger.info("Opening video with cv2.VideoCapture")
-                cap = cv2.VideoCapture(temp_video_path)
-                if not cap.isOpened():
-                    logger.error(f"Failed to open video file: {temp_video_path}")
-                    cap.release()
-                    os.remove(temp_video_path)
-                    return Response({"error": "Unable to open video file."}, status=status.HTTP_400_BAD_REQUEST)
-
-                # Get video properties
-                frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-                fps = cap.get(cv2.CAP_PROP_FPS)
-                logger.info(f"Video properties: frame_count={frame_count}, fps={fps}")
-
-                if frame_count <= 0 or fps <= 0:
-                    logger.error("Invalid video: zero frames or invalid FPS")
-                    cap.release()
-                    os.remove(temp_video_path)
-                    return Response({"error": "Invalid video: zero frames or invalid FPS."}, status=status.HTTP_400_BAD_REQUEST)
-
-                # Calculate frame indices to extract (5 frames evenly spaced)
-                num_frames_to_extract = 5
-                if frame_count < num_frames_to_extract:
-                    logger.error(f"Video has too few frames: {frame_count}")
-                    cap.release()
-                    os.remove(temp_video_path)
-                    return Response({"error": "Video has too few frames."}, status=status.HTTP_400_BAD_REQUEST)
-
-                step = frame_count // num_frames_to_extract
-                frame_indices = [i * step for i in range(num_frames_to_extract)]
-                logger.info(f"Extracting frames at indices: {frame_indices}")
-
-                # Process each selected frame
-                for idx in frame_indices:
-                    logger.info(f"Processing frame {idx}")
-                    cap.set(cv2.CAP_PROP_POS_FRAMES, idx)
-                    ret, frame = cap.read()
-                    if not ret:
-                        logger.warning(f"Failed to read frame {idx}")
-                        continue
-
-                    # Convert frame to PIL Image for processing
-                    frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-                    pil_image = Image.fromarray(frame_rgb)
-
-                    # Detect faces in the frame
-                    logger.info(f"Detecting faces in frame {idx}")
-                    faces = app.get(frame)
-                    logger.info(f"Found {len(faces)} faces in frame {idx}")
-                    for face in faces:
-                        embedding = face.normed_embedding.tolist()
-                        bbox = face.bbox.astype(int)
-                        h, w = frame.shape[:2]
-                        left = max(0, bbox[0])
-                        top = max(0, bbox[1])
-                        right = min(w, bbox[2])
-                        bottom = min(h, bbox[3])
-                        if right <= left or bottom <= top:
-                            logger.warning(f"Invalid bounding box for face in frame {idx}")
-                            continue
-
-                        # Crop face
-                        cropped = frame[top:bottom, left:right]
-                        cropped_pil = Image.fromarray(cv2.cvtColor(cropped, cv2.COLOR_BGR2RGB))
-
-                        # Find best match
-                        students = StudentProfile.objects.filter(face_embedding__isnull=False)
-                        best_match = None
-                        highest_similarity = 0
-                        for student in students:
-                            avg_embedding = student.face_embedding.avg_embedding
-                            if avg_embedding:
-                                similarity = cosine_similarity([embedding], [avg_embedding])[0][0]
-                                if similarity > highest_similarity:
-                                    highest_similarity = similarity
-                                    best_match = student
-
-                        # Process based on similarity
-                        if best_match and highest_similarity >= SIMILARITY_THRESHOLD:
-                            recognized_student_ids.add(best_match.id)
-                            if highest_similarity >= HIGH_CONFIDENCE_THRESHOLD:
-                                update_embedding_with_new_face(best_match, embedding)
-                            else:
-                                filename = f'review_{uuid.uuid4()}.jpg'
-                                image_file_review = save_pil_image_to_file(cropped_pil, filename)
-                                ReviewFace.objects.create(
-                                    suggested_student=best_match,
-                                    image=image_file_review,
-                                    embedding=embedding,
-                                    similarity=highest_similarity
-                                )
-                        else:
-                            filename = f'unrecognized_{uuid.uuid4()}.jpg'
-                            image_file_unrec = save_pil_image_to_file(cropped_pil, filename)
-                            UnrecognizedFace.objects.create(
-                                image=image_file_unrec,
-                                embedding=embedding
-                            )
-
-                # Release video capture and clean up
-                cap.release()
-                if os.path.exists(temp_video_path):
+                with stage('upload'):
+                    temp_video_path = save_video_upload(video_file)
+                try:
+                    recognized_student_ids = process_attendance_video(
+                        temp_video_path, status_input, school_class_id=school_class.id if school_class else None
+                    )
+                finally:
                     os.remove(temp_video_path)
                     logger.info(f"Cleaned up temporary file: {temp_video_path}")
 
-                # Mark attendance for recognized students
-                for student_id in recognized_student_ids:
-                    student = StudentProfile.objects.get(id=student_id)
-                    CentralAttendanceRecord.objects.get_or_create(
-                        student=student,
-                        date=today,
-                        defaults={
-                            'status': 'present' if status_input == 'onTime' else 'late',
-                            'recorded_by': None,
-                            'note': 'Marked via facial recognition (video)'
-                        }
-                    )
-
-                logger.info(f"Attendance marked for {len(recognized_student_ids)} students")
                 return Response({
                     "message": f"Attendance marked for {len(recognized_student_ids)} students from video.",
                     "recognized_students": list(recognized_student_ids),
                     "status": status_input
                 }, status=status.HTTP_200_OK)
 
+            except VideoProcessingError as e:
+                logger.error(f"Rejected video: {str(e)}")
+                return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
             except Exception as e:
                 logger.error(f"Error processing video: {str(e)}\n{traceback.format_exc()}")
-                if 'cap' in locals():
-                    cap.release()
-                if 'temp_video_path' in locals() and os.path.exists(temp_video_path):
-                    os.remove(temp_video_path)
                 return Response({"error": f"Error processing video: {str(e)}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
\ No newline at end of file
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+# Submit a video for background processing; returns a job id right away
+class VideoAttendanceJobCreateView(GenericAPIView):
+    permission_classes = [IsAuthenticated, TeacherOrAdminPermission]
+    serializer_class = MarkAttendanceVideoSerializer
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        if serializer.is_valid():
+            video_file = serializer.validated_data['video']
+            logger.info(f"Received video job: name={video_file.name}, size={video_file.size} bytes")
+            temp_video_path = save_video_upload(video_file)
+            job = VideoAttendanceJob.objects.create(
+                submitted_by=request.user,
+                attendance_status=serializer.validated_data['status'],
+                school_class=serializer.validated_data.get('school_class'),
+            )
+            submit_video_job(job, temp_video_path)
+            return Response(VideoAttendanceJobSerializer(job).data, status=status.HTTP_202_ACCEPTED)
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+# Poll a video job; ?wait=<seconds> long-polls until its status or progress changes
+class VideoAttendanceJobDetailView(RetrieveAPIView):
+    permission_classes = [IsAuthenticated, TeacherOrAdminPermission]
+    serializer_class = VideoAttendanceJobSerializer
+
+    def get_queryset(self):
+        if self.request.user.role == 'admin':
+            return VideoAttendanceJob.objects.all()
+        return VideoAttendanceJob.objects.filter(submitted_by=self.request.user)
+
+    def retrieve(self, request, *args, **kwargs):
+        job = self.get_object()
+        try:
+            wait = min(float(request.query_params.get('wait', 0)), JOB_LONG_POLL_MAX_SECONDS)
+        except ValueError:
+            return Response({"error": "wait must be a number of seconds."}, status=status.HTTP_400_BAD_REQUEST)
+
+        deadline = time.monotonic() + wait
+        seen = (job.status, job.frames_done, job.faces_found)
+        while job.status in ('queued', 'processing') and time.monotonic() < deadline:
+            time.sleep(JOB_LONG_POLL_INTERVAL_SECONDS)
+            job.refresh_from_db()
+            if (job.status, job.frames_done, job.faces_found) != seen:
+                break
+        return Response(self.get_serializer(job).data, status=status.HTTP_200_OK)
@@ -0,0 +1,108 @@
+import logging
+import time
+import uuid
+from collections import namedtuple
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import transaction
+from .clustering import assign_to_clusters
+from .imaging import encode_jpeg
+from .inference import SharedPool
+from .metrics import observe_stage
+from .models import ReviewFace, UnrecognizedFace
+
+logger = logging.getLogger(__name__)
+
+# Crops waiting to be stored; crop is a BGR array
+PendingReviewFace = namedtuple('PendingReviewFace', ['crop', 'student_id', 'embedding', 'similarity'])
+PendingUnrecognizedFace = namedtuple('PendingUnrecognizedFace', ['crop', 'embedding'])
+
+# Same JPEG quality PIL used when crops were saved in the request
+CROP_JPEG_QUALITY = 75
+
+_pool = SharedPool(
+    'face-writer', lambda: settings.FACE_WRITER_WORKERS, max_pending=lambda: settings.FACE_WRITER_MAX_PENDING
+)
+
+
+def submit_face_crops(reviews, unrecognized):
+    """
+    Store review and unrecognized face crops off the request path. Once the
+    surrounding transaction (if any) commits, the batch goes to the writer
+    pool, which encodes the JPEGs, saves them and bulk-creates the rows.
+    Submitting blocks while FACE_WRITER_MAX_PENDING batches are queued, so
+    a slow storage backend can't grow the queue without bound. With
+    FACE_WRITER_WORKERS = 0 the batch is written inline instead.
+    """
+    if not reviews and not unrecognized:
+        return
+    if not settings.FACE_WRITER_WORKERS:
+        transaction.on_commit(lambda: write_face_crops(reviews, unrecognized))
+        return
+
+    transaction.on_commit(lambda: _pool.submit(write_face_crops, reviews, unrecognized))
+
+
+def _with_retries(action, description):
+    attempts = settings.FACE_WRITER_RETRIES + 1
+    for attempt in range(1, attempts + 1):
+        try:
+            return action()
+        except Exception:
+            if attempt == attempts:
+                raise
+            logger.warning(f"{description} failed (attempt {attempt} of {attempts}), retrying", exc_info=True)
+            time.sleep(settings.FACE_WRITER_RETRY_DELAY * 2 ** (attempt - 1))
+
+
+def _store_crop(model, prefix, crop):
+    name = model._meta.get_field('image').generate_filename(None, f'{prefix}_{uuid.uuid4()}.jpg')
+    content = encode_jpeg(crop, name, quality=CROP_JPEG_QUALITY)
+    return _with_retries(lambda: default_storage.save(name, content), f"Storing {name}")
+
+
+def write_face_crops(reviews, unrecognized):
+    start = time.perf_counter()
+    try:
+        _write_face_crops(reviews, unrecognized)
+    finally:
+        observe_stage('face_writer', 'crops', time.perf_counter() - start)
+
+
+def _write_face_crops(reviews, unrecognized):
+    review_rows, unrecognized_rows = [], []
+    for face in reviews:
+        try:
+            image = _store_crop(ReviewFace, 'review', face.crop)
+        except Exception:
+            logger.exception(f"Dropped review face for student {face.student_id}: crop could not be stored")
+            continue
+        review_rows.append(ReviewFace(
+            suggested_student_id=face.student_id, image=image, embedding=face.embedding, similarity=face.similarity
+        ))
+    for face in unrecognized:
+        try:
+            image = _store_crop(UnrecognizedFace, 'unrecognized', face.crop)
+        except Exception:
+            logger.exception("Dropped unrecognized face: crop could not be stored")
+            continue
+        unrecognized_rows.append(UnrecognizedFace(image=image, embedding=face.embedding))
+
+    def create_rows():
+        with transaction.atomic():
+            ReviewFace.objects.bulk_create(review_rows)
+            return UnrecognizedFace.objects.bulk_create(unrecognized_rows)
+
+    try:
+        created = _with_retries(create_rows, "Saving face crop rows")
+    except Exception:
+        logger.exception(
+            f"Dropped {len(review_rows)} review and {len(unrecognized_rows)} unrecognized face rows; "
+            f"their images remain in storage: {[row.image.name for row in review_rows + unrecognized_rows]}"
+        )
+        return
+    try:
+        # Group the new unknown faces with earlier ones for bulk review
+        _with_retries(lambda: assign_to_clusters(created), "Clustering new unrecognized faces")
+    except Exception:
+        logger.exception("Could not cluster new unrecognized faces; cluster_unrecognized_faces will group them")
@@ -130,19 +130,22 @@ class LeaveRequestUpdateView(GenericAPIView):
         Create attendance records for the approved leave days.
         """
         from attendance.models import AttendanceRecord
+        from attendance.utils import upsert_attendance_records
 
         start_date = leave_request.start_date
         end_date = leave_request.end_date
         student = leave_request.student
 
-        # Iterate through each day in the leave period
+        # One record per day in the leave period, replacing any already marked
+        records = []
         current_date = start_date
         while current_date <= end_date:
-            AttendanceRecord.objects.create(
+            records.append(AttendanceRecord(
                 student=student,
                 date=current_date,
                 status='leave',  # Use the 'Leave Approved' status
                 note=f"Leave approved for reason: {leave_request.reason}",
                 recorded_by=None  # Optional: Set the admin user if needed
-            )
-            current_date += timedelta(days=1)
\ No newline at end of file
+            ))
+            current_date += timedelta(days=1)
+        upsert_attendance_records(records)
\ No newline at end of file